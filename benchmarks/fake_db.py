@@ -0,0 +1,222 @@
+"""
+In-memory stand-in for the monitoring postgresql database, so the monitoring
+path can be benchmarked(and tested) without running postgres.
+
+The server factories install it before creating the app, e.g.:
+    gunicorn -c deployment/gunicorn.conf.py "benchmarks.fake_db:create_app()"
+    uvicorn --factory benchmarks.fake_db:create_asgi_app
+"""
+
+import re
+import time
+import threading
+from contextlib import contextmanager
+
+from psycopg2 import errors, errorcodes
+
+from utils import getenv
+
+FAKE_DB_LATENCY_MS = float(getenv("FAKE_DB_LATENCY_MS", "2"))
+
+
+class FakeCursor:
+    """psycopg2 cursor whose queries go to the fake database"""
+
+    def __init__(self, fake_db: "FakeDatabase"):
+        self.fake_db = fake_db
+        self.description = None
+        self._rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+    def execute(self, q, q_args=None):
+        self._rows = self.fake_db.run_query(q, q_args)
+        self.description = None if self._rows is None else ()
+
+    def copy_expert(self, sql, file):
+        self.fake_db.copy(sql, file)
+
+    def fetchall(self):
+        return self._rows
+
+
+class FakeConnection:
+    """psycopg2 connection handed out by the fake database"""
+
+    closed = 0
+
+    def __init__(self, fake_db: "FakeDatabase"):
+        self.fake_db = fake_db
+
+    def cursor(self):
+        return FakeCursor(self.fake_db)
+
+    def commit(self):
+        self.fake_db.num_commits += 1
+
+    def rollback(self):
+        pass
+
+
+class FakeDatabase:
+    """
+    Answers the queries made by the monitoring code the way postgres would,
+    after sleeping `latency_ms` to stand in for the round trip. It has the
+    interface of monitoring.db.ConnectionPool so it can replace the pool.
+    """
+
+    def __init__(self, latency_ms: float = 2):
+        self.latency_s = latency_ms / 1000
+        self.tables = {}
+        self.num_queries = 0
+        self.num_commits = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        yield FakeConnection(self)
+
+    def close(self):
+        pass
+
+    def num_rows(self, table: str) -> int:
+        return self.tables.get(table, {}).get("num_rows", 0)
+
+    def run_query(self, q, q_args=None):  # pylint: disable=unused-argument
+        time.sleep(self.latency_s)
+        with self._lock:
+            self.num_queries += 1
+            return self._run_query(" ".join(q.split()))
+
+    def copy(self, sql: str, file):
+        """COPY ... FROM STDIN of csv rows"""
+        time.sleep(self.latency_s)
+        with self._lock:
+            self.num_queries += 1
+            table = re.match(r"copy (\w+)", sql, re.I).group(1)
+            if table not in self.tables:
+                raise errors.lookup(errorcodes.UNDEFINED_TABLE)(
+                    f'relation "{table}" does not exist'
+                )
+            num_rows = sum(1 for line in file.read().splitlines() if line != "")
+            if num_rows > 0 and len(self.tables[table].get("partitions", [None])) == 0:
+                raise errors.lookup(errorcodes.CHECK_VIOLATION)(
+                    f'no partition of relation "{table}" found for row'
+                )
+            self.tables[table]["num_rows"] += num_rows
+
+    def _run_query(self, q: str):
+        q_lower = q.lower()
+        if "pg_advisory_xact_lock" in q_lower:
+            return [("",)]
+
+        if "pg_inherits" in q_lower:
+            # only the predictions table is partitioned
+            return [(table,) for table, info in self.tables.items() if "parent" in info]
+
+        if q_lower.startswith("create index"):
+            return None
+
+        if "partition of" in q_lower:
+            match = re.match(
+                r"create table (?:if not exists )?(\w+) partition of (\w+)", q, re.I
+            )
+            table, parent = match.group(1), match.group(2)
+            if table not in self.tables:
+                self.tables[table] = {"columns": [], "num_rows": 0, "parent": parent}
+                self.tables[parent]["partitions"].append(table)
+            return None
+
+        if "information_schema.columns" in q_lower:
+            table = re.search(r"table_name = '(\w+)'", q).group(1)
+            columns = self.tables.get(table, {}).get("columns", [])
+            return [(col,) for col in columns]
+
+        if q_lower.startswith("create table"):
+            match = re.match(
+                r"create table (?:if not exists )?(\w+)\s*\((.*?)\)\s*"
+                r"(partition by \w+ \(\w+\))?;?$",
+                q,
+                re.I,
+            )
+            table, columns_str = match.group(1), match.group(2)
+            if table not in self.tables:
+                columns = [
+                    column.split()[0].strip('"') for column in columns_str.split(",")
+                ]
+                self.tables[table] = {"columns": columns, "num_rows": 0}
+                if match.group(3) is not None:
+                    self.tables[table]["partitions"] = []
+            return None
+
+        if q_lower.startswith("alter table"):
+            table = re.search(r"alter table (?:if exists )?(\w+)", q, re.I).group(1)
+            added_columns = re.findall(r"add column (?:if not exists )?(\S+)", q, re.I)
+            columns = self.tables[table]["columns"]
+            for column in added_columns:
+                if column.strip('"') not in columns:
+                    columns.append(column.strip('"'))
+            return None
+
+        if q_lower.startswith("insert into"):
+            match = re.match(r"insert into (\w+)(?: as \w+)?\s*\(([^)]*)\)", q, re.I)
+            table, columns_str = match.group(1), match.group(2)
+            if table not in self.tables:
+                raise errors.lookup(errorcodes.UNDEFINED_TABLE)(
+                    f'relation "{table}" does not exist'
+                )
+            for column in columns_str.split(","):
+                column = column.strip().strip('"')
+                if column not in self.tables[table]["columns"]:
+                    raise errors.lookup(errorcodes.UNDEFINED_COLUMN)(
+                        f'column "{column}" of relation "{table}" does not exist'
+                    )
+            # one "(...)" of values per row
+            self.tables[table]["num_rows"] += q.count("), (") + 1
+            return None
+
+        if q_lower.startswith(("truncate", "drop")):
+            table = q.rstrip(";").split()[-1]
+            if q_lower.startswith("drop"):
+                info = self.tables.pop(table, None) or {}
+                # dropping a partitioned table drops its partitions
+                for partition in info.get("partitions", []):
+                    self.tables.pop(partition, None)
+                if info.get("parent") in self.tables:
+                    self.tables[info["parent"]]["partitions"].remove(table)
+            elif table in self.tables:
+                self.tables[table]["num_rows"] = 0
+            return None
+
+        raise NotImplementedError(f"the fake database doesn't support: {q}")
+
+
+def install(latency_ms: float = FAKE_DB_LATENCY_MS) -> FakeDatabase:
+    """route the queries of the monitoring code to a new FakeDatabase"""
+    # pylint: disable=import-outside-toplevel
+    from monitoring import db
+
+    fake_db = FakeDatabase(latency_ms)
+    db.set_pool(fake_db)
+    print(f"using a fake monitoring database with {latency_ms}ms latency")
+    return fake_db
+
+
+def create_app():
+    # pylint: disable=import-outside-toplevel
+    from deployment import main
+
+    install()
+    return main.create_app()
+
+
+def create_asgi_app():
+    # pylint: disable=import-outside-toplevel
+    from deployment import asgi
+
+    install()
+    return asgi.create_asgi_app()
@@ -0,0 +1,465 @@
+"""
+HTTP load test of the prediction service, reports throughput and latency
+percentiles of /predict and saves them as json so runs can be compared.
+
+usage:
+    # app served from this process(werkzeug, threaded)
+    python -m benchmarks.load_test --server inprocess --concurrency 1,8 --batch-sizes 1,100
+
+    # gunicorn/uvicorn in a subprocess, with the drift monitoring on and off
+    python -m benchmarks.load_test --server gunicorn --monitoring off,on
+
+    # replay captured requests(one json body per line) against a running server
+    python -m benchmarks.load_test --url http://localhost:8080 --replay requests.jsonl
+
+    # compare with an earlier run
+    python -m benchmarks.load_test --compare artifacts/benchmarks/<earlier run>.json
+
+The monitoring database is replaced by benchmarks.fake_db unless --db postgres
+is passed. Servers started by the benchmark use MODEL_DIR(default the
+integration test model).
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import datetime
+import platform
+import threading
+import subprocess
+from pathlib import Path
+from urllib.parse import urlparse
+from http.client import HTTPConnection
+from typing import List, Tuple, Optional
+
+import numpy as np
+
+from deployment.formats import NPY_MIMETYPE, ARROW_MIMETYPE, MSGPACK_MIMETYPES
+
+FORMATS = ("json", "columnar", "npy", "arrow", "msgpack")
+SERVERS = ("inprocess", "gunicorn", "asgi")
+BENCHMARK_DIR = Path("artifacts/benchmarks/")
+DEFAULT_MODEL_DIR = "integration-tests/model/"
+# distinct payloads per format and batch size, so the prediction cache(if on)
+# doesn't answer everything
+NUM_PAYLOADS = 64
+
+Payload = Tuple[bytes, str]
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def get_json(url: str, path: str) -> dict:
+    parsed_url = urlparse(url)
+    conn = HTTPConnection(parsed_url.hostname, parsed_url.port, timeout=5)
+    try:
+        conn.request("GET", path)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def wait_for_server(url: str, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            return get_json(url, "/stats/model")
+        except (OSError, ValueError):
+            time.sleep(0.5)
+    raise TimeoutError(f"server at {url} didn't start in {timeout}s")
+
+
+class InProcessServer:
+    """the flask app served by werkzeug from a thread of this process"""
+
+    def __init__(self, monitoring: bool, db: str):
+        # pylint: disable=import-outside-toplevel
+        from werkzeug.serving import make_server
+
+        from benchmarks import fake_db
+        from deployment import service
+        from deployment.main import create_app
+
+        if monitoring and db == "fake":
+            fake_db.install()
+        # the flag is read by the service on every request, so it can be switched here
+        service.LOG_TO_DB_FLAG = monitoring
+
+        # werkzeug logs every request otherwise
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        self.app = create_app()
+        self.port = get_free_port()
+        self.server = make_server("localhost", self.port, self.app, threaded=True)
+        self.url = f"http://localhost:{self.port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        wait_for_server(self.url)
+        return self
+
+    def __exit__(self, *_):
+        self.server.shutdown()
+        prediction_service = self.app.config["PREDICTION_SERVICE"]
+        prediction_service.monitoring_worker.stop(timeout=5)
+        if prediction_service.metrics_buffer is not None:
+            prediction_service.metrics_buffer.stop(timeout=5)
+
+
+class SubprocessServer:
+    """gunicorn or uvicorn(asgi) started the same way as in the docker image"""
+
+    def __init__(self, server: str, monitoring: bool, db: str):
+        self.port = get_free_port()
+        self.url = f"http://localhost:{self.port}"
+        app_module = "benchmarks.fake_db" if monitoring and db == "fake" else None
+
+        if server == "gunicorn":
+            app = f"{app_module or 'deployment.main'}:create_app()"
+            self.cmd = ["gunicorn", "-c", "deployment/gunicorn.conf.py", app]
+        else:
+            app = f"{app_module or 'deployment.asgi'}:create_asgi_app"
+            self.cmd = ["uvicorn", "--factory", app, "--port", str(self.port)]
+
+        self.env = {
+            **os.environ,
+            "PORT": str(self.port),
+            "LOG_TO_DB_FLAG": str(monitoring).lower(),
+            "MODEL_DIR": os.getenv("MODEL_DIR", DEFAULT_MODEL_DIR),
+        }
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(  # pylint: disable=consider-using-with
+            self.cmd,
+            env=self.env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        wait_for_server(self.url)
+        return self
+
+    def __exit__(self, *_):
+        self.process.terminate()
+        self.process.wait(timeout=60)
+
+
+class ExistingServer:
+    """an already running server(e.g. the docker compose one), left running at the end"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+
+    def __enter__(self):
+        wait_for_server(self.url, timeout=10)
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+
+def encode_payload(X: np.ndarray, numeric_cols: List[str], data_format: str) -> Payload:
+    columns = {col: X[:, j].tolist() for j, col in enumerate(numeric_cols)}
+    records = [dict(zip(numeric_cols, row)) for row in X.tolist()]
+
+    if data_format == "json":
+        return json.dumps(records).encode(), "application/json"
+    if data_format == "columnar":
+        return json.dumps(columns).encode(), "application/json"
+    if data_format == "npy":
+        buffer = io.BytesIO()
+        np.save(buffer, X, allow_pickle=False)
+        return buffer.getvalue(), NPY_MIMETYPE
+    if data_format == "arrow":
+        import pyarrow as pa  # pylint: disable=import-outside-toplevel
+
+        table = pa.table(columns)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes(), ARROW_MIMETYPE
+    if data_format == "msgpack":
+        import msgpack  # pylint: disable=import-outside-toplevel
+
+        return msgpack.packb(records), MSGPACK_MIMETYPES[0]
+    raise ValueError(f"Unsupported format: {data_format}, expected one of {FORMATS}")
+
+
+def make_payloads(
+    numeric_cols: List[str], data_format: str, batch_size: int, seed: int = 0
+) -> List[Payload]:
+    rng = np.random.default_rng(seed)
+    payloads = []
+    for _ in range(NUM_PAYLOADS):
+        X = np.round(rng.normal(size=(batch_size, len(numeric_cols))) * 20 + 40, 2)
+        payloads.append(encode_payload(X, numeric_cols, data_format))
+    return payloads
+
+
+def load_replay_payloads(replay_path: str) -> List[Payload]:
+    """
+    every line is either a json request body or {"body": ..., "content_type": ...}
+    """
+    payloads = []
+    with open(replay_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip() == "":
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict) and "body" in record:
+                body = record["body"]
+                if not isinstance(body, str):
+                    body = json.dumps(body)
+                content_type = record.get("content_type", "application/json")
+                payloads.append((body.encode(), content_type))
+            else:
+                payloads.append((line.strip().encode(), "application/json"))
+    return payloads
+
+
+def is_error_response(status: int, content_type: str, data: bytes) -> bool:
+    # the service answers invalid requests with a 200 and an "error" key
+    return status != 200 or (
+        content_type.startswith("application/json") and data.startswith(b'{"error"')
+    )
+
+
+def run_load(
+    url: str,
+    payloads: List[Payload],
+    concurrency: int,
+    duration: float,
+    warmup: float,
+) -> dict:
+    """send the payloads(round robin) from `concurrency` threads for `duration` seconds"""
+    parsed_url = urlparse(url)
+    start_time = time.perf_counter() + warmup
+    stop_time = start_time + duration
+    latencies, errors = [[] for _ in range(concurrency)], [0] * concurrency
+
+    def worker(i: int):
+        conn = HTTPConnection(parsed_url.hostname, parsed_url.port, timeout=30)
+        j = i
+        while True:
+            body, content_type = payloads[j % len(payloads)]
+            j += concurrency
+            request_start = time.perf_counter()
+            if request_start >= stop_time:
+                break
+            try:
+                conn.request(
+                    "POST", "/predict", body=body, headers={"Content-Type": content_type}
+                )
+                response = conn.getresponse()
+                data = response.read()
+                is_error = is_error_response(
+                    response.status, response.getheader("Content-Type", ""), data
+                )
+            except OSError:
+                conn.close()
+                conn = HTTPConnection(parsed_url.hostname, parsed_url.port, timeout=30)
+                is_error = True
+
+            # requests made during the warmup aren't counted
+            if request_start >= start_time:
+                latencies[i].append(time.perf_counter() - request_start)
+                errors[i] += is_error
+        conn.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies_ms = np.concatenate([np.array(values) for values in latencies]) * 1000
+    num_requests = len(latencies_ms)
+    if num_requests == 0:
+        return {"requests": 0, "errors": 0, "throughput_rps": 0.0}
+
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        "requests": num_requests,
+        "errors": int(sum(errors)),
+        "throughput_rps": num_requests / duration,
+        "latency_ms": {
+            "mean": float(latencies_ms.mean()),
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+            "max": float(latencies_ms.max()),
+        },
+    }
+
+
+def start_server(args: argparse.Namespace, monitoring: bool):
+    if args.url is not None:
+        return ExistingServer(args.url)
+    if args.server == "inprocess":
+        return InProcessServer(monitoring, args.db)
+    return SubprocessServer(args.server, monitoring, args.db)
+
+
+def run_benchmark(args: argparse.Namespace) -> List[dict]:
+    results = []
+    for monitoring in args.monitoring:
+        with start_server(args, monitoring) as server:
+            numeric_cols = get_json(server.url, "/stats/model")["numeric_cols"]
+
+            cases = []
+            if args.replay is not None:
+                cases.append(("replay", None, load_replay_payloads(args.replay)))
+            else:
+                for data_format in args.formats:
+                    for batch_size in args.batch_sizes:
+                        payloads = make_payloads(numeric_cols, data_format, batch_size)
+                        cases.append((data_format, batch_size, payloads))
+
+            for data_format, batch_size, payloads in cases:
+                for concurrency in args.concurrency:
+                    result = {
+                        "server": args.url or args.server,
+                        "monitoring": monitoring if args.url is None else None,
+                        "format": data_format,
+                        "batch_size": batch_size,
+                        "concurrency": concurrency,
+                        **run_load(
+                            server.url,
+                            payloads,
+                            concurrency,
+                            duration=args.duration,
+                            warmup=args.warmup,
+                        ),
+                    }
+                    if batch_size is not None:
+                        result["rows_per_s"] = result["throughput_rps"] * batch_size
+                    print_result(result)
+                    results.append(result)
+    return results
+
+
+def get_result_key(result: dict) -> tuple:
+    return (
+        result["server"],
+        result["monitoring"],
+        result["format"],
+        result["batch_size"],
+        result["concurrency"],
+    )
+
+
+def print_result(result: dict, previous: Optional[dict] = None):
+    latency = result.get("latency_ms", {})
+    line = (
+        f"{str(result['server']):>10} monitoring={str(result['monitoring']):<5} "
+        f"{result['format']:>8} batch={str(result['batch_size']):>6} "
+        f"concurrency={result['concurrency']:>3} "
+        f"{result['throughput_rps']:>9.1f} req/s "
+        f"p50={latency.get('p50', 0):>7.2f}ms p95={latency.get('p95', 0):>7.2f}ms "
+        f"p99={latency.get('p99', 0):>7.2f}ms errors={result['errors']}"
+    )
+    if previous is not None and previous["throughput_rps"] > 0:
+        throughput_change = result["throughput_rps"] / previous["throughput_rps"] - 1
+        p99_change = latency.get("p99", 0) / previous["latency_ms"]["p99"] - 1
+        line += f" | throughput {throughput_change:+.1%} p99 {p99_change:+.1%}"
+    print(line)
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(results: List[dict], args: argparse.Namespace) -> Path:
+    started_at = datetime.datetime.now()
+    output_path = args.output
+    if output_path is None:
+        output_path = BENCHMARK_DIR / f"load_test_{started_at:%Y%m%d_%H%M%S}.json"
+    output_path = Path(output_path)
+    os.makedirs(output_path.parent, exist_ok=True)
+
+    report = {
+        "created_at": started_at.isoformat(),
+        "git_commit": get_git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "model_dir": os.getenv("MODEL_DIR", DEFAULT_MODEL_DIR),
+        "args": {key: value for key, value in vars(args).items() if key != "compare"},
+        "results": results,
+    }
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return output_path
+
+
+def compare_results(results: List[dict], compare_path: str):
+    with open(compare_path, "r", encoding="utf-8") as f:
+        previous_results = {
+            get_result_key(result): result for result in json.load(f)["results"]
+        }
+
+    print(f"\ncompared with {compare_path}:")
+    for result in results:
+        previous = previous_results.get(get_result_key(result))
+        if previous is not None:
+            print_result(result, previous)
+
+
+def parse_list(value: str, value_type=str) -> list:
+    return [value_type(item) for item in value.split(",") if item.strip() != ""]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="load test of /predict")
+    parser.add_argument("--server", choices=SERVERS, default="inprocess")
+    parser.add_argument("--url", default=None, help="use an already running server")
+    parser.add_argument(
+        "--concurrency", type=lambda v: parse_list(v, int), default=[1, 8]
+    )
+    parser.add_argument(
+        "--batch-sizes", type=lambda v: parse_list(v, int), default=[1, 100]
+    )
+    parser.add_argument("--formats", type=parse_list, default=["json"])
+    parser.add_argument(
+        "--monitoring",
+        type=lambda v: [item == "on" for item in parse_list(v)],
+        default=[False],
+        help="comma separated on/off, runs everything once per value",
+    )
+    parser.add_argument("--db", choices=("fake", "postgres"), default="fake")
+    parser.add_argument("--replay", default=None, help="jsonl file of request bodies")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per case")
+    parser.add_argument("--warmup", type=float, default=1, help="seconds per case")
+    parser.add_argument("--output", default=None, help="json file for the results")
+    parser.add_argument("--compare", default=None, help="results json of an earlier run")
+    args = parser.parse_args(argv)
+
+    for data_format in args.formats:
+        if data_format not in FORMATS:
+            parser.error(f"unsupported format: {data_format}, expected one of {FORMATS}")
+    return args
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("MODEL_DIR", DEFAULT_MODEL_DIR)
+    args = parse_args()
+    results = run_benchmark(args)
+    output_path = save_results(results, args)
+    print(f"results saved to {output_path}")
+
+    if args.compare is not None:
+        compare_results(results, args.compare)
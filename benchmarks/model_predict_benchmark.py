@@ -0,0 +1,49 @@
+"""
+Microbenchmark of Model.predict using the compiled LinearScorer
+against the plain sklearn predict.
+
+usage:
+    python -m benchmarks.model_predict_benchmark --model-dir integration-tests/model/
+"""
+
+import timeit
+import argparse
+
+import numpy as np
+
+from src.model import Model
+
+BATCH_SIZES = [1, 10, 100, 1_000, 10_000]
+
+
+def time_per_call(fn, X: np.ndarray) -> float:
+    """returns the best time per call in microseconds"""
+    timer = timeit.Timer(lambda: fn(X))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=5, number=number)) / number * 1e6
+
+
+def run_benchmark(model: Model, batch_sizes: list):
+    assert model.scorer is not None, "the benchmark needs a linear model"
+    rng = np.random.default_rng(0)
+
+    print(f"{'rows':>8} {'sklearn(us)':>12} {'scorer(us)':>12} {'speedup':>8}")
+    for batch_size in batch_sizes:
+        X = rng.normal(size=(batch_size, len(model.numeric_cols))) * 20 + 40
+
+        assert np.array_equal(model.model.predict(X), model.predict(X))
+        sklearn_us = time_per_call(model.model.predict, X)
+        scorer_us = time_per_call(model.predict, X)
+
+        print(
+            f"{batch_size:>8} {sklearn_us:>12.1f} {scorer_us:>12.1f} "
+            f"{sklearn_us / scorer_us:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-dir", default="integration-tests/model/")
+    args = parser.parse_args()
+
+    run_benchmark(Model.from_model_dir(args.model_dir), BATCH_SIZES)
@@ -4,9 +4,11 @@ from pathlib import Path
 ZIP_PATH = Path("dataset/smoke_detection_iot.csv.zip")
 EXTRACTED_DIR = Path("dataset/extracted/")
 FILE_PATH = EXTRACTED_DIR / "smoke_detection_iot.csv"
+DATASET_CACHE_DIR = Path("dataset/cache/")
 ARTIFACT_DIR = Path("artifacts/")
 MODEL_DIR = ARTIFACT_DIR / "model/"
 MONITORING_ARTIFACT_DIR = ARTIFACT_DIR / "monitoring/"
+PREDICTION_LOG_DIR = ARTIFACT_DIR / "prediction_log/"
 MLFLOW_TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI", "http://localhost:5000")
 MLFLOW_EXPERIMENT_NAME = "smoke-detection"
 MLFLOW_MODEL_NAME = "smoke-detection-model"
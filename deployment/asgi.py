@@ -0,0 +1,136 @@
+"""
+ASGI version of the prediction service(see deployment/main.py for the flask one),
+it serves the same routes with the same responses except /predict/stream, which
+only the flask app has.
+
+usage:
+    uvicorn --factory deployment.asgi:create_asgi_app --host 0.0.0.0 --port 8080
+"""
+
+from pathlib import Path
+from contextlib import asynccontextmanager
+
+import httpx
+import jinja2
+import uvicorn
+from dotenv import load_dotenv
+from starlette.requests import Request
+from starlette.routing import Mount, Route
+from starlette.applications import Starlette
+from starlette.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, HTMLResponse, JSONResponse
+
+from deployment.metrics import get_metrics
+from deployment.service import (
+    PORT,
+    PredictionService,
+    create_prediction_service,
+)
+
+load_dotenv()
+
+HOST = "0.0.0.0"
+DEPLOYMENT_DIR = Path(__file__).parent
+
+
+def create_template_env() -> jinja2.Environment:
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(DEPLOYMENT_DIR / "templates"),
+        autoescape=jinja2.select_autoescape(),
+    )
+
+    # the templates are written for flask, so give them a flask like url_for
+    def url_for(endpoint: str, filename: str) -> str:
+        return f"/{endpoint}/{filename}"
+
+    env.globals["url_for"] = url_for
+    return env
+
+
+def create_routes(service: PredictionService, http_client: httpx.AsyncClient) -> list:
+    """`http_client` sends the /test requests"""
+    template = create_template_env().get_template("index.html")
+
+    async def home(_: Request):
+        context = {"numeric_cols": list(service.model.numeric_cols)}
+        return HTMLResponse(template.render(context=context))
+
+    async def test(_: Request):
+        dummy_data = service.get_dummy_data()
+
+        y_pred_response = None
+        if dummy_data is not None:
+            # awaiting here doesn't block the other requests
+            response = await http_client.post(
+                f"http://localhost:{PORT}/predict",
+                json=dummy_data,
+            )
+            y_pred_response = response.json()
+
+        return JSONResponse(service.get_test_response(y_pred_response))
+
+    async def predict(request: Request):
+        mimetype = request.headers.get("content-type", "").split(";")[0].strip().lower()
+        body = await request.body()
+
+        # parsing and predicting is cpu bound so it runs on the thread pool, the
+        # drift monitoring is already done by the background monitoring worker
+        result = await run_in_threadpool(service.predict_request, mimetype, body)
+
+        if result.mimetype is None:
+            return JSONResponse(result.data, status_code=result.status)
+        return Response(
+            result.data, status_code=result.status, media_type=result.mimetype
+        )
+
+    async def cache_stats(_: Request):
+        return JSONResponse(service.cache_stats())
+
+    async def batching_stats(_: Request):
+        return JSONResponse(service.batching_stats())
+
+    async def model_stats(_: Request):
+        return JSONResponse(service.model_stats())
+
+    async def metrics(_: Request):
+        data, content_type = get_metrics()
+        return Response(data, headers={"Content-Type": content_type})
+
+    return [
+        Route("/", home, methods=["GET"]),
+        Route("/test", test, methods=["GET"]),
+        Route("/predict", predict, methods=["POST"]),
+        Route("/stats/cache", cache_stats, methods=["GET"]),
+        Route("/stats/batching", batching_stats, methods=["GET"]),
+        Route("/stats/model", model_stats, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+        Mount("/static", StaticFiles(directory=DEPLOYMENT_DIR / "static"), name="static"),
+    ]
+
+
+def create_asgi_app() -> Starlette:
+    service = create_prediction_service()
+    # one client for all the /test requests, closed on shutdown
+    http_client = httpx.AsyncClient(timeout=10)
+
+    @asynccontextmanager
+    async def lifespan(_: Starlette):
+        try:
+            yield
+        finally:
+            await http_client.aclose()
+
+    app = Starlette(routes=create_routes(service, http_client), lifespan=lifespan)
+    app.state.prediction_service = service
+    app.state.http_client = http_client
+    return app
+
+
+if __name__ == "__main__":
+    uvicorn.run(
+        "deployment.asgi:create_asgi_app",
+        factory=True,
+        host=HOST,
+        port=PORT,
+    )
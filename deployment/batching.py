@@ -0,0 +1,194 @@
+import time
+import queue
+import threading
+from collections import deque
+from typing import Callable, Optional
+from concurrent.futures import Future
+
+import numpy as np
+
+from utils import register_after_fork
+
+
+class BatchingStats:
+    """
+    Keeps track of the batch sizes and the time requests spent waiting in the queue
+    """
+
+    def __init__(self, window_size: int = 1000):
+        self._lock = threading.Lock()
+        self.num_batches = 0
+        self.num_requests = 0
+        self.num_rows = 0
+        self.num_bypassed = 0
+        # batch size(in rows) bucketed by powers of 2: {1: n, 2: n, 4: n, ...}
+        self.batch_size_buckets = {}
+        self.queue_times_ms = deque(maxlen=window_size)
+
+    def record_batch(self, num_rows: int, queue_times_ms: list):
+        bucket = 1 << max(num_rows - 1, 0).bit_length()
+        with self._lock:
+            self.num_batches += 1
+            self.num_requests += len(queue_times_ms)
+            self.num_rows += num_rows
+            self.batch_size_buckets[bucket] = self.batch_size_buckets.get(bucket, 0) + 1
+            self.queue_times_ms.extend(queue_times_ms)
+
+    def record_bypass(self):
+        with self._lock:
+            self.num_bypassed += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            queue_times_ms = np.array(self.queue_times_ms)
+            stats = {
+                "num_batches": self.num_batches,
+                "num_requests": self.num_requests,
+                "num_rows": self.num_rows,
+                "num_bypassed": self.num_bypassed,
+                "avg_batch_rows": self.num_rows / max(self.num_batches, 1),
+                "avg_requests_per_batch": self.num_requests / max(self.num_batches, 1),
+                "batch_size_distribution": {
+                    f"<={bucket}": count
+                    for bucket, count in sorted(self.batch_size_buckets.items())
+                },
+            }
+
+        if len(queue_times_ms) > 0:
+            p50, p95, p99 = np.percentile(queue_times_ms, [50, 95, 99])
+            stats["queue_time_ms"] = {
+                "avg": float(queue_times_ms.mean()),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(queue_times_ms.max()),
+            }
+        return stats
+
+
+class MicroBatcher:
+    """
+    Collects concurrent prediction requests and runs them through the model
+    as a single vectorized predict call.
+
+    A batch is closed when it has max_batch_size rows or when its first request
+    has waited max_wait_ms, whichever happens first. Each caller gets back only
+    the predictions for its own rows. Requests passing a different predict_fn
+    (e.g. after a model reload) are never put in the same batch.
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable[[np.ndarray], np.ndarray],
+        max_batch_size: int = 256,
+        max_wait_ms: float = 5,
+        queue_size: int = 1000,
+    ):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stats = BatchingStats()
+        self._carry = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._start_after_fork = False
+        register_after_fork(self._after_fork)
+
+    def start(self):
+        with self._lock:
+            self._start_after_fork = False
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run,
+                name="micro-batcher",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def predict(
+        self,
+        X: np.ndarray,
+        timeout: Optional[float] = None,
+        predict_fn: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+    ) -> np.ndarray:
+        if self._start_after_fork:
+            self.start()
+
+        if predict_fn is None:
+            predict_fn = self.predict_fn
+
+        # big requests are already a batch, no point in making them wait
+        if self._thread is None or len(X) >= self.max_batch_size:
+            self.stats.record_bypass()
+            return predict_fn(X)
+
+        future = Future()
+        try:
+            self.queue.put_nowait((X, future, time.perf_counter(), predict_fn))
+        except queue.Full:
+            self.stats.record_bypass()
+            return predict_fn(X)
+
+        return future.result(timeout)
+
+    def _after_fork(self):
+        # the batching thread doesn't survive a fork, start a new one
+        # in the child on its first request
+        self._start_after_fork = self._thread is not None
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self._carry = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _next_item(self, timeout: Optional[float]):
+        if self._carry is not None:
+            item, self._carry = self._carry, None
+            return item
+        return self.queue.get(timeout=timeout)
+
+    def _collect_batch(self) -> list:
+        first_item = self._next_item(timeout=None)
+        batch = [first_item]
+        num_rows = len(first_item[0])
+        deadline = first_item[2] + self.max_wait_s
+
+        while num_rows < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._next_item(timeout=remaining)
+            except queue.Empty:
+                break
+
+            if num_rows + len(item[0]) > self.max_batch_size or item[3] != first_item[3]:
+                # doesn't fit(or is for another model), it will start the next batch
+                self._carry = item
+                break
+            batch.append(item)
+            num_rows += len(item[0])
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            start_time = time.perf_counter()
+            queue_times_ms = [(start_time - item[2]) * 1000 for item in batch]
+
+            try:
+                X = np.concatenate([item[0] for item in batch], axis=0)
+                y_pred = batch[0][3](X)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                for _, future, _, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for X_item, future, _, _ in batch:
+                future.set_result(y_pred[offset : offset + len(X_item)])
+                offset += len(X_item)
+
+            self.stats.record_batch(len(X), queue_times_ms)
@@ -13,11 +13,22 @@ model_dir = getenv("MODEL_DIR", DEPLOYMENT_MODEL_DIR)
 
 model_dir = getenv("MODEL_DIR", DEPLOYMENT_MODEL_DIR)
 DOWLOAD_MODEL_FLAG = getenv("DOWLOAD_MODEL_FLAG", "true").lower() == "true"
+MLFLOW_MODEL_VERSION = getenv("MLFLOW_MODEL_VERSION", "2")
+
+
+def download_model_version(mlflow_model, local_dir):
+    s3_resource = boto3.resource("s3")
+
+    download_s3_folder(
+        s3_resource,
+        s3_path=mlflow_model.source,
+        local_dir=local_dir,
+    )
 
 
 def download_mlflow_model():
 
-    mlflow_model_version = getenv("MLFLOW_MODEL_VERSION", "2")
+    mlflow_model_version = MLFLOW_MODEL_VERSION
     mlflow_tracking_uri = getenv("MLFLOW_TRACKING_URI", MLFLOW_TRACKING_URI)
 
     print(f"Downloading mlflow_model_version: {mlflow_model_version}")
@@ -25,13 +36,7 @@ def download_mlflow_model():
     # print(MLFLOW_MODEL_NAME, mlflow_model_version)
     client = MlflowClient(mlflow_tracking_uri)
     mlflow_model = client.get_model_version(MLFLOW_MODEL_NAME, mlflow_model_version)
-    s3_resource = boto3.resource("s3")
-
-    download_s3_folder(
-        s3_resource,
-        s3_path=mlflow_model.source,
-        local_dir=model_dir,
-    )
+    download_model_version(mlflow_model, model_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,161 @@
+import io
+from typing import Tuple
+
+import numpy as np
+
+from deployment.request_schema import RequestSchema, RequestValidationError
+
+try:
+    import msgpack
+except ImportError:  # optional, only needed for msgpack requests
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional, only needed for arrow requests
+    pa = None
+
+NPY_MIMETYPE = "application/x-npy"
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+MSGPACK_MIMETYPES = ("application/msgpack", "application/x-msgpack")
+
+PREDICTION_COL = "prediction"
+
+
+def parse_json_data(json_data, schema: RequestSchema) -> Tuple[np.ndarray, bool]:
+    """
+    parse a decoded json(or msgpack) request, which is either a list of
+    examples or a dict of feature columns.
+    returns the feature array and whether the request was columnar.
+    """
+    if isinstance(json_data, dict):
+        return schema.parse_columns(json_data), True
+    return schema.parse(json_data), False
+
+
+def decode_npy(body: bytes, schema: RequestSchema) -> np.ndarray:
+    """decode a .npy file, the array is a view over the request body(no copy)"""
+    buffer = io.BytesIO(body)
+    try:
+        version = np.lib.format.read_magic(buffer)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(buffer)
+        elif version == (2, 0):
+            header = np.lib.format.read_array_header_2_0(buffer)
+        else:
+            raise ValueError(f"unsupported npy format version {version}")
+        shape, fortran_order, dtype = header
+    except ValueError as e:
+        raise RequestValidationError(f"invalid npy data: {e}") from e
+
+    if dtype.hasobject:
+        raise RequestValidationError("object arrays are not supported")
+
+    count = int(np.prod(shape))
+    if len(body) - buffer.tell() < count * dtype.itemsize:
+        raise RequestValidationError("invalid npy data: body is shorter than the array")
+
+    X = np.frombuffer(body, dtype=dtype, count=count, offset=buffer.tell())
+    X = X.reshape(shape, order="F" if fortran_order else "C")
+    return schema.parse_array(X)
+
+
+def encode_npy(y_pred: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, y_pred, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def decode_arrow(body: bytes, schema: RequestSchema) -> np.ndarray:
+    """decode an arrow ipc stream with one column per feature"""
+    if pa is None:
+        raise RequestValidationError("arrow requests need pyarrow to be installed")
+
+    try:
+        table = pa.ipc.open_stream(body).read_all()
+    except pa.ArrowInvalid as e:
+        raise RequestValidationError(f"invalid arrow stream: {e}") from e
+
+    missing_cols = [col for col in schema.numeric_cols if col not in table.column_names]
+    if len(missing_cols) > 0:
+        raise RequestValidationError(
+            f"pass all the features including {schema.numeric_cols}",
+            row_errors=[f"missing feature '{col}'" for col in missing_cols],
+        )
+    if table.num_rows == 0:
+        raise RequestValidationError("include at least one example")
+
+    X = np.empty((table.num_rows, len(schema.numeric_cols)), dtype=schema.dtype)
+    for j, col in enumerate(schema.numeric_cols):
+        column = table.column(col)
+        if column.null_count > 0 or not (
+            pa.types.is_integer(column.type)
+            or pa.types.is_floating(column.type)
+            or pa.types.is_boolean(column.type)
+        ):
+            raise RequestValidationError(
+                f"feature '{col}' should be a numeric column without nulls"
+            )
+        # each chunk is a view over the arrow buffer, the only copy is into X
+        offset = 0
+        for chunk in column.chunks:
+            X[offset : offset + len(chunk), j] = chunk.to_numpy(zero_copy_only=False)
+            offset += len(chunk)
+    schema.check_finite(X)
+    return X
+
+
+def encode_arrow(y_pred: np.ndarray) -> bytes:
+    table = pa.table({PREDICTION_COL: y_pred})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def decode_msgpack(body: bytes, schema: RequestSchema) -> Tuple[np.ndarray, bool]:
+    if msgpack is None:
+        raise RequestValidationError("msgpack requests need msgpack to be installed")
+
+    try:
+        data = msgpack.unpackb(body)
+    except ValueError as e:
+        raise RequestValidationError(f"invalid msgpack data: {e}") from e
+    return parse_json_data(data, schema)
+
+
+def encode_msgpack(y_pred: np.ndarray, columnar: bool) -> bytes:
+    y_pred = y_pred.tolist()
+    return msgpack.packb({PREDICTION_COL: y_pred} if columnar else y_pred)
+
+
+def is_supported_mimetype(mimetype: str) -> bool:
+    return mimetype in (NPY_MIMETYPE, ARROW_MIMETYPE, *MSGPACK_MIMETYPES)
+
+
+def decode_request(
+    mimetype: str,
+    body: bytes,
+    schema: RequestSchema,
+) -> Tuple[np.ndarray, bool]:
+    """
+    decode a binary request body into the feature array,
+    returns the array and whether the response should be columnar.
+    """
+    if mimetype == NPY_MIMETYPE:
+        return decode_npy(body, schema), True
+    if mimetype == ARROW_MIMETYPE:
+        return decode_arrow(body, schema), True
+    if mimetype in MSGPACK_MIMETYPES:
+        return decode_msgpack(body, schema)
+    raise ValueError(f"Unsupported mimetype: {mimetype}")
+
+
+def encode_response(mimetype: str, y_pred: np.ndarray, columnar: bool) -> bytes:
+    if mimetype == NPY_MIMETYPE:
+        return encode_npy(y_pred)
+    if mimetype == ARROW_MIMETYPE:
+        return encode_arrow(y_pred)
+    if mimetype in MSGPACK_MIMETYPES:
+        return encode_msgpack(y_pred, columnar)
+    raise ValueError(f"Unsupported mimetype: {mimetype}")
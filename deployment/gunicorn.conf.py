@@ -0,0 +1,54 @@
+# gunicorn config for serving the prediction service with multiple processes
+#
+# usage:
+#   gunicorn -c deployment/gunicorn.conf.py "deployment.main:create_app()"
+#
+# The app(model + drift reference data + flask app) is loaded once in the master
+# process and the workers are forked from it, so they share its memory copy-on-write.
+
+import gc
+import os
+
+from prometheus_client import multiprocess
+
+from utils import getenv
+
+bind = f"0.0.0.0:{getenv('PORT', '8080')}"
+
+# one worker per core by default
+workers = int(getenv("SERVING_WORKERS", str(os.cpu_count() or 1)))
+# threads per worker, lets the micro-batcher see concurrent requests
+worker_class = "gthread"
+threads = int(getenv("SERVING_THREADS", "4"))
+
+# load the app in the master before forking the workers(the service then starts its
+# model reloader in the workers only)
+preload_app = True
+os.environ["PRELOAD_APP_FLAG"] = "true"
+# with the drift reference data, instead of every worker loading its own copy
+os.environ.setdefault("PRELOAD_REFERENCE_FLAG", "true")
+
+# recycle workers after this many requests(+ jitter so they don't all restart together)
+max_requests = int(getenv("SERVING_MAX_REQUESTS", "10000"))
+max_requests_jitter = int(getenv("SERVING_MAX_REQUESTS_JITTER", "1000"))
+
+# time given to a worker to finish its requests and drain its monitoring queue
+# on restart(kill -HUP <master pid>) or shutdown
+graceful_timeout = int(getenv("SERVING_GRACEFUL_TIMEOUT", "30"))
+timeout = int(getenv("SERVING_TIMEOUT", "60"))
+
+accesslog = "-"
+
+
+def when_ready(server):
+    # everything loaded so far(model, reference data, flask app) goes to
+    # the permanent generation, so the garbage collector of the workers never
+    # writes to those pages and they stay shared with the master
+    gc.freeze()
+    server.log.info(f"froze {gc.get_freeze_count()} objects before forking workers")
+
+
+def child_exit(_server, worker):
+    # drop the live gauges(queue depths) of the exited worker from /metrics
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(worker.pid)
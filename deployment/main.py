@@ -1,151 +1,110 @@
 # pylint: disable=line-too-long
 
+import sys
+import signal
+
 import requests
-import numpy as np
-import pandas as pd
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request, render_template
-
-from utils import getenv
-from src.model import Model
-from constants import DEPLOYMENT_MODEL_DIR
-from monitoring.log_evidently_metrics import (
-    get_evidently_df,
-    calculate_metrics,
-    load_reference_df,
-    save_reference_df,
-    log_evidently_metrics,
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    request,
+    render_template,
+    stream_with_context,
+)
+
+from deployment.metrics import get_metrics
+from deployment.streaming import gzip_stream
+from deployment.request_schema import RequestSchema
+from deployment.service import (
+    PORT,
+    STREAM_MIMETYPES,
+    STREAM_MIMETYPE_ERROR,
+    create_prediction_service,
 )
 
 load_dotenv()
 
 HOST = "0.0.0.0"
-PORT = 8080
-temperature_col, humidity_col, eco2_col = "Temperature[C]", "Humidity[%]", "eCO2[ppm]"
-
-model_dir = getenv("MODEL_DIR", DEPLOYMENT_MODEL_DIR)
-LOG_TO_DB_FLAG = getenv("LOG_TO_DB_FLAG", "true").lower() == "true"
-
-
-def is_numeric(value: int | float):
-    return isinstance(value, (int, float))
 
 
 def is_valid_json_input(json_data_list: list[dict], numeric_cols: list[str]) -> bool:
-    if not isinstance(json_data_list, list):
-        return False
-    if len(json_data_list) == 0:
-        return False
-
-    for json_data in json_data_list:
-        if not isinstance(json_data, dict):
-            return False
-        for col in numeric_cols:
-            if col not in json_data:
-                return False
-            if not is_numeric(json_data[col]):
-                return False
-    return True
+    return RequestSchema(numeric_cols).is_valid(json_data_list)
 
 
 def create_app():
 
     app = Flask(__name__)
 
-    model = Model.from_model_dir(model_dir)
-
-    save_reference_df(model)
-    reference_df = load_reference_df()
+    service = create_prediction_service()
+    app.config["PREDICTION_SERVICE"] = service
 
     @app.route("/", methods=["GET"])
     def home():
-        context = {"numeric_cols": list(model.numeric_cols)}
+        context = {"numeric_cols": list(service.model.numeric_cols)}
         return render_template("index.html", context=context)
 
     @app.route("/test", methods=["GET"])
     def test():
+        dummy_data = service.get_dummy_data()
 
-        dummy_data = None
-        response = {}
-
-        if sorted(model.numeric_cols) == sorted(
-            [temperature_col, humidity_col, eco2_col]
-        ):
-            dummy_data = np.array(
-                [
-                    [20, 30, 12],
-                    [40, 100, 60],
-                ]
-            )
-            dummy_data = [
-                {
-                    "Humidity[%]": 30,
-                    "Temperature[C]": 20,
-                    "eCO2[ppm]": 12,
-                },
-                {
-                    "Temperature[C]": 40,
-                    "Humidity[%]": 100,
-                    "eCO2[ppm]": 60,
-                },
-            ]
-
-        if dummy_data is None:
-            response = {
-                "numeric_cols": model.numeric_cols,
-                "msg": "we don't have dummy data for this model",
-            }
-
-        else:
+        y_pred_response = None
+        if dummy_data is not None:
             y_pred_response = requests.post(
                 f"http://localhost:{PORT}/predict",
                 json=dummy_data,
                 timeout=10,
             ).json()
 
-            response = {
-                "numeric_cols": model.numeric_cols,
-                "data": dummy_data,
-                "response": y_pred_response,
-            }
-
-        return jsonify(response)
+        return jsonify(service.get_test_response(y_pred_response))
 
     @app.route("/predict", methods=["POST"])
     def predict():
-        # pylint: disable=broad-exception-raised
-        if request.is_json:
-            json_request_data = request.get_json()
-        else:
-            return jsonify({"error": "pass json only"})
-
-        if not isinstance(json_request_data, list):
-            return jsonify({"error": "pass list of features"})
-
-        if len(json_request_data) == 0:
-            return jsonify({"error": "include at least one example"})
-
-        if not is_valid_json_input(json_request_data, model.numeric_cols):
-            return jsonify(
-                {"error": f"pass all the features including {model.numeric_cols}"}
-            )
-
-        data_df = pd.DataFrame(json_request_data, columns=model.numeric_cols)
-
-        y_pred = model.predict(data_df)
-
-        if LOG_TO_DB_FLAG:
-            # log evidently metrics
-            current_df = get_evidently_df(data_df, y_pred)
-            metrics = calculate_metrics(reference_df, current_df, model)
-            log_evidently_metrics(metrics)
-
-        return jsonify(y_pred.tolist())
+        result = service.predict_request(request.mimetype, request.get_data())
+        if result.mimetype is None:
+            return jsonify(result.data), result.status
+        return Response(result.data, status=result.status, mimetype=result.mimetype)
+
+    @app.route("/predict/stream", methods=["POST"])
+    def predict_stream():
+        if request.mimetype not in STREAM_MIMETYPES:
+            return jsonify({"error": STREAM_MIMETYPE_ERROR})
+
+        body = stream_with_context(
+            service.predict_stream(request.mimetype, request.stream)
+        )
+        headers = {}
+        if "gzip" in request.accept_encodings:
+            body = gzip_stream(body)
+            headers["Content-Encoding"] = "gzip"
+
+        return Response(body, mimetype=request.mimetype, headers=headers)
+
+    @app.route("/stats/cache", methods=["GET"])
+    def cache_stats():
+        return jsonify(service.cache_stats())
+
+    @app.route("/stats/batching", methods=["GET"])
+    def batching_stats():
+        return jsonify(service.batching_stats())
+
+    @app.route("/stats/model", methods=["GET"])
+    def model_stats():
+        return jsonify(service.model_stats())
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        data, content_type = get_metrics()
+        return Response(data, content_type=content_type)
 
     return app
 
 
 if __name__ == "__main__":
+    # turn SIGTERM(docker stop) into a normal exit so the monitoring queue gets drained
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
     app = create_app()
     app.run(
         debug=True,
@@ -0,0 +1,132 @@
+"""
+prometheus metrics of the prediction service, served on /metrics.
+
+With gunicorn every worker has its own metrics, set PROMETHEUS_MULTIPROC_DIR(to an
+empty directory) to have /metrics report the sum over all the workers.
+"""
+
+import os
+from typing import Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    Gauge,
+    Counter,
+    Histogram,
+    CollectorRegistry,
+    multiprocess,
+    generate_latest,
+)
+
+# 0.1ms to 10s
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+# 1 to 65536 rows
+ROW_BUCKETS = tuple(2**i for i in range(17))
+
+REQUEST_SECONDS = Histogram(
+    "prediction_request_duration_seconds",
+    "time taken by the prediction service to handle a /predict request",
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "prediction_stage_duration_seconds",
+    "time taken by each stage of the request and monitoring paths",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+STARTUP_SECONDS = Gauge(
+    "prediction_startup_duration_seconds",
+    "time taken by each step of the service startup",
+    ["step"],
+    multiprocess_mode="max",
+)
+REQUESTS = Counter("prediction_requests", "number of /predict requests", ["format"])
+ROWS = Counter("prediction_rows", "number of rows predicted")
+BATCH_ROWS = Histogram(
+    "prediction_batch_rows",
+    "number of rows per /predict request",
+    buckets=ROW_BUCKETS,
+)
+ERRORS = Counter("prediction_errors", "number of rejected requests", ["reason"])
+MONITORING_DROPPED = Counter(
+    "monitoring_jobs_dropped",
+    "number of monitoring jobs dropped because the queue was full",
+)
+MONITORING_FAILED = Counter("monitoring_jobs_failed", "number of failed monitoring jobs")
+MONITORING_SKIPPED = Counter(
+    "monitoring_jobs_skipped",
+    (
+        "number of drift jobs/rows, comparisons and prediction log requests skipped "
+        "because the monitoring database circuit was open"
+    ),
+    ["sink"],
+)
+MODEL_REQUESTS = Counter(
+    "prediction_model_requests", "number of requests answered by each model", ["model"]
+)
+SHADOW_DROPPED = Counter(
+    "shadow_jobs_dropped",
+    "number of canary/shadow comparisons dropped because the queue was full",
+)
+MODEL_RELOADS = Counter("model_reloads", "number of model reloads", ["result"])
+MONITORING_QUEUE_DEPTH = Gauge(
+    "monitoring_queue_depth",
+    "number of pending monitoring jobs",
+    multiprocess_mode="livesum",
+)
+MONITORING_BUFFER_ROWS = Gauge(
+    "monitoring_buffer_rows",
+    "number of drift metrics rows waiting to be written to the database",
+    multiprocess_mode="livesum",
+)
+SAMPLING_RATE = Gauge(
+    "monitoring_sampling_rate",
+    "share of the requests which get drift monitored",
+    multiprocess_mode="liveall",
+)
+MONITORING_CIRCUIT_OPEN = Gauge(
+    "monitoring_circuit_open",
+    "1 while the monitoring database is skipped by the circuit breaker",
+    multiprocess_mode="livemax",
+)
+BATCHING_QUEUE_DEPTH = Gauge(
+    "batching_queue_depth",
+    "number of requests waiting to be batched",
+    multiprocess_mode="livesum",
+)
+
+# labels are resolved once here, so the request path only pays for the timer
+PARSE_SECONDS = STAGE_SECONDS.labels("parse")
+PREDICT_SECONDS = STAGE_SECONDS.labels("predict")
+ENCODE_SECONDS = STAGE_SECONDS.labels("encode")
+MONITORING_SUBMIT_SECONDS = STAGE_SECONDS.labels("monitoring_submit")
+MONITORING_DATAFRAME_SECONDS = STAGE_SECONDS.labels("monitoring_dataframe")
+CALCULATE_METRICS_SECONDS = STAGE_SECONDS.labels("calculate_metrics")
+LOG_TO_DB_SECONDS = STAGE_SECONDS.labels("log_to_db")
+SHADOW_SECONDS = STAGE_SECONDS.labels("shadow_predict")
+
+
+def get_metrics() -> Tuple[bytes, str]:
+    """metrics in the prometheus text format and their content type"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
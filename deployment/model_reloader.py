@@ -0,0 +1,211 @@
+import os
+import shutil
+import tempfile
+import threading
+import traceback
+from pathlib import Path
+from typing import Tuple, Optional
+
+from mlflow.client import MlflowClient
+
+from utils import register_after_fork
+from constants import MLFLOW_MODEL_NAME
+from deployment.download_model import download_model_version
+
+MODEL_FILE_NAMES = ("model.bin", "meta.bin", "reference.parquet")
+
+
+def get_model_dir_fingerprint(model_dir: str) -> Optional[Tuple]:
+    """size and modification time of the model files, None if the model is missing"""
+    model_dir = Path(model_dir)
+    fingerprint = []
+    for file_name in MODEL_FILE_NAMES:
+        try:
+            stat = os.stat(model_dir / file_name)
+        except FileNotFoundError:
+            if file_name == "reference.parquet":
+                # older models don't have it
+                continue
+            return None
+        fingerprint.append((file_name, stat.st_size, stat.st_mtime_ns))
+    return tuple(fingerprint)
+
+
+def get_version_dir(mlflow_model, versions_dir: Path) -> Path:
+    """download a registry model version to versions_dir/<version>(if not there already)"""
+    version_dir = Path(versions_dir) / str(mlflow_model.version)
+    if os.path.exists(version_dir):
+        return version_dir
+
+    print(f"downloading mlflow model version: {mlflow_model.version}")
+    os.makedirs(versions_dir, exist_ok=True)
+    # download to a temporary dir and rename it, so other workers never
+    # see a half downloaded version
+    download_dir = tempfile.mkdtemp(dir=versions_dir)
+    try:
+        download_model_version(mlflow_model, download_dir)
+        os.rename(download_dir, version_dir)
+    except Exception:  # pylint: disable=broad-exception-caught
+        # any failure(s3, mlflow or the rename) cleans up the partial download, and
+        # is raised again unless another worker already renamed its download first
+        shutil.rmtree(download_dir, ignore_errors=True)
+        if not os.path.exists(version_dir):
+            raise
+    return version_dir
+
+
+def download_registry_version(
+    version: str, versions_dir: Path, mlflow_tracking_uri: Optional[str] = None
+) -> Path:
+    client = MlflowClient(mlflow_tracking_uri)
+    mlflow_model = client.get_model_version(MLFLOW_MODEL_NAME, version)
+    return get_version_dir(mlflow_model, versions_dir)
+
+
+class ModelReloader:
+    """
+    Watches model_dir(and the mlflow model registry if an alias or stage is given)
+    from a background thread and hot swaps the model of the service when it changes.
+
+    A changed model_dir is only loaded once it stays the same for two checks in a
+    row, so a model that is still being written isn't picked up. `loaded_version` is
+    the registry version in model_dir, the alias/stage isn't reloaded while it points
+    to that version.
+    """
+
+    def __init__(
+        self,
+        service,
+        model_dir: str,
+        interval: float = 30,
+        mlflow_tracking_uri: Optional[str] = None,
+        mlflow_alias: Optional[str] = None,
+        mlflow_stage: Optional[str] = None,
+        loaded_version: Optional[str] = None,
+    ):
+        if mlflow_alias and mlflow_stage:
+            raise ValueError("pass either mlflow_alias or mlflow_stage, not both")
+
+        self.service = service
+        self.model_dir = Path(model_dir)
+        self.interval = interval
+        self.mlflow_tracking_uri = mlflow_tracking_uri
+        self.mlflow_alias = mlflow_alias
+        self.mlflow_stage = mlflow_stage
+        # downloaded registry versions go next to model_dir
+        self.versions_dir = self.model_dir.parent / "versions"
+
+        self._loaded_fingerprint = get_model_dir_fingerprint(model_dir)
+        self._pending_fingerprint = self._loaded_fingerprint
+        self._loaded_version = loaded_version
+        self._client = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._start_after_fork = False
+        register_after_fork(self._after_fork)
+
+    @property
+    def uses_mlflow(self) -> bool:
+        return bool(self.mlflow_alias or self.mlflow_stage)
+
+    def start(self, after_fork: bool = False):
+        """
+        start watching, with `after_fork` only in the forked workers(e.g. the
+        gunicorn master with preload_app, which doesn't serve any requests)
+        """
+        with self._lock:
+            self._start_after_fork = after_fork
+            if after_fork or self._thread is not None:
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                name="model-reloader",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def start_after_fork(self):
+        """start watching in a forked worker, cheap enough to call on every request"""
+        if self._start_after_fork:
+            self.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def check(self) -> bool:
+        """check for a new model once, returns True if one was loaded"""
+        reloaded = False
+        if self.uses_mlflow:
+            reloaded = self._check_mlflow()
+        return self._check_model_dir() or reloaded
+
+    def _check_model_dir(self) -> bool:
+        fingerprint = get_model_dir_fingerprint(self.model_dir)
+        is_stable = fingerprint == self._pending_fingerprint
+        self._pending_fingerprint = fingerprint
+
+        if (
+            fingerprint is None
+            or fingerprint == self._loaded_fingerprint
+            or not is_stable
+        ):
+            return False
+
+        # it isn't retried until the files change again, even if the load fails
+        self._loaded_fingerprint = fingerprint
+        print(f"model files changed in {self.model_dir}")
+        return self.service.reload_model(self.model_dir)
+
+    def _get_mlflow_model(self):
+        if self._client is None:
+            self._client = MlflowClient(self.mlflow_tracking_uri)
+
+        if self.mlflow_alias:
+            return self._client.get_model_version_by_alias(
+                MLFLOW_MODEL_NAME, self.mlflow_alias
+            )
+
+        mlflow_models = self._client.get_latest_versions(
+            MLFLOW_MODEL_NAME, stages=[self.mlflow_stage]
+        )
+        return mlflow_models[0] if len(mlflow_models) > 0 else None
+
+    def _check_mlflow(self) -> bool:
+        try:
+            mlflow_model = self._get_mlflow_model()
+        except Exception:  # pylint: disable=broad-exception-caught
+            # the registry being down shouldn't affect the served model
+            traceback.print_exc()
+            return False
+
+        if mlflow_model is None or mlflow_model.version == self._loaded_version:
+            return False
+
+        try:
+            version_dir = get_version_dir(mlflow_model, self.versions_dir)
+        except Exception:  # pylint: disable=broad-exception-caught
+            traceback.print_exc()
+            return False
+
+        self._loaded_version = mlflow_model.version
+        return self.service.reload_model(version_dir)
+
+    def _after_fork(self):
+        # every worker process watches for itself, the thread is started again
+        # on the first request of the child
+        self._start_after_fork = self._start_after_fork or self._thread is not None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception:  # pylint: disable=broad-exception-caught
+                traceback.print_exc()
@@ -0,0 +1,99 @@
+import threading
+from collections import OrderedDict
+from typing import Tuple, Callable, Optional
+
+import numpy as np
+
+
+class PredictionCache:
+    """
+    LRU cache of predictions keyed on the feature vector rounded to `precision`
+    decimals(in numeric_cols order).
+
+    Cache misses are predicted on the rounded features too, so a prediction
+    doesn't depend on whether it came from the cache or from the model.
+    The cache is cleared automatically when a different model is passed in.
+    """
+
+    def __init__(self, max_size: int = 100_000, precision: int = 2):
+        self.max_size = max_size
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._model = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def _get_keys(self, X: np.ndarray) -> Tuple[np.ndarray, list]:
+        # adding 0.0 turns -0.0 into 0.0 so both get the same key
+        X = np.ascontiguousarray(np.round(X, self.precision) + 0.0, dtype=np.float64)
+        # one bytes key per row
+        return X, X.view(np.dtype((np.void, X.shape[1] * X.itemsize))).ravel().tolist()
+
+    def predict(
+        self,
+        model,
+        X: np.ndarray,
+        predict_fn: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+    ) -> np.ndarray:
+        if predict_fn is None:
+            predict_fn = model.predict
+
+        X_rounded, keys = self._get_keys(X)
+
+        hit_idx, hit_values, miss_idx = [], [], []
+        with self._lock:
+            if model is not self._model:
+                # the model was reloaded, old predictions are stale
+                self._cache.clear()
+                self._model = model
+
+            for i, key in enumerate(keys):
+                value = self._cache.get(key)
+                if value is None:
+                    miss_idx.append(i)
+                else:
+                    self._cache.move_to_end(key)
+                    hit_idx.append(i)
+                    hit_values.append(value)
+            self.hits += len(hit_idx)
+            self.misses += len(miss_idx)
+
+        if len(miss_idx) == 0:
+            return np.array(hit_values)
+
+        # only the misses go to the model, all of them in one call
+        y_miss = predict_fn(X_rounded[miss_idx])
+
+        with self._lock:
+            if model is self._model:
+                for i, value in zip(miss_idx, y_miss):
+                    self._cache[keys[i]] = value
+                while len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+
+        if len(hit_idx) == 0:
+            return y_miss
+
+        y_pred = np.empty(len(keys), dtype=y_miss.dtype)
+        y_pred[hit_idx] = hit_values
+        y_pred[miss_idx] = y_miss
+        return y_pred
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "size": len(self._cache),
+            "max_size": self.max_size,
+            "precision": self.precision,
+        }
@@ -0,0 +1,215 @@
+from operator import itemgetter
+from typing import List, Optional
+
+import numpy as np
+
+# numpy dtype kinds we accept as numeric: bool, signed int, unsigned int, float
+NUMERIC_KINDS = "biuf"
+
+
+class RequestValidationError(ValueError):
+    """
+    Raised when the json request doesn't match the schema,
+    row_errors has a readable message for each invalid row.
+    """
+
+    def __init__(self, message: str, row_errors: Optional[List[str]] = None):
+        super().__init__(message)
+        self.row_errors = row_errors or []
+
+
+def is_numeric(value: int | float):
+    return isinstance(value, (int, float))
+
+
+class RequestSchema:
+    """
+    Validates json requests(list of dicts) for a model and packs them
+    straight into a numpy array with columns in model.numeric_cols order.
+
+    It is built once per loaded model, so the per-request work is a single
+    pass which pulls the features out of every row followed by one
+    conversion to a numpy array. The slow row by row checks only run
+    to explain why a request is invalid.
+    """
+
+    def __init__(
+        self,
+        numeric_cols: List[str],
+        dtype: np.dtype = np.float64,
+        max_row_errors: int = 10,
+    ):
+        self.numeric_cols = list(numeric_cols)
+        self.dtype = np.dtype(dtype)
+        self.max_row_errors = max_row_errors
+        self._get_features = itemgetter(*self.numeric_cols)
+
+    def parse(self, json_data_list: list) -> np.ndarray:
+        if not isinstance(json_data_list, list):
+            raise RequestValidationError("pass list of features")
+        if len(json_data_list) == 0:
+            raise RequestValidationError("include at least one example")
+
+        X = self._pack(json_data_list)
+        if X is None:
+            raise RequestValidationError(
+                f"pass all the features including {self.numeric_cols}",
+                row_errors=self.get_row_errors(json_data_list),
+            )
+        self.check_finite(X)
+        return X
+
+    def parse_columns(self, columns: dict) -> np.ndarray:
+        """parse columnar requests like {"Temperature[C]": [...], ...}"""
+        if not isinstance(columns, dict):
+            raise RequestValidationError("pass dict of feature columns")
+
+        missing_cols = [col for col in self.numeric_cols if col not in columns]
+        if len(missing_cols) > 0:
+            raise RequestValidationError(
+                f"pass all the features including {self.numeric_cols}",
+                row_errors=[f"missing feature '{col}'" for col in missing_cols],
+            )
+
+        num_rows = None
+        X = None
+        for j, col in enumerate(self.numeric_cols):
+            try:
+                values = np.asarray(columns[col])
+            except ValueError:
+                values = np.asarray(None)
+
+            if values.ndim != 1 or values.dtype.kind not in NUMERIC_KINDS:
+                raise RequestValidationError(
+                    f"pass all the features including {self.numeric_cols}",
+                    row_errors=[f"feature '{col}' should be a list of numbers"],
+                )
+
+            if X is None:
+                num_rows = len(values)
+                if num_rows == 0:
+                    raise RequestValidationError("include at least one example")
+                X = np.empty((num_rows, len(self.numeric_cols)), dtype=self.dtype)
+            elif len(values) != num_rows:
+                raise RequestValidationError(
+                    "all the feature columns should have the same length",
+                    row_errors=[f"feature '{col}' has {len(values)} values"],
+                )
+            X[:, j] = values
+
+        self.check_finite(X)
+        return X
+
+    def parse_array(self, X: np.ndarray, row_offset: int = 0) -> np.ndarray:
+        """
+        check an array which already has the columns in numeric_cols order,
+        row_offset is added to the row numbers of the errors(e.g. of a csv chunk)
+        """
+        if X.ndim == 1 and len(self.numeric_cols) == 1:
+            X = X.reshape(-1, 1)
+
+        if X.ndim != 2 or X.shape[1] != len(self.numeric_cols):
+            raise RequestValidationError(
+                (
+                    f"expected an array of shape (n, {len(self.numeric_cols)}) "
+                    f"with columns {self.numeric_cols}, got shape {X.shape}"
+                )
+            )
+        if X.dtype.kind not in NUMERIC_KINDS:
+            raise RequestValidationError(f"expected a numeric array, got {X.dtype}")
+        if len(X) == 0:
+            raise RequestValidationError("include at least one example")
+
+        # no copy when the dtype already matches
+        X = X.astype(self.dtype, copy=False)
+        self.check_finite(X, row_offset)
+        return X
+
+    def check_finite(self, X: np.ndarray, row_offset: int = 0):
+        """
+        reject NaN and infinite features(e.g. a blank csv cell or a NaN in the
+        json), the models can't predict them
+        """
+        if X.dtype.kind != "f" or np.isfinite(X).all():
+            return
+
+        invalid_rows = np.flatnonzero(~np.isfinite(X).all(axis=1))
+        row_errors = []
+        for i in invalid_rows[: self.max_row_errors]:
+            j = int(np.flatnonzero(~np.isfinite(X[i]))[0])
+            row_errors.append(
+                f"row {row_offset + i}: feature '{self.numeric_cols[j]}' "
+                f"should be a finite number, got {X[i, j]}"
+            )
+        if len(invalid_rows) > self.max_row_errors:
+            row_errors.append("...")
+        raise RequestValidationError(
+            f"row {row_offset + invalid_rows[0]}: features should be finite numbers",
+            row_errors=row_errors,
+        )
+
+    def is_valid(self, json_data_list: list) -> bool:
+        try:
+            self.parse(json_data_list)
+        except RequestValidationError:
+            return False
+        return True
+
+    def _pack(self, json_data_list: list) -> Optional[np.ndarray]:
+        """returns None if any of the rows is invalid"""
+        num_rows, num_cols = len(json_data_list), len(self.numeric_cols)
+        try:
+            values = [self._get_features(json_data) for json_data in json_data_list]
+            X = np.array(values)
+        except (KeyError, TypeError, ValueError):
+            return None
+
+        expected_shape = (num_rows,) if num_cols == 1 else (num_rows, num_cols)
+        if X.shape != expected_shape:
+            return None
+
+        if X.dtype.kind not in NUMERIC_KINDS:
+            # numpy falls back to object for ints too big for int64, these are
+            # still valid numbers(unless too big for the dtype) so check them one by one
+            if X.dtype.kind != "O" or len(self.get_row_errors(json_data_list)) > 0:
+                return None
+
+        return X.astype(self.dtype, copy=False).reshape(num_rows, num_cols)
+
+    def get_row_errors(self, json_data_list: list) -> List[str]:
+        row_errors = []
+        for i, json_data in enumerate(json_data_list):
+            if len(row_errors) >= self.max_row_errors:
+                row_errors.append("...")
+                break
+
+            if not isinstance(json_data, dict):
+                row_errors.append(
+                    f"row {i}: expected an object, got {type(json_data).__name__}"
+                )
+                continue
+
+            for col in self.numeric_cols:
+                if col not in json_data:
+                    row_errors.append(f"row {i}: missing feature '{col}'")
+                    break
+                if not is_numeric(json_data[col]):
+                    row_errors.append(
+                        (
+                            f"row {i}: feature '{col}' should be a number, "
+                            f"got {type(json_data[col]).__name__}"
+                        )
+                    )
+                    break
+                if not self.is_in_range(json_data[col]):
+                    row_errors.append(f"row {i}: feature '{col}' is out of range")
+                    break
+        return row_errors
+
+    def is_in_range(self, value: int | float) -> bool:
+        """whether the number fits the dtype, e.g. 10**400 doesn't fit a float64"""
+        try:
+            self.dtype.type(value)
+        except OverflowError:
+            return False
+        return True
@@ -0,0 +1,979 @@
+import json
+import time
+import atexit
+import datetime
+import threading
+import traceback
+from pathlib import Path
+from functools import partial
+from typing import (
+    IO,
+    Any,
+    List,
+    Tuple,
+    Callable,
+    Iterator,
+    Optional,
+    NamedTuple,
+)
+
+import numpy as np
+import pandas as pd
+
+from utils import getenv
+from src.model import Model
+from constants import MLFLOW_TRACKING_URI, DEPLOYMENT_MODEL_DIR
+from constants import PREDICTION_LOG_DIR as DEFAULT_PREDICTION_LOG_DIR
+
+# isort: split
+from deployment.batching import MicroBatcher
+from deployment.prediction_cache import PredictionCache
+from deployment.request_schema import RequestSchema, RequestValidationError
+from deployment.download_model import DOWLOAD_MODEL_FLAG, MLFLOW_MODEL_VERSION
+from deployment.model_reloader import ModelReloader, download_registry_version
+from deployment.streaming import (
+    CSV_MIMETYPE,
+    NDJSON_MIMETYPES,
+    iter_chunks,
+    encode_error,
+    encode_predictions,
+)
+from deployment.formats import (
+    PREDICTION_COL,
+    decode_request,
+    encode_response,
+    parse_json_data,
+    is_supported_mimetype,
+)
+from deployment.metrics import (
+    ROWS,
+    ERRORS,
+    REQUESTS,
+    BATCH_ROWS,
+    MODEL_RELOADS,
+    PARSE_SECONDS,
+    SAMPLING_RATE,
+    ENCODE_SECONDS,
+    MODEL_REQUESTS,
+    SHADOW_DROPPED,
+    SHADOW_SECONDS,
+    PREDICT_SECONDS,
+    REQUEST_SECONDS,
+    STARTUP_SECONDS,
+    LOG_TO_DB_SECONDS,
+    MONITORING_FAILED,
+    MONITORING_DROPPED,
+    MONITORING_SKIPPED,
+    BATCHING_QUEUE_DEPTH,
+    MONITORING_BUFFER_ROWS,
+    MONITORING_QUEUE_DEPTH,
+    MONITORING_CIRCUIT_OPEN,
+    CALCULATE_METRICS_SECONDS,
+    MONITORING_SUBMIT_SECONDS,
+    MONITORING_DATAFRAME_SECONDS,
+)
+
+# isort: split
+from monitoring.db import is_circuit_open
+from monitoring.sampling import create_sampler
+from monitoring.worker import MonitoringWorker
+from monitoring.metrics_buffer import MetricsBuffer
+from monitoring.circuit_breaker import CircuitOpenError
+from monitoring.drift_window import DriftWindow, ClosedWindow
+from monitoring.prediction_log import PredictionBatch, create_sink
+from monitoring.drift import (
+    STATTESTS,
+    ReferenceProfile,
+    calculate_native_metrics,
+)
+from monitoring.log_model_comparison import (
+    get_comparison,
+    log_model_comparisons,
+)
+from monitoring.log_evidently_metrics import (
+    get_timestamp,
+    get_evidently_df,
+    calculate_metrics,
+    load_model_reference_df,
+    log_evidently_metrics_batch,
+)
+
+PORT = 8080
+temperature_col, humidity_col, eco2_col = "Temperature[C]", "Humidity[%]", "eCO2[ppm]"
+
+model_dir = getenv("MODEL_DIR", DEPLOYMENT_MODEL_DIR)
+LOG_TO_DB_FLAG = getenv("LOG_TO_DB_FLAG", "true").lower() == "true"
+MONITORING_QUEUE_SIZE = int(getenv("MONITORING_QUEUE_SIZE", "1000"))
+MONITORING_NUM_THREADS = int(getenv("MONITORING_NUM_THREADS", "1"))
+# what to do when the monitoring queue is full: "drop" the job or "block" the request
+MONITORING_OVERFLOW_POLICY = getenv("MONITORING_OVERFLOW_POLICY", "drop").lower()
+MONITORING_BLOCK_TIMEOUT = float(getenv("MONITORING_BLOCK_TIMEOUT", "1"))
+MONITORING_DRAIN_TIMEOUT = float(getenv("MONITORING_DRAIN_TIMEOUT", "30"))
+# metrics rows are written in bulk once this many are pending(or every
+# MONITORING_FLUSH_INTERVAL seconds), 1 writes every row right away
+MONITORING_BUFFER_SIZE = int(getenv("MONITORING_BUFFER_SIZE", "100"))
+MONITORING_FLUSH_INTERVAL = float(getenv("MONITORING_FLUSH_INTERVAL", "5"))
+# "evidently" or "native"(monitoring/drift.py, same metrics without the evidently report)
+DRIFT_ENGINE = getenv("DRIFT_ENGINE", "evidently").lower()
+DRIFT_ENGINES = ("evidently", "native")
+# test of the native engine: auto(what evidently would use), wasserstein, ks or psi
+DRIFT_STATTEST = getenv("DRIFT_STATTEST", "auto").lower()
+# which requests get drift monitored: all, fixed(MONITORING_SAMPLING_RATE of them),
+# reservoir(MONITORING_RESERVOIR_SIZE per MONITORING_RESERVOIR_SECONDS) or
+# budget(adjusts the rate to keep the monitoring jobs at MONITORING_CPU_BUDGET of a core)
+MONITORING_SAMPLING = getenv("MONITORING_SAMPLING", "all").lower()
+MONITORING_SAMPLING_RATE = float(getenv("MONITORING_SAMPLING_RATE", "0.1"))
+MONITORING_RESERVOIR_SIZE = int(getenv("MONITORING_RESERVOIR_SIZE", "100"))
+MONITORING_RESERVOIR_SECONDS = float(getenv("MONITORING_RESERVOIR_SECONDS", "10"))
+MONITORING_CPU_BUDGET = float(getenv("MONITORING_CPU_BUDGET", "0.1"))
+# write every scored row(timestamp, model version, features, prediction) to a
+# prediction log: off, postgres(the predictions table) or parquet(files in PREDICTION_LOG_DIR)
+PREDICTION_LOG_SINK = getenv("PREDICTION_LOG_SINK", "off").lower()
+PREDICTION_LOG_DIR = getenv("PREDICTION_LOG_DIR", str(DEFAULT_PREDICTION_LOG_DIR))
+PREDICTION_LOG_RETENTION_DAYS = int(getenv("PREDICTION_LOG_RETENTION_DAYS", "30"))
+# requests buffered before a write, and seconds after which they are written anyway
+PREDICTION_LOG_BUFFER_SIZE = int(getenv("PREDICTION_LOG_BUFFER_SIZE", "1000"))
+PREDICTION_LOG_FLUSH_INTERVAL = float(getenv("PREDICTION_LOG_FLUSH_INTERVAL", "5"))
+# load the drift reference data at startup instead of on the first monitoring job,
+# set by deployment/gunicorn.conf.py so the forked workers share the master's copy
+PRELOAD_REFERENCE_FLAG = getenv("PRELOAD_REFERENCE_FLAG", "false").lower() == "true"
+# the app is loaded in a master process which forks the workers, set by
+# deployment/gunicorn.conf.py so only the workers watch for new models
+PRELOAD_APP_FLAG = getenv("PRELOAD_APP_FLAG", "false").lower() == "true"
+# calculate the drift once per window of rows instead of once per request
+DRIFT_WINDOW_FLAG = getenv("DRIFT_WINDOW_FLAG", "false").lower() == "true"
+DRIFT_WINDOW_ROWS = int(getenv("DRIFT_WINDOW_ROWS", "1000"))
+DRIFT_WINDOW_SECONDS = float(getenv("DRIFT_WINDOW_SECONDS", "60"))
+DRIFT_WINDOW_MIN_ROWS = int(getenv("DRIFT_WINDOW_MIN_ROWS", "100"))
+# combine concurrent /predict requests into a single model.predict call
+BATCHING_FLAG = getenv("BATCHING_FLAG", "false").lower() == "true"
+BATCHING_MAX_BATCH_SIZE = int(getenv("BATCHING_MAX_BATCH_SIZE", "256"))
+BATCHING_MAX_WAIT_MS = float(getenv("BATCHING_MAX_WAIT_MS", "5"))
+BATCHING_QUEUE_SIZE = int(getenv("BATCHING_QUEUE_SIZE", "1000"))
+# cache predictions of repeated feature vectors(rounded to PREDICTION_CACHE_PRECISION decimals)
+PREDICTION_CACHE_FLAG = getenv("PREDICTION_CACHE_FLAG", "false").lower() == "true"
+PREDICTION_CACHE_SIZE = int(getenv("PREDICTION_CACHE_SIZE", "100000"))
+PREDICTION_CACHE_PRECISION = int(getenv("PREDICTION_CACHE_PRECISION", "2"))
+# dtype of the feature array requests are packed into: float64 or float32
+REQUEST_DTYPE = getenv("REQUEST_DTYPE", "float64")
+# rows scored at a time by /predict/stream
+STREAM_CHUNK_SIZE = int(getenv("STREAM_CHUNK_SIZE", "10000"))
+# rows of each chunk sent for drift monitoring
+STREAM_MONITORING_SAMPLE_SIZE = int(getenv("STREAM_MONITORING_SAMPLE_SIZE", "100"))
+
+# watch MODEL_DIR(and the mlflow registry if an alias or stage is set) for new models
+MODEL_RELOAD_FLAG = getenv("MODEL_RELOAD_FLAG", "false").lower() == "true"
+MODEL_RELOAD_INTERVAL = float(getenv("MODEL_RELOAD_INTERVAL", "30"))
+MODEL_RELOAD_MLFLOW_ALIAS = getenv("MODEL_RELOAD_MLFLOW_ALIAS", "")
+MODEL_RELOAD_MLFLOW_STAGE = getenv("MODEL_RELOAD_MLFLOW_STAGE", "")
+
+# serve CANARY_PERCENT % of the requests with another model(registry version or model dir)
+CANARY_MODEL = getenv("CANARY_MODEL", "")
+CANARY_PERCENT = float(getenv("CANARY_PERCENT", "0"))
+# comma separated registry versions or model dirs, scored in the background and
+# compared with the served predictions in the monitoring database
+SHADOW_MODELS = getenv("SHADOW_MODELS", "")
+SHADOW_QUEUE_SIZE = int(getenv("SHADOW_QUEUE_SIZE", "1000"))
+
+PRIMARY_MODEL_KEY = "primary"
+STREAM_MIMETYPES = (*NDJSON_MIMETYPES, CSV_MIMETYPE)
+STREAM_MIMETYPE_ERROR = f"pass ndjson({NDJSON_MIMETYPES[0]}) or csv({CSV_MIMETYPE})"
+
+
+class PredictResult(NamedTuple):
+    """data is a json serializable object when mimetype is None, else encoded bytes"""
+
+    data: Any
+    mimetype: Optional[str] = None
+    status: int = 200
+
+
+def is_json_mimetype(mimetype: str) -> bool:
+    # same rule as flask's request.is_json
+    return mimetype == "application/json" or (
+        mimetype.startswith("application/") and mimetype.endswith("+json")
+    )
+
+
+def get_format_label(mimetype: str) -> str:
+    # keeps the number of label values of the request metrics bounded
+    if is_json_mimetype(mimetype):
+        return "application/json"
+    if is_supported_mimetype(mimetype):
+        return mimetype
+    return "other"
+
+
+class ServedModel:
+    """
+    A loaded model with everything derived from it, a reload swaps the whole
+    object so a request never mixes two models.
+    """
+
+    def __init__(self, model: Model, model_dir: str, key: str = PRIMARY_MODEL_KEY):
+        self.model = model
+        self.model_dir = model_dir
+        self.key = key
+        self.version = get_model_version(model_dir, key)
+        self.request_schema = RequestSchema(model.numeric_cols, dtype=REQUEST_DTYPE)
+        self.loaded_at = time.time()
+        self._reference_df = None
+        self._reference_profile = None
+        self._reference_lock = threading.Lock()
+
+        self.drift_window = None
+        # drift is only monitored on the primary model
+        if DRIFT_WINDOW_FLAG and key == PRIMARY_MODEL_KEY:
+            self.drift_window = DriftWindow(
+                len(model.numeric_cols),
+                max_rows=DRIFT_WINDOW_ROWS,
+                window_seconds=DRIFT_WINDOW_SECONDS,
+                min_rows=DRIFT_WINDOW_MIN_ROWS,
+            )
+
+    @property
+    def reference_df(self) -> pd.DataFrame:
+        """
+        drift reference data, loaded by the first monitoring job so it doesn't
+        slow down the startup(unless PRELOAD_REFERENCE_FLAG is set).
+        """
+        with self._reference_lock:
+            if self._reference_df is None:
+                start_time = time.perf_counter()
+                self._reference_df = load_model_reference_df(self.model, self.model_dir)
+                STARTUP_SECONDS.labels("load_reference").set(
+                    time.perf_counter() - start_time
+                )
+            return self._reference_df
+
+    @property
+    def reference_profile(self) -> ReferenceProfile:
+        """summary of the reference data used by the native drift engine"""
+        reference_df = self.reference_df
+        with self._reference_lock:
+            if self._reference_profile is None:
+                start_time = time.perf_counter()
+                self._reference_profile = ReferenceProfile(
+                    reference_df, [*self.model.numeric_cols, PREDICTION_COL]
+                )
+                STARTUP_SECONDS.labels("reference_profile").set(
+                    time.perf_counter() - start_time
+                )
+            return self._reference_profile
+
+    def warm_up(self, load_reference: bool = True):
+        # the first predict compiles the scorer
+        self.model.predict(
+            np.zeros((1, len(self.model.numeric_cols)), dtype=REQUEST_DTYPE)
+        )
+        if LOG_TO_DB_FLAG and load_reference:
+            _ = self.reference_df
+            if DRIFT_ENGINE == "native":
+                _ = self.reference_profile
+
+
+class ModelRoutes:
+    """
+    The primary model with the optional canary and shadow models. Requests are
+    parsed once into the union of their numeric_cols, and every model gets its
+    own columns out of it.
+    """
+
+    def __init__(
+        self,
+        primary: ServedModel,
+        canary: Optional[ServedModel] = None,
+        canary_percent: float = 0.0,
+        shadows: Optional[List[ServedModel]] = None,
+    ):
+        self.primary = primary
+        self.canary = canary
+        self.canary_percent = canary_percent
+        self.shadows = shadows or []
+
+        models = [primary, *([canary] if canary is not None else []), *self.shadows]
+        keys = [served.key for served in models]
+        if len(set(keys)) != len(keys):
+            raise ValueError(f"model keys should be unique, got {keys}")
+
+        self.numeric_cols = sorted(
+            {col for served in models for col in served.model.numeric_cols}
+        )
+        if self.numeric_cols == primary.model.numeric_cols:
+            self.request_schema = primary.request_schema
+        else:
+            self.request_schema = RequestSchema(self.numeric_cols, dtype=REQUEST_DTYPE)
+
+        self._col_idx = {}
+        for served in models:
+            idx = [self.numeric_cols.index(col) for col in served.model.numeric_cols]
+            # None when the model uses all the columns, so nothing gets copied
+            self._col_idx[served.key] = (
+                None if idx == list(range(len(self.numeric_cols))) else idx
+            )
+
+    @property
+    def has_secondary_models(self) -> bool:
+        return self.canary is not None or len(self.shadows) > 0
+
+    def project(self, X_all: np.ndarray, served: ServedModel) -> np.ndarray:
+        """columns of `served` out of the union of the columns"""
+        idx = self._col_idx[served.key]
+        return X_all if idx is None else X_all[:, idx]
+
+    def replace_primary(self, primary: ServedModel) -> "ModelRoutes":
+        return ModelRoutes(primary, self.canary, self.canary_percent, self.shadows)
+
+
+class PredictionService:
+    """
+    Everything needed to serve predictions for a model, independent of the
+    web framework so the flask and the asgi apps give the same responses.
+    """
+
+    def __init__(
+        self,
+        model: Model,
+        model_dir: str,
+        canary: Optional[ServedModel] = None,
+        canary_percent: float = 0.0,
+        shadows: Optional[List[ServedModel]] = None,
+    ):
+        if DRIFT_ENGINE not in DRIFT_ENGINES:
+            raise ValueError(
+                f"Unsupported DRIFT_ENGINE: {DRIFT_ENGINE}, expected one of {DRIFT_ENGINES}"
+            )
+        if DRIFT_STATTEST not in STATTESTS:
+            raise ValueError(
+                f"Unsupported DRIFT_STATTEST: {DRIFT_STATTEST}, expected one of {STATTESTS}"
+            )
+
+        self.routes = ModelRoutes(
+            ServedModel(model, model_dir), canary, canary_percent, shadows
+        )
+        self.rng = np.random.default_rng()
+        self._reload_lock = threading.Lock()
+
+        self.monitoring_worker = MonitoringWorker(
+            self.log_monitoring_metrics,
+            queue_size=MONITORING_QUEUE_SIZE,
+            num_threads=MONITORING_NUM_THREADS,
+            overflow_policy=MONITORING_OVERFLOW_POLICY,
+            block_timeout=MONITORING_BLOCK_TIMEOUT,
+            # closes the due windows when the traffic stops
+            tick=self.close_due_drift_windows if DRIFT_WINDOW_FLAG else None,
+        )
+
+        self.sampler = create_sampler(
+            MONITORING_SAMPLING,
+            rate=MONITORING_SAMPLING_RATE,
+            reservoir_size=MONITORING_RESERVOIR_SIZE,
+            reservoir_seconds=MONITORING_RESERVOIR_SECONDS,
+            cpu_budget=MONITORING_CPU_BUDGET,
+        )
+
+        self.metrics_buffer = None
+        if MONITORING_BUFFER_SIZE > 1:
+            self.metrics_buffer = MetricsBuffer(
+                self.write_monitoring_metrics,
+                max_rows=MONITORING_BUFFER_SIZE,
+                flush_interval=MONITORING_FLUSH_INTERVAL,
+            )
+
+        self.prediction_log = create_sink(
+            PREDICTION_LOG_SINK, PREDICTION_LOG_DIR, PREDICTION_LOG_RETENTION_DAYS
+        )
+        self.prediction_log_buffer = None
+        if self.prediction_log is not None:
+            self.prediction_log_buffer = MetricsBuffer(
+                self.write_prediction_log,
+                max_rows=PREDICTION_LOG_BUFFER_SIZE,
+                flush_interval=PREDICTION_LOG_FLUSH_INTERVAL,
+                max_pending_rows=PREDICTION_LOG_BUFFER_SIZE * 10,
+            )
+
+        self.batcher = None
+        if BATCHING_FLAG:
+            self.batcher = MicroBatcher(
+                model.predict,
+                max_batch_size=BATCHING_MAX_BATCH_SIZE,
+                max_wait_ms=BATCHING_MAX_WAIT_MS,
+                queue_size=BATCHING_QUEUE_SIZE,
+            )
+
+        self.prediction_cache = None
+        if PREDICTION_CACHE_FLAG:
+            self.prediction_cache = PredictionCache(
+                max_size=PREDICTION_CACHE_SIZE,
+                precision=PREDICTION_CACHE_PRECISION,
+            )
+
+        # shadow scoring never makes a request wait, jobs are dropped when it falls behind
+        self.shadow_worker = MonitoringWorker(
+            self.score_secondary_models,
+            queue_size=SHADOW_QUEUE_SIZE,
+            overflow_policy="drop",
+        )
+
+        self.model_reloader = None
+        if MODEL_RELOAD_FLAG:
+            self.model_reloader = ModelReloader(
+                self,
+                model_dir,
+                interval=MODEL_RELOAD_INTERVAL,
+                mlflow_tracking_uri=getenv("MLFLOW_TRACKING_URI", MLFLOW_TRACKING_URI),
+                mlflow_alias=MODEL_RELOAD_MLFLOW_ALIAS or None,
+                mlflow_stage=MODEL_RELOAD_MLFLOW_STAGE or None,
+                # the version deployment.download_model put in MODEL_DIR
+                loaded_version=MLFLOW_MODEL_VERSION if DOWLOAD_MODEL_FLAG else None,
+            )
+
+    @property
+    def served(self) -> ServedModel:
+        return self.routes.primary
+
+    @property
+    def model(self) -> Model:
+        return self.served.model
+
+    @property
+    def request_schema(self) -> RequestSchema:
+        return self.served.request_schema
+
+    @property
+    def reference_df(self) -> pd.DataFrame:
+        return self.served.reference_df
+
+    def reload_model(self, model_dir: str) -> bool:
+        """
+        load the model in model_dir, warm it up and swap it in, requests which
+        already started finish on the old model. returns False if it failed to load.
+        """
+        with self._reload_lock:
+            start_time = time.perf_counter()
+            try:
+                served = ServedModel(Model.from_model_dir(model_dir), model_dir)
+                served.warm_up()
+            except Exception:  # pylint: disable=broad-exception-caught
+                # keep serving the old model
+                traceback.print_exc()
+                MODEL_RELOADS.labels("failure").inc()
+                return False
+
+            self.routes = self.routes.replace_primary(served)
+            STARTUP_SECONDS.labels("reload_model").set(time.perf_counter() - start_time)
+            MODEL_RELOADS.labels("success").inc()
+            print(
+                f"reloaded model from {model_dir}, numeric_cols: {served.model.numeric_cols}"
+            )
+            return True
+
+    def start(self):
+        if LOG_TO_DB_FLAG:
+            self.monitoring_worker.start()
+            if self.metrics_buffer is not None:
+                self.metrics_buffer.start()
+                # atexit runs in reverse, so the buffer is flushed after the
+                # monitoring worker drained its queue into it
+                atexit.register(
+                    self.metrics_buffer.stop, timeout=MONITORING_DRAIN_TIMEOUT
+                )
+            if DRIFT_WINDOW_FLAG:
+                # between the two, so the last windows get the drained jobs' rows
+                atexit.register(self.flush_drift_windows)
+            atexit.register(self.monitoring_worker.stop, timeout=MONITORING_DRAIN_TIMEOUT)
+            # runs before the worker is stopped, so the held requests get monitored
+            atexit.register(self.flush_sampler)
+        if self.prediction_log_buffer is not None:
+            self.prediction_log_buffer.start()
+            atexit.register(self.stop_prediction_log)
+        if self.batcher is not None:
+            self.batcher.start()
+        if self.model_reloader is not None:
+            self.model_reloader.start(after_fork=PRELOAD_APP_FLAG)
+        if LOG_TO_DB_FLAG and self.routes.has_secondary_models:
+            self.shadow_worker.start()
+            atexit.register(self.shadow_worker.stop, timeout=MONITORING_DRAIN_TIMEOUT)
+
+    def score_secondary_models(
+        self,
+        X_all: np.ndarray,
+        y_pred: np.ndarray,
+        served: ServedModel,
+        routes: ModelRoutes,
+    ):
+        """
+        score the request with the models which didn't answer it and log how they
+        compare to the primary model, runs on the shadow worker.
+        """
+        if is_circuit_open():
+            MONITORING_SKIPPED.labels("comparison").inc()
+            return
+
+        with SHADOW_SECONDS.time():
+            primary = routes.primary
+            y_pred_primary = y_pred
+            comparisons = []
+            if served is not primary:
+                y_pred_primary = primary.model.predict(routes.project(X_all, primary))
+                comparisons.append(
+                    get_comparison(
+                        served.key,
+                        "canary",
+                        str(primary.model_dir),
+                        y_pred,
+                        y_pred_primary,
+                    )
+                )
+            for shadow in routes.shadows:
+                y_pred_shadow = shadow.model.predict(routes.project(X_all, shadow))
+                comparisons.append(
+                    get_comparison(
+                        shadow.key,
+                        "shadow",
+                        str(primary.model_dir),
+                        y_pred_shadow,
+                        y_pred_primary,
+                    )
+                )
+        try:
+            log_model_comparisons(comparisons)
+        except CircuitOpenError:
+            MONITORING_SKIPPED.labels("comparison").inc()
+
+    def start_after_fork(self):
+        # the model reloader thread of a forked worker(the monitoring worker and
+        # the batcher restart themselves on use)
+        if self.model_reloader is not None:
+            self.model_reloader.start_after_fork()
+
+    def log_monitoring_metrics(
+        self,
+        X: np.ndarray,
+        y_pred: np.ndarray,
+        served: Optional[ServedModel] = None,
+        sampling_rate: float = 1.0,
+    ):
+        # compared against the model which made the predictions, even if it was reloaded since
+        served = served if served is not None else self.served
+        if is_circuit_open():
+            # queued before the circuit opened, its metrics couldn't be written
+            MONITORING_SKIPPED.labels("drift").inc()
+            return
+        start_cpu_time = time.thread_time()
+        try:
+            if served.drift_window is None:
+                self.log_drift_metrics(X, y_pred, served, sampling_rate=sampling_rate)
+                return
+
+            window = served.drift_window.add(X, y_pred, sampling_rate)
+            if window is not None:
+                self.log_window_drift_metrics(window, served)
+        except CircuitOpenError:
+            MONITORING_SKIPPED.labels("drift").inc()
+        except Exception:
+            MONITORING_FAILED.inc()
+            raise
+        finally:
+            # the budget sampler adjusts its rate to the cpu used by the jobs
+            self.sampler.record_cost(time.thread_time() - start_cpu_time)
+            MONITORING_QUEUE_DEPTH.set(self.monitoring_worker.queue.qsize())
+
+    def log_window_drift_metrics(self, window: ClosedWindow, served: ServedModel):
+        self.log_drift_metrics(
+            window.X,
+            window.y_pred,
+            served,
+            sampling_rate=window.sampling_rate,
+            timestamp=window.end,
+            window_metrics={
+                "window_start": window.start,
+                "window_end": window.end,
+                "window_rows": len(window.X),
+                "window_rows_seen": window.num_seen,
+            },
+        )
+
+    def flush_drift_windows(self):
+        """log the drift of the open windows with at least min_rows rows(on shutdown)"""
+        self.log_closed_windows(DriftWindow.close)
+
+    def close_due_drift_windows(self):
+        """log the drift of the windows which are due, called by the monitoring worker"""
+        self.log_closed_windows(DriftWindow.tick)
+
+    def log_closed_windows(self, close: Callable[[DriftWindow], Optional[ClosedWindow]]):
+        served = self.served
+        if served.drift_window is None:
+            return
+        window = close(served.drift_window)
+        if window is not None:
+            try:
+                self.log_window_drift_metrics(window, served)
+            except CircuitOpenError:
+                MONITORING_SKIPPED.labels("drift").inc()
+            except Exception:  # pylint: disable=broad-exception-caught
+                MONITORING_FAILED.inc()
+                traceback.print_exc()
+
+    def log_drift_metrics(
+        self,
+        X: np.ndarray,
+        y_pred: np.ndarray,
+        served: ServedModel,
+        sampling_rate: float = 1.0,
+        timestamp: Optional[datetime.datetime] = None,
+        window_metrics: Optional[dict] = None,
+    ):
+        if DRIFT_ENGINE == "native":
+            reference_profile = served.reference_profile
+            with CALCULATE_METRICS_SECONDS.time():
+                metrics = calculate_native_metrics(
+                    reference_profile,
+                    X,
+                    y_pred,
+                    served.model.numeric_cols,
+                    stattest=DRIFT_STATTEST,
+                )
+        else:
+            reference_df = served.reference_df
+            with MONITORING_DATAFRAME_SECONDS.time():
+                # the dataframe is only needed by evidently so it is built here
+                data_df = pd.DataFrame(X, columns=served.model.numeric_cols)
+                current_df = get_evidently_df(data_df, y_pred)
+            with CALCULATE_METRICS_SECONDS.time():
+                metrics = calculate_metrics(reference_df, current_df, served.model)
+        metrics["sampling_rate"] = float(sampling_rate)
+        if window_metrics is not None:
+            metrics.update(window_metrics)
+
+        timestamp = timestamp if timestamp is not None else get_timestamp()
+        if self.metrics_buffer is not None:
+            if not self.metrics_buffer.add((timestamp, metrics)):
+                MONITORING_DROPPED.inc()
+            MONITORING_BUFFER_ROWS.set(self.metrics_buffer.num_pending)
+        else:
+            with LOG_TO_DB_SECONDS.time():
+                log_evidently_metrics_batch([(timestamp, metrics)])
+
+    def write_monitoring_metrics(self, rows: List):
+        """write a batch of (timestamp, metrics) rows of the metrics buffer"""
+        try:
+            with LOG_TO_DB_SECONDS.time():
+                log_evidently_metrics_batch(rows)
+        except CircuitOpenError:
+            MONITORING_SKIPPED.labels("drift").inc(len(rows))
+        except Exception:
+            MONITORING_FAILED.inc(len(rows))
+            raise
+        finally:
+            MONITORING_BUFFER_ROWS.set(self.metrics_buffer.num_pending)
+
+    def monitor(
+        self, X: np.ndarray, y_pred: np.ndarray, served: Optional[ServedModel] = None
+    ):
+        if LOG_TO_DB_FLAG:
+            # the monitoring database is down or slow, skip the job instead of
+            # letting it fill up the queue(or block the request)
+            circuit_open = is_circuit_open()
+            MONITORING_CIRCUIT_OPEN.set(circuit_open)
+            if circuit_open:
+                MONITORING_SKIPPED.labels("drift").inc()
+                return
+            served = served if served is not None else self.served
+            # only the requests picked by the sampler are monitored
+            self.submit_monitoring_jobs(self.sampler.sample((X, y_pred, served)))
+
+    def submit_monitoring_jobs(self, sampled: List[Tuple[Tuple, float]]):
+        # log evidently metrics in the background
+        for (X, y_pred, served), sampling_rate in sampled:
+            if not self.monitoring_worker.submit(X, y_pred, served, sampling_rate):
+                MONITORING_DROPPED.inc()
+        MONITORING_QUEUE_DEPTH.set(self.monitoring_worker.queue.qsize())
+        SAMPLING_RATE.set(self.sampler.rate)
+
+    def log_predictions(self, X: np.ndarray, y_pred: np.ndarray, served: ServedModel):
+        # only keeps a reference to the arrays, the sink's thread turns them into rows
+        if self.prediction_log_buffer is not None:
+            self.prediction_log_buffer.add(
+                PredictionBatch(
+                    get_timestamp(), served.version, served.model.numeric_cols, X, y_pred
+                )
+            )
+
+    def write_prediction_log(self, batches: List[PredictionBatch]):
+        """write the requests of the prediction log buffer"""
+        try:
+            self.prediction_log.write(batches)
+        except CircuitOpenError:
+            MONITORING_SKIPPED.labels("prediction_log").inc(len(batches))
+
+    def stop_prediction_log(self):
+        self.prediction_log_buffer.stop(timeout=MONITORING_DRAIN_TIMEOUT)
+        self.prediction_log.close()
+
+    def flush_sampler(self):
+        """monitor the requests still held by the sampler(on shutdown)"""
+        self.submit_monitoring_jobs(self.sampler.flush())
+
+    def predict_features(
+        self, X: np.ndarray, served: Optional[ServedModel] = None
+    ) -> np.ndarray:
+        served = served if served is not None else self.served
+        model = served.model
+        predict_fn = model.predict
+        if self.batcher is not None:
+            BATCHING_QUEUE_DEPTH.set(self.batcher.queue.qsize())
+            predict_fn = partial(self.batcher.predict, predict_fn=model.predict)
+        # only the primary model is cached, the cache is cleared on every model change
+        if self.prediction_cache is not None and served is self.served:
+            return self.prediction_cache.predict(model, X, predict_fn)
+        return predict_fn(X)
+
+    def _decode(
+        self, mimetype: str, body: bytes, request_schema: RequestSchema
+    ) -> Tuple[np.ndarray, bool]:
+        if is_json_mimetype(mimetype):
+            return parse_json_data(json.loads(body), request_schema)
+        return decode_request(mimetype, body, request_schema)
+
+    def _parse_request(
+        self, mimetype: str, body: bytes, routes: ModelRoutes
+    ) -> Tuple[Optional[np.ndarray], np.ndarray, bool]:
+        """
+        returns the features of all the models(None if the request only has the
+        primary model's features), the features of the primary model and if the
+        request was columnar.
+        """
+        primary_schema = routes.primary.request_schema
+        if routes.request_schema is primary_schema:
+            X, columnar = self._decode(mimetype, body, primary_schema)
+            return X, X, columnar
+
+        try:
+            X_all, columnar = self._decode(mimetype, body, routes.request_schema)
+            return X_all, routes.project(X_all, routes.primary), columnar
+        except RequestValidationError:
+            # a request only needs the features of the primary model
+            X, columnar = self._decode(mimetype, body, primary_schema)
+            return None, X, columnar
+
+    def _choose_model(
+        self, routes: ModelRoutes, X_all: Optional[np.ndarray]
+    ) -> ServedModel:
+        if (
+            routes.canary is not None
+            and X_all is not None
+            and self.rng.random() * 100 < routes.canary_percent
+        ):
+            return routes.canary
+        return routes.primary
+
+    def predict_request(self, mimetype: str, body: bytes) -> PredictResult:
+        """handle a /predict request body"""
+        self.start_after_fork()
+        REQUESTS.labels(get_format_label(mimetype)).inc()
+        with REQUEST_SECONDS.time():
+            return self._predict_request(mimetype, body)
+
+    def _predict_request(self, mimetype: str, body: bytes) -> PredictResult:
+        if not is_json_mimetype(mimetype) and not is_supported_mimetype(mimetype):
+            ERRORS.labels("unsupported_mimetype").inc()
+            return PredictResult({"error": "pass json only"})
+
+        # the whole request uses the models which were served when it started
+        routes = self.routes
+        try:
+            with PARSE_SECONDS.time():
+                X_all, X, columnar = self._parse_request(mimetype, body, routes)
+        except RequestValidationError as e:
+            ERRORS.labels("invalid_features").inc()
+            for row_error in e.row_errors:
+                print(f"invalid request, {row_error}")
+            return PredictResult({"error": str(e)})
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            ERRORS.labels("invalid_json").inc()
+            return PredictResult({"error": "invalid json"}, status=400)
+
+        ROWS.inc(len(X))
+        BATCH_ROWS.observe(len(X))
+
+        served = self._choose_model(routes, X_all)
+        if served is not routes.primary:
+            X = routes.project(X_all, served)
+        MODEL_REQUESTS.labels(served.key).inc()
+
+        with PREDICT_SECONDS.time():
+            y_pred = self.predict_features(X, served)
+        with MONITORING_SUBMIT_SECONDS.time():
+            self.log_predictions(X, y_pred, served)
+            # drift is monitored on the primary model, the canary is compared with it
+            if served is routes.primary:
+                self.monitor(X, y_pred, served)
+            if X_all is not None and routes.has_secondary_models and LOG_TO_DB_FLAG:
+                if not self.shadow_worker.submit(X_all, y_pred, served, routes):
+                    SHADOW_DROPPED.inc()
+
+        with ENCODE_SECONDS.time():
+            if is_json_mimetype(mimetype):
+                y_pred = y_pred.tolist()
+                return PredictResult({PREDICTION_COL: y_pred} if columnar else y_pred)
+
+            # reply in the same format as the request
+            return PredictResult(encode_response(mimetype, y_pred, columnar), mimetype)
+
+    def predict_stream(self, mimetype: str, stream: IO[bytes]) -> Iterator[str]:
+        """predict a ndjson or csv stream chunk by chunk, see /predict/stream"""
+        self.start_after_fork()
+        served = self.served
+        chunks = iter_chunks(mimetype, stream, served.request_schema, STREAM_CHUNK_SIZE)
+        try:
+            for i, X in enumerate(chunks):
+                ROWS.inc(len(X))
+                with PREDICT_SECONDS.time():
+                    y_pred = served.model.predict(X)
+
+                self.log_predictions(X, y_pred, served)
+                if LOG_TO_DB_FLAG:
+                    # only a sample of every chunk goes to drift monitoring
+                    sample_size = min(STREAM_MONITORING_SAMPLE_SIZE, len(X))
+                    idx = self.rng.choice(len(X), size=sample_size, replace=False)
+                    self.monitor(X[idx], y_pred[idx], served)
+
+                yield encode_predictions(mimetype, y_pred, is_first_chunk=i == 0)
+        except RequestValidationError as e:
+            ERRORS.labels("invalid_features").inc()
+            # the response has already started, so report the error in the body
+            yield encode_error(str(e))
+
+    def get_dummy_data(self) -> Optional[list]:
+        if sorted(self.model.numeric_cols) != sorted(
+            [temperature_col, humidity_col, eco2_col]
+        ):
+            return None
+
+        return [
+            {
+                "Humidity[%]": 30,
+                "Temperature[C]": 20,
+                "eCO2[ppm]": 12,
+            },
+            {
+                "Temperature[C]": 40,
+                "Humidity[%]": 100,
+                "eCO2[ppm]": 60,
+            },
+        ]
+
+    def get_test_response(self, y_pred_response=None) -> dict:
+        dummy_data = self.get_dummy_data()
+        if dummy_data is None:
+            return {
+                "numeric_cols": self.model.numeric_cols,
+                "msg": "we don't have dummy data for this model",
+            }
+
+        return {
+            "numeric_cols": self.model.numeric_cols,
+            "data": dummy_data,
+            "response": y_pred_response,
+        }
+
+    def cache_stats(self) -> dict:
+        if self.prediction_cache is None:
+            return {
+                "error": "prediction cache is disabled, set PREDICTION_CACHE_FLAG=true"
+            }
+        return self.prediction_cache.stats()
+
+    def batching_stats(self) -> dict:
+        if self.batcher is None:
+            return {"error": "batching is disabled, set BATCHING_FLAG=true"}
+        return self.batcher.stats.as_dict()
+
+    def model_stats(self) -> dict:
+        self.start_after_fork()
+        routes = self.routes
+        stats = get_served_model_stats(routes.primary)
+        stats["reload_enabled"] = self.model_reloader is not None
+        if routes.canary is not None:
+            stats["canary"] = get_served_model_stats(routes.canary)
+            stats["canary"]["percent"] = routes.canary_percent
+        if len(routes.shadows) > 0:
+            stats["shadows"] = [
+                get_served_model_stats(shadow) for shadow in routes.shadows
+            ]
+        return stats
+
+
+def get_model_version(served_dir: str, key: str) -> str:
+    """registry version("v3") of a downloaded model, else its key or model dir"""
+    served_dir = Path(served_dir)
+    if served_dir.parent.name == "versions":
+        return f"v{served_dir.name}"
+    if key != PRIMARY_MODEL_KEY:
+        return key
+    if DOWLOAD_MODEL_FLAG and served_dir == Path(model_dir):
+        # the version deployment.download_model put in MODEL_DIR
+        return f"v{MLFLOW_MODEL_VERSION}"
+    return str(served_dir)
+
+
+def get_served_model_stats(served: ServedModel) -> dict:
+    return {
+        "key": served.key,
+        "version": served.version,
+        "model_dir": str(served.model_dir),
+        "numeric_cols": served.model.numeric_cols,
+        "loaded_at": datetime.datetime.fromtimestamp(served.loaded_at).isoformat(),
+    }
+
+
+def load_served_model(model_source: str) -> ServedModel:
+    """load a model from a registry version(e.g. "3") or from a model dir"""
+    if model_source.isdigit():
+        key = f"v{model_source}"
+        source_dir = download_registry_version(
+            model_source,
+            versions_dir=Path(model_dir).parent / "versions",
+            mlflow_tracking_uri=getenv("MLFLOW_TRACKING_URI", MLFLOW_TRACKING_URI),
+        )
+    else:
+        key = model_source
+        source_dir = model_source
+
+    served = ServedModel(Model.from_model_dir(source_dir), source_dir, key=key)
+    # drift is only monitored on the primary model
+    served.warm_up(load_reference=False)
+    print(f"loaded {key} model, numeric_cols: {served.model.numeric_cols}")
+    return served
+
+
+def create_prediction_service() -> PredictionService:
+    start_time = time.perf_counter()
+    model = Model.from_model_dir(model_dir)
+    STARTUP_SECONDS.labels("load_model").set(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    canary = load_served_model(CANARY_MODEL) if CANARY_MODEL else None
+    shadows = [
+        load_served_model(model_source.strip())
+        for model_source in SHADOW_MODELS.split(",")
+        if model_source.strip() != ""
+    ]
+    STARTUP_SECONDS.labels("load_secondary_models").set(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    service = PredictionService(
+        model,
+        model_dir,
+        canary=canary,
+        canary_percent=CANARY_PERCENT,
+        shadows=shadows,
+    )
+    if PRELOAD_REFERENCE_FLAG:
+        # the model which gets drift monitored
+        service.served.warm_up()
+    service.start()
+    STARTUP_SECONDS.labels("start_service").set(time.perf_counter() - start_time)
+    return service
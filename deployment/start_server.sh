@@ -0,0 +1,10 @@
+#!/bin/bash
+# starts the prediction service, set ASGI_FLAG=true to serve the asgi app instead of flask
+if [ "${ASGI_FLAG}" = "true" ]; then
+    exec uvicorn --factory deployment.asgi:create_asgi_app --host 0.0.0.0 --port 8080
+else
+    # the gunicorn workers write their prometheus metrics here so /metrics can add them up
+    export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}
+    rm -rf "${PROMETHEUS_MULTIPROC_DIR}" && mkdir -p "${PROMETHEUS_MULTIPROC_DIR}"
+    exec gunicorn -c deployment/gunicorn.conf.py "deployment.main:create_app()"
+fi
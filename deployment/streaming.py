@@ -0,0 +1,101 @@
+import json
+import zlib
+from typing import IO, Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+
+from deployment.request_schema import RequestSchema, RequestValidationError
+
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/jsonlines")
+CSV_MIMETYPE = "text/csv"
+
+
+def iter_ndjson_chunks(
+    stream: IO[bytes],
+    schema: RequestSchema,
+    chunk_size: int,
+) -> Iterator[np.ndarray]:
+    """read one json example per line and yield them as arrays of chunk_size rows"""
+    rows = []
+    for line_no, line in enumerate(stream):
+        line = line.strip()
+        if len(line) == 0:
+            continue
+        try:
+            rows.append(json.loads(line))
+        except ValueError as e:
+            raise RequestValidationError(f"line {line_no}: invalid json") from e
+
+        if len(rows) == chunk_size:
+            yield schema.parse(rows)
+            rows = []
+
+    if len(rows) > 0:
+        yield schema.parse(rows)
+
+
+def iter_csv_chunks(
+    stream: IO[bytes],
+    schema: RequestSchema,
+    chunk_size: int,
+) -> Iterator[np.ndarray]:
+    """read a csv with a header row and yield its features as arrays of chunk_size rows"""
+    try:
+        reader = pd.read_csv(
+            stream,
+            chunksize=chunk_size,
+            usecols=lambda col: col in schema.numeric_cols,
+        )
+        row_offset = 0
+        for chunk_df in reader:
+            missing_cols = [col for col in schema.numeric_cols if col not in chunk_df]
+            if len(missing_cols) > 0:
+                raise RequestValidationError(
+                    f"pass all the features including {schema.numeric_cols}",
+                    row_errors=[f"missing feature '{col}'" for col in missing_cols],
+                )
+            X = chunk_df[schema.numeric_cols].to_numpy()
+            # a blank cell is read as NaN, which parse_array rejects
+            yield schema.parse_array(X, row_offset=row_offset)
+            row_offset += len(X)
+    except RequestValidationError:
+        raise
+    except ValueError as e:
+        # pandas parser errors are ValueErrors too
+        raise RequestValidationError(f"invalid csv data: {e}") from e
+
+
+def iter_chunks(
+    mimetype: str,
+    stream: IO[bytes],
+    schema: RequestSchema,
+    chunk_size: int,
+) -> Iterator[np.ndarray]:
+    if mimetype in NDJSON_MIMETYPES:
+        return iter_ndjson_chunks(stream, schema, chunk_size)
+    if mimetype == CSV_MIMETYPE:
+        return iter_csv_chunks(stream, schema, chunk_size)
+    raise ValueError(f"Unsupported mimetype: {mimetype}")
+
+
+def encode_predictions(mimetype: str, y_pred: np.ndarray, is_first_chunk: bool) -> str:
+    lines = "\n".join(map(str, y_pred.tolist())) + "\n"
+    if mimetype == CSV_MIMETYPE and is_first_chunk:
+        return "prediction\n" + lines
+    return lines
+
+
+def encode_error(error: str) -> str:
+    return json.dumps({"error": error}) + "\n"
+
+
+def gzip_stream(pieces: Iterable[str]) -> Iterator[bytes]:
+    """
+    gzip compress the pieces, flushing after each one so the client gets them as
+    they are ready
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for piece in pieces:
+        yield compressor.compress(piece.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
@@ -45,6 +45,20 @@ docker compose up deployment --no-deps --build -d
 exit_script
 
 
+check_service_heath
+exit_script
+
+python integration-tests/test_flask_valid.py
+exit_script
+
+python integration-tests/test_flask_invalid.py
+exit_script
+
+# run the same tests against the asgi version of the app
+export ASGI_FLAG="true"
+docker compose up deployment --no-deps -d
+exit_script
+
 check_service_heath
 exit_script
 
@@ -0,0 +1,89 @@
+import time
+import threading
+from typing import Callable
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    """the call was skipped because the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency(the monitoring database) so its callers
+    fail fast instead of waiting on it.
+
+    `failure_threshold` consecutive failures, or calls slower than
+    `latency_budget` seconds, open the circuit and calls are refused for
+    `reset_timeout` seconds. Then a single probe call is let through(half open),
+    its success closes the circuit and its failure opens it again.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        latency_budget: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if failure_threshold < 1:
+            raise ValueError(
+                f"failure_threshold should be at least 1, got {failure_threshold}"
+            )
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.latency_budget = latency_budget
+        self.clock = clock
+
+        self.state = CLOSED
+        self.num_failures = 0
+        self.num_opened = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        """True while calls are refused(open, or half open with the probe running)"""
+        with self._lock:
+            if self.state == OPEN:
+                return self.clock() - self._opened_at < self.reset_timeout
+            return self.state == HALF_OPEN
+
+    def allow(self) -> bool:
+        """whether a call can go ahead, the first one after reset_timeout is the probe"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if (
+                self.state == OPEN
+                and self.clock() - self._opened_at >= self.reset_timeout
+            ):
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def record(self, seconds: float, failed: bool = False):
+        """result of an allowed call, calls over the latency budget count as failures"""
+        with self._lock:
+            if not failed and seconds <= self.latency_budget:
+                self.state = CLOSED
+                self.num_failures = 0
+                return
+
+            self.num_failures += 1
+            if self.state == HALF_OPEN or self.num_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.num_opened += 1
+                    print(
+                        f"monitoring database circuit opened after {self.num_failures} "
+                        f"failed or slow calls, retrying in {self.reset_timeout}s"
+                    )
+                self.state = OPEN
+                self._opened_at = self.clock()
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self.num_failures = 0
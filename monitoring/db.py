@@ -0,0 +1,280 @@
+"""
+pooled connections to the monitoring postgresql database.
+
+    with transaction():
+        run_query(...)
+        run_query(...)
+
+runs both queries in one transaction on one connection, a run_query outside of
+a transaction gets a transaction of its own.
+
+The transactions go through a circuit breaker(monitoring.circuit_breaker), while
+the database is down or slow they fail right away with CircuitOpenError.
+"""
+
+import os
+import time
+import threading
+import traceback
+from typing import Optional
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+from utils import getenv
+from monitoring.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+DB_HOST = getenv("DB_HOST", "localhost")
+DB_POOL_MIN_SIZE = int(getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(getenv("DB_POOL_MAX_SIZE", "4"))
+# seconds to wait for a free connection when all of them are in use
+DB_POOL_TIMEOUT = float(getenv("DB_POOL_TIMEOUT", "10"))
+# connections idle for longer than this are checked with a "SELECT 1" before use
+DB_HEALTH_CHECK_INTERVAL = float(getenv("DB_HEALTH_CHECK_INTERVAL", "30"))
+# the circuit opens after this many failed transactions in a row(or ones slower
+# than DB_LATENCY_BUDGET seconds), and a transaction is tried again after
+# DB_CIRCUIT_RESET_TIMEOUT seconds
+DB_CIRCUIT_FAILURE_THRESHOLD = int(getenv("DB_CIRCUIT_FAILURE_THRESHOLD", "5"))
+DB_CIRCUIT_RESET_TIMEOUT = float(getenv("DB_CIRCUIT_RESET_TIMEOUT", "30"))
+DB_LATENCY_BUDGET = float(getenv("DB_LATENCY_BUDGET", "1"))
+# seconds to wait for a new connection / for a query(0 is no limit), a query slower
+# than the latency budget already counts as failed so it is cancelled by default
+DB_CONNECT_TIMEOUT = int(getenv("DB_CONNECT_TIMEOUT", "5"))
+DB_STATEMENT_TIMEOUT = float(getenv("DB_STATEMENT_TIMEOUT", str(DB_LATENCY_BUDGET)))
+PSYCOPG2_CONNECTION_STR = (
+    f"host={DB_HOST} port=5432 "
+    "user=monitoring password=secret dbname=monitoring "
+    f"connect_timeout={DB_CONNECT_TIMEOUT} "
+    f"options='-c statement_timeout={int(DB_STATEMENT_TIMEOUT * 1000)}'"
+)
+
+# postgresql allows at most 65535 parameters per query
+MAX_QUERY_ARGS = 65535
+
+# errors after which the connection can't be used anymore
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class PoolTimeoutError(Exception):
+    """no connection of the pool became free within its timeout"""
+
+
+# errors which mean the database is down or overloaded(a cancelled query is an
+# OperationalError too), unlike e.g. a query on a dropped table
+CIRCUIT_ERRORS = (*CONNECTION_ERRORS, PoolTimeoutError)
+
+
+class ConnectionPool:
+    """
+    psycopg2's ThreadedConnectionPool which waits for a free connection instead of
+    failing, health checks idle connections and replaces broken ones.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = 1,
+        max_size: int = 4,
+        timeout: float = 10,
+        health_check_interval: float = 30,
+    ):
+        if not 0 <= min_size <= max_size:
+            raise ValueError(
+                f"expected 0 <= min_size <= max_size, got {min_size}, {max_size}"
+            )
+
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._pool = ThreadedConnectionPool(min_size, max_size, dsn)
+        self._slots = threading.BoundedSemaphore(max_size)
+        # id(connection) -> time it was last returned to the pool
+        self._last_used = {}
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as curr:
+                curr.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except CONNECTION_ERRORS:
+            return False
+
+    def _getconn(self):
+        while True:
+            conn = self._pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            print("discarding a broken database connection")
+            self._putconn(conn, close=True)
+
+    def _putconn(self, conn, close: bool = False):
+        if close:
+            self._last_used.pop(id(conn), None)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+        self._pool.putconn(conn, close=close or bool(conn.closed))
+
+    @contextmanager
+    def connection(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeoutError(f"no free database connection after {self.timeout}s")
+        try:
+            conn = self._getconn()
+            broken = False
+            try:
+                yield conn
+            except CONNECTION_ERRORS:
+                broken = True
+                raise
+            finally:
+                self._putconn(conn, close=broken)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self._pool.closeall()
+
+
+def create_circuit_breaker() -> CircuitBreaker:
+    return CircuitBreaker(
+        failure_threshold=DB_CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout=DB_CIRCUIT_RESET_TIMEOUT,
+        latency_budget=DB_LATENCY_BUDGET,
+    )
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+_breaker = create_circuit_breaker()
+
+
+def get_pool() -> ConnectionPool:
+    """the process wide pool, created on first use"""
+    global _pool  # pylint: disable=global-statement
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    PSYCOPG2_CONNECTION_STR,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    health_check_interval=DB_HEALTH_CHECK_INTERVAL,
+                )
+    return _pool
+
+
+def set_pool(pool) -> Optional[ConnectionPool]:
+    """replace the pool(e.g. with benchmarks.fake_db), returns the previous one"""
+    global _pool  # pylint: disable=global-statement
+    with _pool_lock:
+        previous_pool, _pool = _pool, pool
+    return previous_pool
+
+
+def close_pool():
+    previous_pool = set_pool(None)
+    if previous_pool is not None:
+        previous_pool.close()
+
+
+def is_circuit_open() -> bool:
+    """whether the monitoring database is skipped for now, callers can skip their work"""
+    return _breaker.is_open
+
+
+def _after_fork():
+    global _pool, _pool_lock, _local, _breaker  # pylint: disable=global-statement
+    # the connections belong to the parent, closing them here would close them for
+    # the parent too, so the child just forgets them and makes a pool of its own
+    _pool = None
+    _pool_lock = threading.Lock()
+    _local = threading.local()
+    _breaker = create_circuit_breaker()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+@contextmanager
+def transaction():
+    """
+    cursor of a transaction which is committed at the end of the block and rolled
+    back on an exception, nested blocks join the outer transaction.
+    Raises CircuitOpenError without connecting while the circuit is open.
+    """
+    curr = getattr(_local, "cursor", None)
+    if curr is not None:
+        yield curr
+        return
+
+    breaker = _breaker
+    if not breaker.allow():
+        raise CircuitOpenError("the monitoring database circuit is open")
+
+    start_time = time.perf_counter()
+    failed = False
+    try:
+        with get_pool().connection() as conn:
+            try:
+                with conn.cursor() as curr:
+                    _local.cursor = curr
+                    try:
+                        yield curr
+                    finally:
+                        _local.cursor = None
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    try:
+                        conn.rollback()
+                    except CONNECTION_ERRORS:
+                        pass
+                raise
+    except CIRCUIT_ERRORS:
+        failed = True
+        raise
+    finally:
+        breaker.record(time.perf_counter() - start_time, failed=failed)
+
+
+def _run_query(q, q_args=None):
+    with transaction() as curr:
+        curr.execute(q, q_args)
+        if curr.description is not None:
+            return curr.fetchall()
+        return None
+
+
+def disable_statement_timeout():
+    """no DB_STATEMENT_TIMEOUT for the rest of the transaction(e.g. a bulk rebuild)"""
+    run_query("SET LOCAL statement_timeout = 0;")
+
+
+def run_query(q, q_args=None):
+    """run query of database"""
+    try:
+        try:
+            return _run_query(q, q_args)
+        except CONNECTION_ERRORS:
+            # a connection dropped by the server(e.g. a postgres restart) fails its
+            # next query, it was replaced so try once more unless the query is part
+            # of a larger transaction
+            if getattr(_local, "cursor", None) is not None:
+                raise
+            print("database connection failed, retrying the query")
+            return _run_query(q, q_args)
+    except CircuitOpenError:
+        # expected while the database is down, not worth a traceback per query
+        raise
+    except Exception as e:
+        print(f"query: {q}")
+        traceback.print_exc()
+        raise e
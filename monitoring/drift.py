@@ -0,0 +1,198 @@
+"""
+native drift calculation, an alternative to the evidently report which gives the
+same metrics(see calculate_native_metrics) at a fraction of the cost.
+
+The reference data is summarized once(ReferenceProfile) into per column quantile
+sketches, decile histograms and category frequencies, so a drift calculation
+never touches the full reference data again.
+"""
+
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import distance
+from scipy.stats import chisquare, distributions
+
+from monitoring.log_evidently_metrics import ds_col_to_simple_col
+
+# "auto" picks the test evidently would use by default for the column
+STATTESTS = ("auto", "wasserstein", "ks", "psi")
+# evidently's default thresholds, a column drifted if the score is >= the
+# threshold(< for the p-values, ks and the small reference categorical tests)
+THRESHOLDS = {"wasserstein": 0.1, "ks": 0.05, "psi": 0.1, "jensenshannon": 0.1}
+# columns with at most this many distinct values are treated as categorical
+MAX_CATEGORIES = 5
+# evidently uses ks instead of wasserstein for references up to this many rows
+KS_MAX_REFERENCE_ROWS = 1000
+
+
+class ReferenceProfile:
+    """summary of the reference data which the drift of a current batch is calculated against"""
+
+    def __init__(
+        self,
+        reference_df: pd.DataFrame,
+        columns: List[str],
+        num_quantiles: int = 1000,
+        num_psi_bins: int = 10,
+    ):
+        self.columns = columns
+        self.num_rows = len(reference_df)
+        values = reference_df[columns].to_numpy(dtype=np.float64)
+
+        self.categories = {}
+        for j in range(len(columns)):
+            unique_values, counts = np.unique(values[:, j], return_counts=True)
+            if len(unique_values) <= MAX_CATEGORIES:
+                self.categories[j] = (unique_values, counts / self.num_rows)
+        self.numeric_idx = np.array(
+            [j for j in range(len(columns)) if j not in self.categories], dtype=int
+        )
+
+        numeric_values = values[:, self.numeric_idx]
+        # quantile function sampled at the middle of num_quantiles equal steps
+        self.probs = (np.arange(num_quantiles) + 0.5) / num_quantiles
+        self.quantiles = np.quantile(
+            numeric_values, self.probs, axis=0, method="inverted_cdf"
+        )
+        self.std = np.maximum(np.std(numeric_values, axis=0), 0.001)
+
+        # inner edges of the reference deciles(by default), every bin holds about
+        # the same share of the reference rows
+        edge_probs = np.arange(1, num_psi_bins) / num_psi_bins
+        self.psi_edges = np.quantile(numeric_values, edge_probs, axis=0)
+        self.psi_percents = get_bin_percents(numeric_values, self.psi_edges)
+
+    def get_stattest(self, stattest: str) -> str:
+        if stattest != "auto":
+            return stattest
+        return "ks" if self.num_rows <= KS_MAX_REFERENCE_ROWS else "wasserstein"
+
+
+def get_bin_percents(values: np.ndarray, inner_edges: np.ndarray) -> np.ndarray:
+    """share of the rows in each bin, for all the columns at once"""
+    num_bins = len(inner_edges) + 1
+    # bin of every value is the number of inner edges below it
+    bin_idx = (values[:, None, :] > inner_edges[None, :, :]).sum(axis=1)
+    counts = (bin_idx[:, None, :] == np.arange(num_bins)[None, :, None]).sum(axis=0)
+    percents = counts / len(values)
+    # empty bins would make the psi infinite
+    return np.maximum(percents, 0.0001)
+
+
+def wasserstein_norm(profile: ReferenceProfile, current: np.ndarray) -> np.ndarray:
+    """wasserstein distance normed by the reference std, the area between the quantile functions"""
+    quantiles = np.quantile(current, profile.probs, axis=0, method="inverted_cdf")
+    return np.abs(profile.quantiles - quantiles).mean(axis=0) / profile.std
+
+
+def ks_pvalue(profile: ReferenceProfile, current: np.ndarray) -> np.ndarray:
+    """p-value of the two sample kolmogorov-smirnov test"""
+    current = np.sort(current, axis=0)
+    n_ref, n_cur = profile.num_rows, len(current)
+    statistics = np.empty(current.shape[1])
+    for j in range(current.shape[1]):
+        # the cdfs only change at these points
+        points = np.concatenate([profile.quantiles[:, j], current[:, j]])
+        cdf_ref = np.searchsorted(profile.quantiles[:, j], points, side="right")
+        cdf_cur = np.searchsorted(current[:, j], points, side="right")
+        statistics[j] = np.abs(cdf_ref / len(profile.probs) - cdf_cur / n_cur).max()
+    return distributions.kstwo.sf(statistics, np.round(n_ref * n_cur / (n_ref + n_cur)))
+
+
+def psi(profile: ReferenceProfile, current: np.ndarray) -> np.ndarray:
+    """population stability index over the reference deciles"""
+    percents = get_bin_percents(current, profile.psi_edges)
+    return (
+        (profile.psi_percents - percents) * np.log(profile.psi_percents / percents)
+    ).sum(axis=0)
+
+
+def category_drift(
+    profile: ReferenceProfile, j: int, current: np.ndarray
+) -> Tuple[float, bool]:
+    """
+    drift of a categorical column from its category frequencies, with the test
+    evidently would use: jensen-shannon distance for large references, else a
+    z-test(two categories) or chi-square test p-value
+    """
+    ref_values, ref_percents = profile.categories[j]
+    values, counts = np.unique(current, return_counts=True)
+    all_values = np.union1d(ref_values, values)
+    ref_p = np.zeros(len(all_values))
+    ref_p[np.searchsorted(all_values, ref_values)] = ref_percents
+    cur_p = np.zeros(len(all_values))
+    cur_p[np.searchsorted(all_values, values)] = counts / len(current)
+
+    if profile.num_rows > KS_MAX_REFERENCE_ROWS:
+        score = float(distance.jensenshannon(ref_p, cur_p))
+        return score, score >= THRESHOLDS["jensenshannon"]
+
+    n_ref, n_cur = profile.num_rows, len(current)
+    if len(all_values) == 1:
+        p_value = 1.0
+    elif len(all_values) == 2:
+        # share of the second category
+        pooled = (ref_p[1] * n_ref + cur_p[1] * n_cur) / (n_ref + n_cur)
+        z = (ref_p[1] - cur_p[1]) / np.sqrt(
+            pooled * (1 - pooled) * (1 / n_ref + 1 / n_cur)
+        )
+        p_value = float(2 * distributions.norm.sf(np.abs(z)))
+    else:
+        expected_p = ref_p
+        if (ref_p == 0).any():
+            # a category the reference doesn't have would have an expected count of
+            # 0, smooth the reference counts(+0.5 each) to keep the test finite
+            expected_p = (ref_p * n_ref + 0.5) / (n_ref + 0.5 * len(all_values))
+        p_value = float(chisquare(cur_p * n_cur, expected_p * n_cur).pvalue)
+    return p_value, p_value < THRESHOLDS["ks"]
+
+
+STATTEST_FUNCS = {"wasserstein": wasserstein_norm, "ks": ks_pvalue, "psi": psi}
+
+
+def calculate_drift(
+    profile: ReferenceProfile, current: np.ndarray, stattest: str = "auto"
+) -> List[Tuple[float, bool]]:
+    """(drift score, drifted) of every column of the profile"""
+    if stattest not in STATTESTS:
+        raise ValueError(f"Unsupported stattest: {stattest}, expected one of {STATTESTS}")
+
+    results = [None] * len(profile.columns)
+
+    stattest = profile.get_stattest(stattest)
+    threshold = THRESHOLDS[stattest]
+    scores = STATTEST_FUNCS[stattest](profile, current[:, profile.numeric_idx])
+    drifted = scores < threshold if stattest == "ks" else scores >= threshold
+    for j, score, is_drifted in zip(profile.numeric_idx, scores, drifted):
+        results[j] = (float(score), bool(is_drifted))
+
+    for j in profile.categories:
+        results[j] = category_drift(profile, j, current[:, j])
+    return results
+
+
+def calculate_native_metrics(
+    profile: ReferenceProfile,
+    X: np.ndarray,
+    y_pred: np.ndarray,
+    numeric_cols: List[str],
+    stattest: str = "auto",
+) -> Dict[str, Union[int, float]]:
+    """
+    the metrics of log_evidently_metrics.calculate_metrics, profile is of
+    numeric_cols + ["prediction"]
+    """
+    current = np.column_stack([X, y_pred]).astype(np.float64, copy=False)
+    results = calculate_drift(profile, current, stattest)
+
+    tracked_metrics = {}
+    for col, (score, _) in zip(numeric_cols, results):
+        tracked_metrics[ds_col_to_simple_col[col] + "__column_drift"] = score
+
+    # like evidently the dataset drift counts the prediction too
+    num_drifted = sum(is_drifted for _, is_drifted in results)
+    tracked_metrics["num_drifted_columns"] = int(num_drifted)
+    tracked_metrics["share_drifted_columns"] = num_drifted / len(results)
+    return tracked_metrics
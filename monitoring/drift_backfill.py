@@ -0,0 +1,169 @@
+"""
+offline drift of logged predictions(the predictions table of the prediction
+log) or of any csv/parquet file, per time bucket, against the model's reference
+profile, used by src/flows/drift_backfill.py.
+
+Every bucket becomes one evidently_metrics row(native drift engine), with
+window_start/window_end/window_rows like the windowed drift mode and backfill=1.
+"""
+
+import datetime
+from pathlib import Path
+from typing import Dict, List, Tuple, Union, Iterator, Optional
+
+import pytz
+import numpy as np
+import pandas as pd
+
+from src.model import Model
+from monitoring.prediction_log import COLUMNS, PREDICTIONS_TABLE
+from monitoring.drift import ReferenceProfile, calculate_native_metrics
+from monitoring.db import run_query, transaction, disable_statement_timeout
+from monitoring.log_evidently_metrics import (
+    ds_col_to_simple_col,
+    load_model_reference_df,
+)
+
+PREDICTION_COL = "prediction"
+simple_col_to_ds_col = {simple: ds for ds, simple in ds_col_to_simple_col.items()}
+
+Bucket = Tuple[datetime.datetime, datetime.datetime]
+
+
+def load_reference_profile(model: Model, model_dir: str) -> ReferenceProfile:
+    reference_df = load_model_reference_df(model, model_dir)
+    return ReferenceProfile(reference_df, [*model.numeric_cols, PREDICTION_COL])
+
+
+def get_buckets(
+    start: datetime.datetime, end: datetime.datetime, bucket_seconds: float
+) -> List[Bucket]:
+    """[start, end) split in buckets of bucket_seconds, the last one may be shorter"""
+    step = datetime.timedelta(seconds=bucket_seconds)
+    buckets = []
+    while start < end:
+        buckets.append((start, min(start + step, end)))
+        start += step
+    return buckets
+
+
+def to_utc_time(timestamps: pd.Series) -> pd.Series:
+    """
+    naive utc like the monitoring tables, numbers are taken as unix timestamps
+    (e.g. the dataset's UTC column) and naive times as utc
+    """
+    if pd.api.types.is_numeric_dtype(timestamps):
+        timestamps = pd.to_datetime(timestamps, unit="s", utc=True)
+    else:
+        timestamps = pd.to_datetime(timestamps)
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_convert("UTC").dt.tz_localize(None)
+    return timestamps
+
+
+def read_logged_predictions(
+    start: datetime.datetime, end: datetime.datetime, model: Optional[str] = None
+) -> pd.DataFrame:
+    """rows of the predictions table in [start, end), only scans those days' partitions"""
+    q = (
+        f"SELECT {', '.join(COLUMNS)} FROM {PREDICTIONS_TABLE} "
+        "WHERE timestamp >= %s AND timestamp < %s"
+    )
+    q_args = [start, end]
+    if model is not None:
+        q += " AND model = %s"
+        q_args.append(model)
+    with transaction():
+        disable_statement_timeout()
+        rows = run_query(q + ";", q_args)
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def iter_file_chunks(path: Union[str, Path], chunksize: int) -> Iterator[pd.DataFrame]:
+    if Path(path).suffix == ".parquet" or Path(path).is_dir():
+        # pylint: disable=import-outside-toplevel
+        import pyarrow.dataset as ds
+
+        for batch in ds.dataset(path, partitioning="hive").to_batches(
+            batch_size=chunksize
+        ):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize)
+
+
+def iter_file_buckets(
+    path: Union[str, Path],
+    bucket_seconds: float,
+    chunksize: int = 100_000,
+    timestamp_col: str = "timestamp",
+) -> Iterator[Tuple[Bucket, pd.DataFrame]]:
+    """
+    rows of a csv/parquet file(or a directory of the parquet prediction log) per
+    bucket, read in chunks. A bucket is yielded once a chunk starts after it, so a
+    time ordered file only keeps about a chunk in memory(an unordered one keeps
+    all of it until the end).
+    """
+    bucket = pd.Timedelta(seconds=bucket_seconds)
+    pending = {}
+    for chunk in iter_file_chunks(path, chunksize):
+        chunk[timestamp_col] = to_utc_time(chunk[timestamp_col])
+        bucket_starts = chunk[timestamp_col].dt.floor(bucket)
+        for bucket_start, rows in chunk.groupby(bucket_starts):
+            pending.setdefault(bucket_start, []).append(rows)
+
+        oldest = chunk[timestamp_col].min()
+        for bucket_start in sorted(pending):
+            if bucket_start + bucket > oldest:
+                break
+            rows = pd.concat(pending.pop(bucket_start), ignore_index=True)
+            yield get_bucket(bucket_start, bucket), rows
+
+    for bucket_start in sorted(pending):
+        rows = pd.concat(pending.pop(bucket_start), ignore_index=True)
+        yield get_bucket(bucket_start, bucket), rows
+
+
+def get_bucket(bucket_start: pd.Timestamp, bucket: pd.Timedelta) -> Bucket:
+    return bucket_start.to_pydatetime(), (bucket_start + bucket).to_pydatetime()
+
+
+def get_features(df: pd.DataFrame, model: Model) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    the model's features(dataset or prediction log column names) and the
+    predictions, made with the model if the file doesn't have them
+    """
+    df = df.rename(columns=simple_col_to_ds_col)
+    X = df[model.numeric_cols].to_numpy(dtype=np.float64)
+    if PREDICTION_COL in df.columns:
+        y_pred = df[PREDICTION_COL].to_numpy()
+    else:
+        y_pred = model.predict(X)
+    return X, y_pred
+
+
+def calculate_bucket_metrics(
+    df: pd.DataFrame,
+    bucket: Bucket,
+    model: Model,
+    profile: ReferenceProfile,
+    stattest: str = "auto",
+    min_rows: int = 100,
+) -> Optional[Tuple[datetime.datetime, Dict]]:
+    """(timestamp, metrics) row of evidently_metrics, None if the bucket has too few rows"""
+    X, y_pred = get_features(df, model)
+    # rows of a model which didn't use one of the features are NULL there
+    is_complete = ~np.isnan(X).any(axis=1)
+    X, y_pred = X[is_complete], y_pred[is_complete]
+    if len(X) < min_rows:
+        return None
+
+    metrics = calculate_native_metrics(profile, X, y_pred, model.numeric_cols, stattest)
+    start, end = (pytz.utc.localize(timestamp) for timestamp in bucket)
+    metrics["window_start"] = start
+    metrics["window_end"] = end
+    metrics["window_rows"] = len(X)
+    metrics["window_rows_seen"] = len(X)
+    metrics["sampling_rate"] = 1.0
+    metrics["backfill"] = 1
+    return end, metrics
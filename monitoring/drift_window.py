@@ -0,0 +1,160 @@
+import time
+import datetime
+import threading
+from typing import Callable, Optional, NamedTuple
+
+import pytz
+import numpy as np
+
+
+class ClosedWindow(NamedTuple):
+    """rows and bounds of a closed window, what its drift row is calculated from"""
+
+    X: np.ndarray
+    y_pred: np.ndarray
+    # window bounds
+    start: datetime.datetime
+    end: datetime.datetime
+    # rows seen while the window was open, more than len(X) if the ring buffer wrapped
+    num_seen: int
+    # share of the requests in the window's time which made it to the window
+    sampling_rate: float
+
+
+def to_datetime(timestamp: float) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(timestamp, pytz.timezone("Asia/Kolkata"))
+
+
+class DriftWindow:
+    """
+    Collects the monitored rows(features + prediction) of a model so the drift is
+    calculated once per window instead of once per request.
+
+    The rows go in a ring buffer of the latest `max_rows` rows. The window closes
+    once `max_rows` rows were added, or `window_seconds` after it opened if it has
+    at least `min_rows` rows by then(otherwise it stays open until it does).
+
+    A due window is closed by the next add(before its rows, which open the next
+    window) or by tick(), which the monitoring worker calls periodically so the
+    window closes when the traffic stops too. Either way it ends at
+    opened + window_seconds(or when it got min_rows rows, if that was later).
+    """
+
+    def __init__(
+        self,
+        num_cols: int,
+        max_rows: int = 1000,
+        window_seconds: float = 60,
+        min_rows: int = 100,
+        clock: Callable[[], float] = time.time,
+    ):
+        if not 1 <= min_rows <= max_rows:
+            raise ValueError(
+                f"expected 1 <= min_rows <= max_rows, got {min_rows}, {max_rows}"
+            )
+
+        self.max_rows = max_rows
+        self.window_seconds = window_seconds
+        self.min_rows = min_rows
+        self.clock = clock
+
+        # the last column holds the predictions
+        self._rows = np.empty((max_rows, num_cols + 1), dtype=np.float64)
+        self._next = 0
+        self._size = 0
+        self._num_seen = 0
+        self._num_added = 0
+        self._num_represented = 0.0
+        self._opened_at = None
+        # time the window got min_rows rows
+        self._min_rows_at = None
+        self._pred_dtype = np.float64
+        self._lock = threading.Lock()
+
+    @property
+    def num_rows(self) -> int:
+        return self._size
+
+    def add(
+        self, X: np.ndarray, y_pred: np.ndarray, sampling_rate: float = 1.0
+    ) -> Optional[ClosedWindow]:
+        """
+        add the rows of a request, returns the window if it was due or they filled
+        it(a full window left after closing a due one is closed by the next tick)
+        """
+        now = self.clock()
+        with self._lock:
+            window = None
+            if self._is_due(now):
+                window = self._close(self._get_due_end())
+
+            if self._opened_at is None:
+                self._opened_at = now
+            self._num_seen += len(X)
+            self._num_added += 1
+            # every sampled request stands for 1 / sampling_rate requests
+            self._num_represented += 1 / sampling_rate
+            self._pred_dtype = y_pred.dtype
+
+            # only the latest max_rows rows can be kept
+            X, y_pred = X[-self.max_rows :], y_pred[-self.max_rows :]
+            n = len(X)
+            idx = (self._next + np.arange(n)) % self.max_rows
+            self._rows[idx, :-1] = X
+            self._rows[idx, -1] = y_pred
+            self._next = (self._next + n) % self.max_rows
+            self._size = min(self._size + n, self.max_rows)
+            if self._min_rows_at is None and self._size >= self.min_rows:
+                self._min_rows_at = now
+
+            if window is None and self._num_seen >= self.max_rows:
+                window = self._close(now)
+        return window
+
+    def tick(self) -> Optional[ClosedWindow]:
+        """close the window if it's full or due, called periodically"""
+        now = self.clock()
+        with self._lock:
+            if self._opened_at is not None and self._num_seen >= self.max_rows:
+                return self._close(now)
+            if self._is_due(now):
+                return self._close(self._get_due_end())
+        return None
+
+    def _is_due(self, now: float) -> bool:
+        return (
+            self._opened_at is not None
+            and now - self._opened_at >= self.window_seconds
+            and self._size >= self.min_rows
+        )
+
+    def _get_due_end(self) -> float:
+        return max(self._opened_at + self.window_seconds, self._min_rows_at)
+
+    def close(self) -> Optional[ClosedWindow]:
+        """close the window early(e.g. on shutdown), None if it has less than min_rows"""
+        with self._lock:
+            if self._size < self.min_rows:
+                return None
+            return self._close(self.clock())
+
+    def _close(self, now: float) -> ClosedWindow:
+        # oldest row first
+        order = (self._next - self._size + np.arange(self._size)) % self.max_rows
+        rows = self._rows[order]
+        window = ClosedWindow(
+            X=rows[:, :-1],
+            y_pred=rows[:, -1].astype(self._pred_dtype),
+            start=to_datetime(self._opened_at),
+            end=to_datetime(now),
+            num_seen=self._num_seen,
+            sampling_rate=self._num_added / self._num_represented,
+        )
+        self._next = 0
+        self._size = 0
+        self._num_seen = 0
+        self._num_added = 0
+        self._num_represented = 0.0
+        self._opened_at = None
+        self._min_rows_at = None
+        return window
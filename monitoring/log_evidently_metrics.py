@@ -1,29 +1,43 @@
 import os
 import datetime
-import traceback
-from typing import Dict, List, Union
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
 
 import pytz
-import psycopg2
 import numpy as np
 import pandas as pd
+import psycopg2.errors
+import psycopg2.errorcodes
 from evidently import ColumnMapping
 from evidently.report import Report
 from evidently.metrics import ColumnDriftMetric, DatasetDriftMetric
 
-from utils import getenv
-from src.model import Model
+from src.model import REFERENCE_FILE_NAME, Model
 from src.prepare_dataset import split_data, prepare_data, read_dataset
 from constants import SEED, MODEL_DIR, TEST_SIZE, MONITORING_ARTIFACT_DIR
 
+# isort: split
+from monitoring.db import MAX_QUERY_ARGS, run_query, transaction
+from monitoring.metrics_rollup import update_rollups, clear_rollup_columns
+
 os.makedirs(MONITORING_ARTIFACT_DIR, exist_ok=True)
 
 REFERENCE_DF_PATH = MONITORING_ARTIFACT_DIR / "reference.csv"
-DB_HOST = getenv("DB_HOST", "localhost")
-PSYCOPG2_CONNECTION_STR = (
-    f"host={DB_HOST} port=5432 " "user=monitoring password=secret dbname=monitoring"
+# timezone of the timestamps the monitoring rows get
+TIMEZONE = pytz.timezone("Asia/Kolkata")
+
+# errors of an insert made with an outdated _evidently_table_columns
+# (looked up by their SQLSTATE, pylint can't see the classes made by psycopg2's C
+# extension)
+SCHEMA_ERRORS = (
+    psycopg2.errors.lookup(psycopg2.errorcodes.UNDEFINED_TABLE),
+    psycopg2.errors.lookup(psycopg2.errorcodes.UNDEFINED_COLUMN),
 )
 
+# columns of the evidently_metrics table, None until they are read from the database.
+# it is replaced(never modified) so the monitoring threads can read it without a lock
+_evidently_table_columns = None
+
 # dataset column name to simplified column name
 ds_col_to_simple_col = {
     'UTC': "utc",
@@ -48,7 +62,7 @@ def _get_reference_data(
     numeric_cols: List[str],
     target: str,
 ) -> np.ndarray:
-    df = read_dataset()
+    df = read_dataset(columns=[*numeric_cols, target])
     X, y = prepare_data(df, numeric_cols=numeric_cols, target=target)
     X_train, _, _, _ = split_data(X, y, test_size=TEST_SIZE, random_state=SEED)
     return X_train
@@ -89,6 +103,21 @@ def load_reference_df() -> pd.DataFrame:
     return reference_df
 
 
+def load_model_reference_df(model: Model, model_dir: str) -> pd.DataFrame:
+    """
+    load the reference df saved with the model at training time, models trained
+    before it was saved get it calculated from the dataset instead.
+    """
+    reference_path = Path(model_dir) / REFERENCE_FILE_NAME
+    if os.path.exists(reference_path):
+        reference_df = pd.read_parquet(reference_path, memory_map=True)
+        print(f"loaded reference df from {reference_path}")
+        return reference_df
+
+    print(f"{reference_path} doesn't exists, calculating reference df from the dataset")
+    return _calc_reference_df(model)
+
+
 def get_column_mapping(numeric_cols: List[str]) -> ColumnMapping:
     column_mapping = ColumnMapping(
         target=None,
@@ -160,6 +189,8 @@ def py_type_to_db_type(value):
         col_type = "integer"
     elif isinstance(value, float):
         col_type = "float"
+    elif isinstance(value, datetime.datetime):
+        col_type = "timestamp"
     else:
         raise NotImplementedError(
             "unsupported type for " f"value: {value}, type: {type(value)}"
@@ -168,41 +199,27 @@ def py_type_to_db_type(value):
     return col_type
 
 
-def run_query(q, q_args=None):
-    """run query of database"""
-    try:
-        with psycopg2.connect(
-            PSYCOPG2_CONNECTION_STR,
-        ) as conn:
-            with conn.cursor() as curr:
-                curr.execute(q, q_args)
-                if curr.description is not None:
-                    return curr.fetchall()
-
-                return None
-
-    except Exception as e:
-        print(f"query: {q}")
-        traceback.print_exc()
-        raise e
-
-
 def truncate_evidently_table():
     run_query("truncate TABLE evidently_metrics;")
 
 
 def drop_evidently_table():
     run_query("drop TABLE if exists evidently_metrics;")
+    clear_evidently_table_columns()
+
+
+def clear_evidently_table_columns():
+    """forget the cached columns, they are read from the database on the next write"""
+    global _evidently_table_columns  # pylint: disable=global-statement
+    _evidently_table_columns = None
 
 
 def get_evidently_table_columns():
-    columns = run_query(
-        """
+    columns = run_query("""
               SELECT COLUMN_NAME from information_schema.columns
               WHERE table_name = 'evidently_metrics'
 
-              """
-    )
+              """)
     columns = [value[0] for value in columns]
     return columns
 
@@ -216,7 +233,10 @@ def add_missing_columns_to_evidently_table(add_columns, column_values):
     """
     add_columns_str = ", ".join(
         [
-            (f"ADD COLUMN {add_columns[i]} " f"{py_type_to_db_type(column_values[i])}")
+            (
+                f"ADD COLUMN IF NOT EXISTS {add_columns[i]} "
+                f"{py_type_to_db_type(column_values[i])}"
+            )
             for i in range(len(add_columns))
         ]
     )
@@ -244,11 +264,28 @@ def create_evidently_table(metrics: Dict[str, Union[int, float]]):
     run_query(create_table_statement.format(columns=columns_str))
 
 
+def create_evidently_timestamp_index():
+    run_query("""
+        CREATE INDEX if not exists evidently_metrics_timestamp_idx
+        ON evidently_metrics (timestamp);
+        """)
+
+
 def refresh_evidently_table_schema(metrics):
+    global _evidently_table_columns  # pylint: disable=global-statement
+
+    columns = _evidently_table_columns
+    if columns is None:
+        columns = frozenset(get_evidently_table_columns())
+        if len(columns) > 0:
+            # tables made before the index existed get it too
+            create_evidently_timestamp_index()
+
     # check if columns are changed
-    columns = get_evidently_table_columns()
     if len(columns) == 0:
         create_evidently_table(metrics)
+        create_evidently_timestamp_index()
+        columns = frozenset(["timestamp", *metrics.keys()])
     else:
         data_columns = list(metrics.keys())
         missing_columns = list(set(data_columns) - set(columns))
@@ -259,37 +296,79 @@ def refresh_evidently_table_schema(metrics):
                 missing_columns,
                 missing_columns_values,
             )
+            columns = columns.union(missing_columns)
+
+    _evidently_table_columns = columns
+
+
+def get_timestamp() -> datetime.datetime:
+    return datetime.datetime.now(TIMEZONE)
 
 
 def log_evidently_metrics(metrics: Dict[str, Union[int, float]]):
+    log_evidently_metrics_batch([(get_timestamp(), metrics)])
 
-    refresh_evidently_table_schema(metrics)
 
-    timestamp = datetime.datetime.now(pytz.timezone("Asia/Kolkata"))
+def log_evidently_metrics_batch(
+    rows: List[Tuple[datetime.datetime, Dict[str, Union[int, float]]]],
+):
+    """insert (timestamp, metrics) rows with multi-row inserts in one transaction"""
+    if len(rows) == 0:
+        return
+
+    # the schema lookup, schema changes and the inserts share one connection
+    try:
+        with transaction():
+            _log_evidently_metrics_batch(rows)
+    except SCHEMA_ERRORS:
+        # the table was changed by someone else(or a schema change of this process
+        # was rolled back), read its columns again and retry once
+        print("evidently_metrics schema is outdated, reading it again")
+        clear_evidently_table_columns()
+        clear_rollup_columns()
+        with transaction():
+            _log_evidently_metrics_batch(rows)
+
+
+def _log_evidently_metrics_batch(
+    rows: List[Tuple[datetime.datetime, Dict[str, Union[int, float]]]],
+):
+    # rows can have different metrics, the table gets all of them and a row
+    # missing a metric gets a NULL
+    all_metrics = {}
+    for _, metrics in rows:
+        for col, value in metrics.items():
+            all_metrics.setdefault(col, value)
+
+    refresh_evidently_table_schema(all_metrics)
 
     insert_statement = """INSERT INTO evidently_metrics
         ({columns})
-        VALUES({placeholders})
+        VALUES {values}
     """
 
-    columns = []
-    columns.extend(list(metrics.keys()))
-
-    query_args = []
-    for col in columns:
-        query_args.append(metrics[col])
-
+    columns = list(all_metrics.keys())
     columns.append("timestamp")
-    query_args.append(timestamp)
-
     columns_str = ", ".join([f'"{col}"' for col in columns])
+    placeholders = "(" + ", ".join(["%s" for _ in columns]) + ")"
+
+    rows_per_insert = max(1, MAX_QUERY_ARGS // len(columns))
+    for i in range(0, len(rows), rows_per_insert):
+        chunk = rows[i : i + rows_per_insert]
+        query_args = []
+        for timestamp, metrics in chunk:
+            query_args.extend([metrics.get(col) for col in columns[:-1]])
+            query_args.append(timestamp)
+
+        run_query(
+            insert_statement.format(
+                columns=columns_str, values=", ".join([placeholders for _ in chunk])
+            ),
+            query_args,
+        )
 
-    run_query(
-        insert_statement.format(
-            columns=columns_str, placeholders=", ".join(["%s" for _ in columns])
-        ),
-        query_args,
-    )
+    # the dashboards read the rollups, they are kept in step with the raw rows
+    update_rollups(rows)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,85 @@
+import datetime
+from typing import List
+
+import pytz
+import numpy as np
+
+from monitoring.db import run_query
+
+COMPARISON_COLUMNS = (
+    "timestamp",
+    "model",
+    "role",
+    "primary_model",
+    "num_rows",
+    "agreement",
+    "prediction_mean",
+    "primary_prediction_mean",
+)
+
+_table_created = False
+
+
+def get_comparison(
+    model: str,
+    role: str,
+    primary_model: str,
+    y_pred: np.ndarray,
+    y_pred_primary: np.ndarray,
+) -> dict:
+    """how a canary/shadow model's predictions compare to the primary model's"""
+    return {
+        "model": model,
+        "role": role,
+        "primary_model": primary_model,
+        "num_rows": len(y_pred),
+        "agreement": float(np.mean(y_pred == y_pred_primary)),
+        "prediction_mean": float(np.mean(y_pred)),
+        "primary_prediction_mean": float(np.mean(y_pred_primary)),
+    }
+
+
+def create_model_comparison_table():
+    run_query("""
+        CREATE TABLE if not exists model_comparison(
+            timestamp timestamp,
+            model varchar,
+            role varchar,
+            primary_model varchar,
+            num_rows integer,
+            agreement float,
+            prediction_mean float,
+            primary_prediction_mean float
+        );
+        """)
+
+
+def drop_model_comparison_table():
+    run_query("drop TABLE if exists model_comparison;")
+
+
+def log_model_comparisons(comparisons: List[dict]):
+    global _table_created  # pylint: disable=global-statement
+    if len(comparisons) == 0:
+        return
+
+    if not _table_created:
+        create_model_comparison_table()
+        _table_created = True
+
+    timestamp = datetime.datetime.now(pytz.timezone("Asia/Kolkata"))
+
+    placeholders = "(" + ", ".join(["%s" for _ in COMPARISON_COLUMNS]) + ")"
+    query_args = []
+    for comparison in comparisons:
+        query_args.extend(
+            [timestamp, *[comparison[col] for col in COMPARISON_COLUMNS[1:]]]
+        )
+
+    run_query(
+        f"""INSERT INTO model_comparison
+        ({", ".join(COMPARISON_COLUMNS)})
+        VALUES {", ".join([placeholders for _ in comparisons])}
+        """,
+        query_args,
+    )
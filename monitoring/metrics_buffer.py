@@ -0,0 +1,122 @@
+import threading
+import traceback
+from typing import Any, List, Callable, Optional
+
+from utils import register_after_fork
+
+
+class MetricsBuffer:
+    """
+    Collects rows(e.g. the evidently metrics of each request) and writes them in
+    bulk with `write_fn(rows)` once `max_rows` are pending, every `flush_interval`
+    seconds and on stop, instead of one transaction per row.
+    """
+
+    def __init__(
+        self,
+        write_fn: Callable[[List[Any]], None],
+        max_rows: int = 100,
+        flush_interval: float = 5,
+        max_pending_rows: int = 10000,
+    ):
+        if max_rows < 1:
+            raise ValueError(f"max_rows should be at least 1, got {max_rows}")
+
+        self.write_fn = write_fn
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        # rows are dropped beyond this, e.g. while the database is down
+        self.max_pending_rows = max_pending_rows
+
+        self.num_written = 0
+        self.num_dropped = 0
+        self.num_failed = 0
+        self._rows = []
+        self._thread = None
+        self._lock = threading.Lock()
+        # serializes the writes of the flusher thread and stop()
+        self._write_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._stopped = False
+        self._start_after_fork = False
+        register_after_fork(self._after_fork)
+
+    @property
+    def num_pending(self) -> int:
+        return len(self._rows)
+
+    def start(self):
+        with self._lock:
+            self._start_after_fork = False
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(
+                target=self._run,
+                name="metrics-buffer",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def add(self, row) -> bool:
+        """buffer a row, returns False if it was dropped"""
+        if self._start_after_fork:
+            self.start()
+
+        with self._lock:
+            if self._stopped or len(self._rows) >= self.max_pending_rows:
+                self.num_dropped += 1
+                return False
+            self._rows.append(row)
+            is_full = len(self._rows) >= self.max_rows
+
+        if is_full:
+            self._flush_event.set()
+        return True
+
+    def flush(self):
+        """write the pending rows now"""
+        with self._write_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            # written in chunks of max_rows, so a backlog isn't one giant insert
+            for i in range(0, len(rows), self.max_rows):
+                chunk = rows[i : i + self.max_rows]
+                try:
+                    self.write_fn(chunk)
+                    self.num_written += len(chunk)
+                except Exception:  # pylint: disable=broad-exception-caught
+                    # a failed write shouldn't stop the buffer, the rows are lost
+                    self.num_failed += len(chunk)
+                    traceback.print_exc()
+
+    def stop(self, timeout: Optional[float] = None):
+        """stop accepting rows and write the pending ones"""
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            thread, self._thread = self._thread, None
+
+        if thread is not None:
+            self._flush_event.set()
+            thread.join(timeout)
+        print(f"flushing metrics buffer ({self.num_pending} pending rows)")
+        self.flush()
+
+    def _after_fork(self):
+        # the pending rows belong to the parent, the child starts empty and starts
+        # its own thread on the first add(if the parent had it running)
+        self._start_after_fork = self._thread is not None and not self._stopped
+        self._rows = []
+        self._thread = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._stopped = False
+
+    def _run(self):
+        while not self._stopped:
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            self.flush()
@@ -0,0 +1,223 @@
+"""
+1 minute and 1 hour rollups of evidently_metrics for the dashboards, so a panel
+over a week reads ~10k(or ~170) rows instead of a row per request.
+
+Every metric column <col> has <col>__avg, <col>__max and <col>__count columns
+in evidently_metrics_1m and evidently_metrics_1h, keyed by the bucket's start.
+The rows written to evidently_metrics are aggregated per bucket and upserted in
+the same transaction, merging with what the bucket already has.
+"""
+
+import datetime
+from typing import Dict, List, Tuple, Union, Iterable, Optional
+
+import pytz
+
+from monitoring.db import (
+    MAX_QUERY_ARGS,
+    run_query,
+    transaction,
+    disable_statement_timeout,
+)
+
+
+def to_utc(timestamp: datetime.datetime) -> datetime.datetime:
+    """
+    naive utc, what postgres stores for the aware timestamps psycopg2 sends, so
+    the buckets line up with the utc hours(not the +05:30 ones)
+    """
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+# table suffix -> timestamp floor of a bucket, and the postgres date_trunc unit
+ROLLUPS = {
+    "1m": (lambda t: to_utc(t).replace(second=0, microsecond=0), "minute"),
+    "1h": (lambda t: to_utc(t).replace(minute=0, second=0, microsecond=0), "hour"),
+}
+AGGREGATES = ("avg", "max", "count")
+
+# metric columns the rollup tables have, None until they are first written in
+# this process. replaced(never modified) like _evidently_table_columns
+_rollup_columns = None
+
+
+def get_rollup_table(rollup: str) -> str:
+    return f"evidently_metrics_{rollup}"
+
+
+def clear_rollup_columns():
+    global _rollup_columns  # pylint: disable=global-statement
+    _rollup_columns = None
+
+
+def get_metric_columns(
+    rows: List[Tuple[datetime.datetime, Dict[str, Union[int, float]]]],
+) -> List[str]:
+    """numeric metrics of the rows, e.g. not the window_start/window_end timestamps"""
+    columns = {}
+    for _, metrics in rows:
+        for col, value in metrics.items():
+            if isinstance(value, (int, float)):
+                columns.setdefault(col, None)
+    return list(columns)
+
+
+def aggregate_rows(
+    rows: List[Tuple[datetime.datetime, Dict[str, Union[int, float]]]],
+    columns: List[str],
+    rollup: str,
+) -> Dict[datetime.datetime, Dict[str, List]]:
+    """bucket -> col -> [avg, max, count] of the rows, NULLs are skipped"""
+    floor = ROLLUPS[rollup][0]
+    buckets = {}
+    for timestamp, metrics in rows:
+        bucket = buckets.setdefault(floor(timestamp), {})
+        for col in columns:
+            value = metrics.get(col)
+            if value is None:
+                continue
+            if col not in bucket:
+                bucket[col] = [0.0, value, 0]
+            aggregates = bucket[col]
+            # the sum until it's divided below
+            aggregates[0] += value
+            aggregates[1] = max(aggregates[1], value)
+            aggregates[2] += 1
+
+    for bucket in buckets.values():
+        for aggregates in bucket.values():
+            aggregates[0] /= aggregates[2]
+    return buckets
+
+
+def get_rollup_column_defs(columns: Iterable[str]) -> List[str]:
+    defs = []
+    for col in columns:
+        defs.append(f'"{col}__avg" float')
+        defs.append(f'"{col}__max" float')
+        defs.append(f'"{col}__count" integer')
+    return defs
+
+
+def refresh_rollup_tables_schema(columns: List[str]):
+    global _rollup_columns  # pylint: disable=global-statement
+
+    known_columns = _rollup_columns
+    if known_columns is None:
+        for rollup in ROLLUPS:
+            run_query(f"""
+                CREATE TABLE if not exists {get_rollup_table(rollup)}(
+                    timestamp timestamp PRIMARY KEY
+                );
+                """)
+        known_columns = frozenset()
+
+    missing_columns = [col for col in columns if col not in known_columns]
+    if len(missing_columns) > 0:
+        add_columns_str = ", ".join(
+            f"ADD COLUMN IF NOT EXISTS {col_def}"
+            for col_def in get_rollup_column_defs(missing_columns)
+        )
+        for rollup in ROLLUPS:
+            run_query(f"ALTER TABLE {get_rollup_table(rollup)} {add_columns_str};")
+        known_columns = known_columns.union(missing_columns)
+
+    _rollup_columns = known_columns
+
+
+def get_merge_sql(col: str) -> str:
+    """SET clause merging a bucket's upserted aggregates into the existing ones"""
+    avg, max_, count = (f'"{col}__{aggregate}"' for aggregate in AGGREGATES)
+    return (
+        f"{avg} = (COALESCE(t.{avg} * t.{count}, 0) "
+        f"+ COALESCE(EXCLUDED.{avg} * EXCLUDED.{count}, 0)) "
+        f"/ NULLIF(COALESCE(t.{count}, 0) + COALESCE(EXCLUDED.{count}, 0), 0), "
+        # greatest ignores NULLs
+        f"{max_} = GREATEST(t.{max_}, EXCLUDED.{max_}), "
+        f"{count} = COALESCE(t.{count}, 0) + COALESCE(EXCLUDED.{count}, 0)"
+    )
+
+
+def update_rollups(rows: List[Tuple[datetime.datetime, Dict[str, Union[int, float]]]]):
+    """upsert the rows' aggregates, called in the transaction which inserts the rows"""
+    columns = get_metric_columns(rows)
+    if len(rows) == 0 or len(columns) == 0:
+        return
+
+    refresh_rollup_tables_schema(columns)
+
+    rollup_columns = [
+        f'"{col}__{aggregate}"' for col in columns for aggregate in AGGREGATES
+    ]
+    placeholders = "(" + ", ".join(["%s"] * (len(rollup_columns) + 1)) + ")"
+    merge_sql = ", ".join(get_merge_sql(col) for col in columns)
+    buckets_per_insert = max(1, MAX_QUERY_ARGS // (len(rollup_columns) + 1))
+    for rollup in ROLLUPS:
+        buckets = aggregate_rows(rows, columns, rollup)
+        # always in the same order, so concurrent upserts lock the rows in the same order
+        bucket_starts = sorted(buckets)
+        for i in range(0, len(bucket_starts), buckets_per_insert):
+            chunk = bucket_starts[i : i + buckets_per_insert]
+            query_args = []
+            for bucket_start in chunk:
+                query_args.append(bucket_start)
+                for col in columns:
+                    query_args.extend(buckets[bucket_start].get(col, [None, None, None]))
+
+            run_query(
+                f"""
+                INSERT INTO {get_rollup_table(rollup)} AS t
+                (timestamp, {", ".join(rollup_columns)})
+                VALUES {", ".join([placeholders] * len(chunk))}
+                ON CONFLICT (timestamp) DO UPDATE SET {merge_sql};
+                """,
+                query_args,
+            )
+
+
+def get_evidently_metric_columns() -> List[str]:
+    rows = run_query("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = 'evidently_metrics'
+        AND data_type IN ('integer', 'double precision');
+        """)
+    return [row[0] for row in rows]
+
+
+def rebuild_rollups(columns: Optional[List[str]] = None):
+    """
+    recalculate the rollups from evidently_metrics, e.g. for the rows logged
+    before the rollups existed
+    """
+    if columns is None:
+        columns = get_evidently_metric_columns()
+    refresh_rollup_tables_schema(columns)
+    aggregates_sql = ", ".join(
+        f'avg("{col}"), max("{col}"), count("{col}")' for col in columns
+    )
+    rollup_columns = ", ".join(
+        f'"{col}__{aggregate}"' for col in columns for aggregate in AGGREGATES
+    )
+    with transaction():
+        disable_statement_timeout()
+        for rollup, (_, unit) in ROLLUPS.items():
+            table = get_rollup_table(rollup)
+            run_query(f"truncate TABLE {table};")
+            run_query(f"""
+                INSERT INTO {table} (timestamp, {rollup_columns})
+                SELECT date_trunc('{unit}', timestamp), {aggregates_sql}
+                FROM evidently_metrics
+                GROUP BY 1;
+                """)
+
+
+def drop_rollup_tables():
+    for rollup in ROLLUPS:
+        run_query(f"drop TABLE if exists {get_rollup_table(rollup)};")
+    clear_rollup_columns()
+
+
+if __name__ == "__main__":
+    rebuild_rollups()
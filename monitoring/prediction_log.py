@@ -0,0 +1,276 @@
+"""
+raw prediction log, every scored row(timestamp, model version, features,
+prediction) so drift can be recomputed with new tests and retraining sets can be
+built from the production traffic.
+
+The requests' arrays are buffered(monitoring.metrics_buffer) and written in
+bulk by a background thread to one of the sinks:
+- PostgresSink: COPY into the predictions table, range partitioned by(utc) day
+- ParquetSink: hourly parquet files under <log_dir>/date=YYYY-MM-DD/(utc)
+"""
+
+import io
+import os
+import re
+import time
+import shutil
+import datetime
+import threading
+from pathlib import Path
+from typing import List, Union, Optional, NamedTuple
+
+import numpy as np
+import pandas as pd
+from psycopg2 import errors, errorcodes
+
+from monitoring.circuit_breaker import CircuitOpenError
+from monitoring.db import run_query, transaction, is_circuit_open
+from monitoring.log_evidently_metrics import ds_col_to_simple_col
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only needed for the parquet sink
+    pa = pq = None
+
+PREDICTION_LOG_SINKS = ("off", "postgres", "parquet")
+PREDICTIONS_TABLE = "predictions"
+# every dataset feature gets a column, the ones a model doesn't use are NULL
+FEATURE_COLUMNS = [col for col in ds_col_to_simple_col.values() if col != "fire_alarm"]
+COLUMNS = ["timestamp", "model", *FEATURE_COLUMNS, "prediction"]
+
+# errors of a COPY made with an outdated partition cache
+# (looked up by their SQLSTATE, pylint can't see the classes made by psycopg2's C
+# extension)
+PARTITION_ERRORS = (
+    errors.lookup(errorcodes.UNDEFINED_TABLE),
+    errors.lookup(errorcodes.CHECK_VIOLATION),
+)
+
+
+class PredictionBatch(NamedTuple):
+    """the rows scored by one request, waiting to be written to the log"""
+
+    timestamp: datetime.datetime
+    model: str
+    numeric_cols: List[str]
+    X: np.ndarray
+    y_pred: np.ndarray
+
+
+def batches_to_df(batches: List[PredictionBatch]) -> pd.DataFrame:
+    """one row per scored row, in the COLUMNS order"""
+    num_rows = np.array([len(batch.X) for batch in batches])
+    features = np.full((num_rows.sum(), len(FEATURE_COLUMNS)), np.nan)
+    start = 0
+    for batch in batches:
+        end = start + len(batch.X)
+        idx = [FEATURE_COLUMNS.index(ds_col_to_simple_col[c]) for c in batch.numeric_cols]
+        features[start:end, idx] = batch.X
+        start = end
+
+    df = pd.DataFrame(features, columns=FEATURE_COLUMNS)
+    # the per request values are repeated for its rows
+    timestamps = pd.DatetimeIndex([batch.timestamp for batch in batches])
+    df.insert(0, "timestamp", timestamps.repeat(num_rows))
+    models = np.array([batch.model for batch in batches], dtype=object)
+    df.insert(1, "model", models.repeat(num_rows))
+    df["prediction"] = np.concatenate([batch.y_pred for batch in batches]).astype(
+        np.float64
+    )
+    return df
+
+
+def get_partition_name(day: datetime.date) -> str:
+    return f"{PREDICTIONS_TABLE}_{day:%Y%m%d}"
+
+
+class PostgresSink:
+    """
+    COPYs the rows into the predictions table, which is range partitioned by day
+    so old days are dropped as whole partitions and a time range scan only reads
+    the days it covers, the brin index on timestamp narrows it down further.
+    """
+
+    def __init__(self, retention_days: int = 30):
+        # partitions older than this many days are dropped, 0 keeps them all
+        self.retention_days = retention_days
+        # days which have a partition, cached like the evidently_metrics columns
+        self._partitions = set()
+
+    def write(self, batches: List[PredictionBatch]):
+        if is_circuit_open():
+            # don't build the rows just to have the copy refused
+            raise CircuitOpenError("the monitoring database circuit is open")
+        df = batches_to_df(batches)
+        try:
+            self._write(df)
+        except PARTITION_ERRORS:
+            # the table or a partition was dropped by someone else, check again
+            print("prediction log partitions changed, retrying the copy")
+            self._partitions = set()
+            self._write(df)
+
+    def _write(self, df: pd.DataFrame):
+        # naive utc like the timestamps psycopg2 writes to the other monitoring
+        # tables(and how grafana reads them), an empty csv field is NULL
+        df = df.assign(
+            timestamp=df["timestamp"].dt.tz_convert("UTC").dt.tz_localize(None)
+        )
+        buffer = io.StringIO()
+        df.to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+
+        with transaction() as curr:
+            self._create_partitions(set(df["timestamp"].dt.date))
+            curr.copy_expert(
+                f"COPY {PREDICTIONS_TABLE} ({', '.join(COLUMNS)}) "
+                "FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+
+    def _create_partitions(self, days: set):
+        missing_days = sorted(days - self._partitions)
+        if len(missing_days) == 0:
+            return
+
+        # gunicorn workers would otherwise race to create the same partition
+        run_query("SELECT pg_advisory_xact_lock(hashtext(%s));", (PREDICTIONS_TABLE,))
+        create_predictions_table()
+        for day in missing_days:
+            next_day = day + datetime.timedelta(days=1)
+            run_query(f"""
+                CREATE TABLE if not exists {get_partition_name(day)}
+                PARTITION OF {PREDICTIONS_TABLE}
+                FOR VALUES FROM ('{day}') TO ('{next_day}');
+                """)
+        self._partitions |= set(missing_days)
+        # a new day is a good time to drop the old ones
+        if self.retention_days > 0:
+            drop_old_partitions(max(missing_days), self.retention_days)
+
+    def close(self):
+        pass
+
+
+def create_predictions_table():
+    columns = ",\n".join(f"{col} double precision" for col in FEATURE_COLUMNS)
+    run_query(f"""
+        CREATE TABLE if not exists {PREDICTIONS_TABLE}(
+            timestamp timestamp NOT NULL,
+            model varchar,
+            {columns},
+            prediction double precision
+        ) PARTITION BY RANGE (timestamp);
+        """)
+    # tiny and good enough for the append only, time ordered rows
+    run_query(f"""
+        CREATE INDEX if not exists {PREDICTIONS_TABLE}_timestamp_idx
+        ON {PREDICTIONS_TABLE} USING brin (timestamp);
+        """)
+
+
+def get_partition_days() -> List[datetime.date]:
+    rows = run_query(
+        """
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = %s;
+        """,
+        (PREDICTIONS_TABLE,),
+    )
+    days = []
+    for (name,) in rows:
+        match = re.fullmatch(PREDICTIONS_TABLE + r"_(\d{8})", name)
+        if match is not None:
+            days.append(datetime.datetime.strptime(match.group(1), "%Y%m%d").date())
+    return sorted(days)
+
+
+def drop_old_partitions(today: datetime.date, retention_days: int):
+    oldest_day = today - datetime.timedelta(days=retention_days)
+    for day in get_partition_days():
+        if day < oldest_day:
+            print(f"dropping prediction log partition of {day}")
+            run_query(f"drop TABLE if exists {get_partition_name(day)};")
+
+
+def drop_predictions_table():
+    run_query(f"drop TABLE if exists {PREDICTIONS_TABLE};")
+
+
+class ParquetSink:
+    """
+    appends the rows to a parquet file per hour and process(a row group per
+    write), <log_dir>/date=YYYY-MM-DD/HH-<pid>.parquet, so a time range can be
+    read with pyarrow.dataset's hive partitioning. A file is readable once it's
+    rolled over(or the sink is closed).
+    """
+
+    def __init__(self, log_dir: Path, retention_days: int = 30):
+        if pa is None:
+            raise ValueError("the parquet prediction log needs pyarrow to be installed")
+        self.log_dir = Path(log_dir)
+        self.retention_days = retention_days
+        self._writer = None
+        self._hour = None
+        self._lock = threading.Lock()
+
+    def write(self, batches: List[PredictionBatch]):
+        df = batches_to_df(batches)
+        # files per utc hour/day, like the postgres partitions
+        df["timestamp"] = df["timestamp"].dt.tz_convert("UTC")
+        hours = df["timestamp"].dt.floor("h")
+        with self._lock:
+            for hour in hours.unique():
+                table = pa.Table.from_pandas(df[hours == hour], preserve_index=False)
+                self._get_writer(hour.to_pydatetime(), table.schema).write_table(table)
+
+    def _get_writer(self, hour: datetime.datetime, schema):
+        if hour == self._hour:
+            return self._writer
+
+        self._close_writer()
+        path = self.log_dir / f"date={hour:%Y-%m-%d}" / f"{hour:%H}-{os.getpid()}.parquet"
+        os.makedirs(path.parent, exist_ok=True)
+        if path.exists():
+            # e.g. the same hour after a restart, parquet files can't be appended to
+            path = path.with_name(f"{path.stem}-{int(time.time())}{path.suffix}")
+        self._writer = pq.ParquetWriter(path, schema)
+        self._hour = hour
+        if self.retention_days > 0:
+            self.drop_old_days(hour.date())
+        return self._writer
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = None
+        self._hour = None
+
+    def drop_old_days(self, today: datetime.date):
+        oldest_day = today - datetime.timedelta(days=self.retention_days)
+        for day_dir in self.log_dir.glob("date=*"):
+            day = datetime.datetime.strptime(day_dir.name, "date=%Y-%m-%d").date()
+            if day < oldest_day:
+                print(f"dropping prediction log files of {day}")
+                shutil.rmtree(day_dir, ignore_errors=True)
+
+    def close(self):
+        with self._lock:
+            self._close_writer()
+
+
+def create_sink(
+    sink: str, log_dir: Path, retention_days: int = 30
+) -> Optional[Union[PostgresSink, ParquetSink]]:
+    if sink == "off":
+        return None
+    if sink == "postgres":
+        return PostgresSink(retention_days)
+    if sink == "parquet":
+        return ParquetSink(log_dir, retention_days)
+    raise ValueError(
+        f"Unsupported prediction log sink: {sink}, expected one of {PREDICTION_LOG_SINKS}"
+    )
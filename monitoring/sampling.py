@@ -0,0 +1,168 @@
+"""
+samplers which pick the requests that get drift monitored, so the monitoring cost
+can be bounded at high request rates.
+
+Every sampler's sample(item) returns the (item, sampling_rate) pairs to monitor
+now, the sampling rate is logged with the metrics so dashboards can correct for it.
+"""
+
+import time
+import random
+import threading
+from typing import Any, List, Tuple, Callable, Optional
+
+SAMPLING_MODES = ("all", "fixed", "reservoir", "budget")
+
+Sampled = List[Tuple[Any, float]]
+
+
+class FixedRateSampler:
+    """monitors every request with probability `rate`"""
+
+    def __init__(self, rate: float = 1.0, seed: Optional[int] = None):
+        if not 0 < rate <= 1:
+            raise ValueError(f"rate should be in (0, 1], got {rate}")
+        self.rate = rate
+        self._random = random.Random(seed)
+
+    def sample(self, item) -> Sampled:
+        rate = self.rate
+        if rate >= 1 or self._random.random() < rate:
+            return [(item, rate)]
+        return []
+
+    def flush(self) -> Sampled:
+        return []
+
+    def record_cost(self, cpu_seconds: float):
+        pass
+
+
+class ReservoirSampler:
+    """
+    monitors `size` requests picked uniformly out of every `window_seconds` window,
+    they are released when the window ends(checked on the next request).
+    """
+
+    def __init__(
+        self,
+        size: int = 100,
+        window_seconds: float = 10,
+        seed: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if size < 1:
+            raise ValueError(f"size should be at least 1, got {size}")
+        self.size = size
+        self.window_seconds = window_seconds
+        self.clock = clock
+        # sampling rate of the last released window
+        self.rate = 1.0
+        self._random = random.Random(seed)
+        self._reservoir = []
+        self._num_seen = 0
+        self._window_start = clock()
+        self._lock = threading.Lock()
+
+    def sample(self, item) -> Sampled:
+        with self._lock:
+            sampled = []
+            if self.clock() - self._window_start >= self.window_seconds:
+                sampled = self._release()
+
+            # algorithm R, every request seen so far has the same chance to be kept
+            self._num_seen += 1
+            if len(self._reservoir) < self.size:
+                self._reservoir.append(item)
+            else:
+                j = self._random.randrange(self._num_seen)
+                if j < self.size:
+                    self._reservoir[j] = item
+            return sampled
+
+    def flush(self) -> Sampled:
+        """release the current window early(e.g. on shutdown)"""
+        with self._lock:
+            return self._release()
+
+    def record_cost(self, cpu_seconds: float):
+        pass
+
+    def _release(self) -> Sampled:
+        if self._num_seen > 0:
+            self.rate = len(self._reservoir) / self._num_seen
+        sampled = [(item, self.rate) for item in self._reservoir]
+        self._reservoir = []
+        self._num_seen = 0
+        self._window_start = self.clock()
+        return sampled
+
+
+class BudgetSampler(FixedRateSampler):
+    """
+    fixed rate sampler which adjusts its rate every `interval` seconds so the
+    monitoring jobs use about `cpu_budget` of a cpu core(0.1 = 10%).
+    """
+
+    def __init__(
+        self,
+        cpu_budget: float = 0.1,
+        initial_rate: float = 1.0,
+        min_rate: float = 0.001,
+        interval: float = 5,
+        seed: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        super().__init__(initial_rate, seed)
+        if cpu_budget <= 0:
+            raise ValueError(f"cpu_budget should be more than 0, got {cpu_budget}")
+        self.cpu_budget = cpu_budget
+        self.min_rate = min_rate
+        self.interval = interval
+        self.clock = clock
+        self._cpu_seconds = 0.0
+        self._interval_start = clock()
+        self._lock = threading.Lock()
+
+    def sample(self, item) -> Sampled:
+        # adjusted here too, so the rate recovers even if no job ran for a while
+        if self.clock() - self._interval_start >= self.interval:
+            self.record_cost(0.0)
+        return super().sample(item)
+
+    def record_cost(self, cpu_seconds: float):
+        """cpu time taken by a monitoring job"""
+        with self._lock:
+            self._cpu_seconds += cpu_seconds
+            now = self.clock()
+            elapsed = now - self._interval_start
+            if elapsed < self.interval:
+                return
+
+            cpu_share = self._cpu_seconds / elapsed
+            # at most halve/double per interval so it doesn't swing on a burst
+            factor = 2.0 if cpu_share == 0 else self.cpu_budget / cpu_share
+            factor = min(max(factor, 0.5), 2.0)
+            self.rate = min(max(self.rate * factor, self.min_rate), 1.0)
+            self._cpu_seconds = 0.0
+            self._interval_start = now
+
+
+def create_sampler(
+    mode: str,
+    rate: float = 1.0,
+    reservoir_size: int = 100,
+    reservoir_seconds: float = 10,
+    cpu_budget: float = 0.1,
+):
+    if mode == "all":
+        return FixedRateSampler(1.0)
+    if mode == "fixed":
+        return FixedRateSampler(rate)
+    if mode == "reservoir":
+        return ReservoirSampler(reservoir_size, reservoir_seconds)
+    if mode == "budget":
+        return BudgetSampler(cpu_budget, initial_rate=rate)
+    raise ValueError(
+        f"Unsupported sampling mode: {mode}, expected one of {SAMPLING_MODES}"
+    )
@@ -0,0 +1,166 @@
+import time
+import queue
+import threading
+import traceback
+from typing import Callable, Optional
+
+from utils import register_after_fork
+
+OVERFLOW_POLICIES = ("drop", "block")
+
+# sentinel which tells a consumer thread to exit
+_STOP = object()
+
+
+class MonitoringWorker:
+    """
+    Runs the monitoring job(drift calculation and logging to database) on
+    background threads so that the request path only has to enqueue the data.
+
+    `tick` is called by one of the threads every `tick_interval` seconds, also
+    when no jobs come in(e.g. to close the drift windows which are due).
+    """
+
+    def __init__(
+        self,
+        job: Callable,
+        queue_size: int = 1000,
+        num_threads: int = 1,
+        overflow_policy: str = "drop",
+        block_timeout: Optional[float] = None,
+        tick: Optional[Callable] = None,
+        tick_interval: float = 1.0,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(
+                (
+                    f"Unsupported overflow_policy: {overflow_policy}, "
+                    f"expected one of {OVERFLOW_POLICIES}"
+                )
+            )
+        if num_threads < 1:
+            raise ValueError(f"num_threads should be at least 1, got {num_threads}")
+
+        self.job = job
+        self.queue_size = queue_size
+        self.num_threads = num_threads
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.tick = tick
+        self.tick_interval = tick_interval
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.num_dropped = 0
+        self.num_failed = 0
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._start_after_fork = False
+        self._last_tick = time.monotonic()
+        register_after_fork(self._after_fork)
+
+    @property
+    def is_running(self) -> bool:
+        return len(self._threads) > 0 and not self._stopped
+
+    def start(self):
+        with self._lock:
+            if self.is_running:
+                return
+            self._stopped = False
+            self._start_after_fork = False
+            self._threads = [
+                threading.Thread(
+                    target=self._run,
+                    name=f"monitoring-worker-{i}",
+                    daemon=True,
+                )
+                for i in range(self.num_threads)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def submit(self, *args) -> bool:
+        """
+        enqueue a monitoring job, returns False if it was dropped
+        because the queue is full(or the worker is stopped).
+        """
+        if self._start_after_fork:
+            self.start()
+
+        if self._stopped:
+            self._count_dropped()
+            return False
+
+        try:
+            if self.overflow_policy == "block":
+                self.queue.put(args, block=True, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(args)
+        except queue.Full:
+            self._count_dropped()
+            return False
+        return True
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        stop accepting new jobs and wait for the queued ones to finish.
+        """
+        with self._lock:
+            if self._stopped or len(self._threads) == 0:
+                return
+            self._stopped = True
+
+        print(f"draining monitoring queue ({self.queue.qsize()} pending jobs)")
+        for _ in self._threads:
+            # sentinels go after the pending jobs so everything queued gets processed
+            self.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _after_fork(self):
+        # threads don't survive a fork, so the child gets its own queue and
+        # threads(started on the first submit, only if the parent had them running)
+        self._start_after_fork = self.is_running
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def _count_dropped(self):
+        with self._lock:
+            self.num_dropped += 1
+
+    def _run(self):
+        while True:
+            if self.tick is not None:
+                self._maybe_tick()
+                try:
+                    item = self.queue.get(timeout=self.tick_interval)
+                except queue.Empty:
+                    continue
+            else:
+                item = self.queue.get()
+            try:
+                if item is _STOP:
+                    return
+                self.job(*item)
+            except Exception:  # pylint: disable=broad-exception-caught
+                # a failing monitoring job should never kill the worker
+                with self._lock:
+                    self.num_failed += 1
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    def _maybe_tick(self):
+        with self._lock:
+            now = time.monotonic()
+            # only one of the threads ticks per interval
+            if now - self._last_tick < self.tick_interval:
+                return
+            self._last_tick = now
+        try:
+            self.tick()
+        except Exception:  # pylint: disable=broad-exception-caught
+            traceback.print_exc()
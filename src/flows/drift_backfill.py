@@ -0,0 +1,106 @@
+import datetime
+from typing import List, Optional
+
+from prefect import flow, task, unmapped, get_run_logger
+
+from src.model import Model
+from constants import DEPLOYMENT_MODEL_DIR
+from monitoring.log_evidently_metrics import log_evidently_metrics_batch
+from monitoring.drift_backfill import (
+    get_buckets,
+    iter_file_buckets,
+    load_reference_profile,
+    read_logged_predictions,
+    calculate_bucket_metrics,
+)
+
+# buckets computed in parallel before their rows are written
+MAX_PENDING_BUCKETS = 32
+
+
+@task
+def load_model_task(model_dir):
+    model = Model.from_model_dir(model_dir)
+    profile = load_reference_profile(model, model_dir)
+    return model, profile
+
+
+@task
+def logged_bucket_drift_task(bucket, model, profile, model_version, stattest, min_rows):
+    # every bucket reads its own time range, so only its partitions are scanned
+    df = read_logged_predictions(*bucket, model=model_version)
+    return calculate_bucket_metrics(df, bucket, model, profile, stattest, min_rows)
+
+
+@task
+def bucket_drift_task(df, bucket, model, profile, stattest, min_rows):
+    return calculate_bucket_metrics(df, bucket, model, profile, stattest, min_rows)
+
+
+@task
+def write_metrics_task(rows):
+    rows = [row for row in rows if row is not None]
+    if len(rows) > 0:
+        log_evidently_metrics_batch(rows)
+    return len(rows)
+
+
+@flow
+def drift_backfill_flow(
+    source: str = "predictions",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    bucket_minutes: float = 60,
+    model_dir: str = str(DEPLOYMENT_MODEL_DIR),
+    model_version: Optional[str] = None,
+    stattest: str = "auto",
+    min_rows: int = 100,
+    timestamp_col: str = "timestamp",
+    chunksize: int = 100_000,
+) -> int:
+    """
+    source is "predictions"(the prediction log table, between the start and end
+    utc times e.g. "2024-07-01T00:00") or the path of a csv/parquet file
+    """
+    logger = get_run_logger()
+    model, profile = load_model_task(model_dir)
+
+    if source == "predictions":
+        if start is None or end is None:
+            raise ValueError("pass start and end to backfill the predictions table")
+        buckets = get_buckets(
+            datetime.datetime.fromisoformat(start),
+            datetime.datetime.fromisoformat(end),
+            bucket_minutes * 60,
+        )
+        logger.info(f"calculating drift of {len(buckets)} buckets")
+        rows = logged_bucket_drift_task.map(
+            buckets,
+            unmapped(model),
+            unmapped(profile),
+            unmapped(model_version),
+            unmapped(stattest),
+            unmapped(min_rows),
+        )
+        num_rows = write_metrics_task([row.result() for row in rows])
+        logger.info(f"logged drift of {num_rows} buckets")
+        return num_rows
+
+    num_rows = 0
+    pending: List = []
+    for bucket, df in iter_file_buckets(
+        source, bucket_minutes * 60, chunksize=chunksize, timestamp_col=timestamp_col
+    ):
+        pending.append(
+            bucket_drift_task.submit(df, bucket, model, profile, stattest, min_rows)
+        )
+        if len(pending) >= MAX_PENDING_BUCKETS:
+            num_rows += write_metrics_task([row.result() for row in pending])
+            pending = []
+    num_rows += write_metrics_task([row.result() for row in pending])
+    logger.info(f"logged drift of {num_rows} buckets")
+    return num_rows
+
+
+if __name__ == "__main__":
+    drift_backfill_flow(source="dataset/smoke_detection_iot.csv.zip", timestamp_col="UTC")
@@ -11,7 +11,7 @@ from constants import SEED, MODEL_DIR, MLFLOW_MODEL_NAME, MLFLOW_TRACKING_URI
 
 @task
 def read_dataset_task(numeric_cols, target):
-    df = read_dataset()
+    df = read_dataset(columns=[*numeric_cols, target])
     X, y = prepare_data(df=df, numeric_cols=numeric_cols, target=target)
     X_train, X_val, y_train, y_val = split_data(X, y, test_size=0.2, random_state=SEED)
 
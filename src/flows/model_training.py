@@ -12,8 +12,8 @@ from constants import (
 
 
 @task
-def read_dataset_task():
-    df = read_dataset()
+def read_dataset_task(columns):
+    df = read_dataset(columns=columns)
     return df
 
 
@@ -47,8 +47,8 @@ def calculate_accuracy_task(model, X, y):
 
 
 @task
-def save_model_task(model, model_dir):
-    model.save(model_dir)
+def save_model_task(model, model_dir, X_reference=None):
+    model.save(model_dir, X_reference=X_reference)
 
 
 @flow
@@ -67,7 +67,7 @@ def train_simple_flow(numeric_cols):
         mlflow.log_param("seed", SEED)
         mlflow.log_param("numeric_cols", numeric_cols)
 
-        df = read_dataset_task()
+        df = read_dataset_task(columns=[*numeric_cols, target])
 
         X, y = prepare_dataset_task(
             df=df,
@@ -100,7 +100,7 @@ def train_simple_flow(numeric_cols):
         mlflow.log_metric("val_acc", score)
 
         logger.info("Saving model artifacts")
-        save_model_task(model, MODEL_DIR)
+        save_model_task(model, MODEL_DIR, X_reference=X_train)
         logger.info(f"Model artifacts saved to {MODEL_DIR}")
 
         mlflow.log_artifacts(local_dir=MODEL_DIR, artifact_path="model")
@@ -18,6 +18,73 @@ from constants import (
     MLFLOW_EXPERIMENT_NAME,
 )
 
+try:
+    # private, only used to check that an estimator predicts the stock linear way
+    from sklearn.linear_model._base import LinearClassifierMixin
+except ImportError:  # moved by another sklearn version, predict through sklearn then
+    LinearClassifierMixin = None
+
+# drift reference data saved next to model.bin/meta.bin
+REFERENCE_FILE_NAME = "reference.parquet"
+
+
+class LinearScorer:
+    """
+    Predicts with the coefficients of a fitted linear classifier using a single
+    numpy matmul, skipping sklearn's per call input validation and dispatch.
+    It does the same computation as LinearClassifierMixin.predict so the
+    predictions are identical.
+    """
+
+    def __init__(self, coef: np.ndarray, intercept: np.ndarray, classes: np.ndarray):
+        self.coef_T = coef.T
+        self.intercept = intercept
+        self.classes = classes
+        self.n_features = coef.shape[1]
+
+    @classmethod
+    def from_estimator(cls, estimator) -> Optional["LinearScorer"]:
+        """returns None if the estimator can't be compiled"""
+        # only estimators using the stock linear predict, so the results stay the same
+        linear_predict = getattr(LinearClassifierMixin, "predict", None)
+        estimator_predict = getattr(type(estimator), "predict", None)
+        if linear_predict is None or estimator_predict is not linear_predict:
+            return None
+        if not all(
+            hasattr(estimator, attr) for attr in ("coef_", "intercept_", "classes_")
+        ):
+            return None
+        # sparsified coefficients go through sklearn
+        if not isinstance(estimator.coef_, np.ndarray) or estimator.coef_.ndim != 2:
+            return None
+        return cls(
+            estimator.coef_,
+            np.asarray(estimator.intercept_),
+            np.asarray(estimator.classes_),
+        )
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X)
+        if X.dtype.kind != "f":
+            X = X.astype(np.float64)
+
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(
+                (
+                    f"X has shape {X.shape}, but the model is "
+                    f"expecting {self.n_features} features as input"
+                )
+            )
+        if not np.isfinite(X).all():
+            raise ValueError("Input X contains NaN or infinity")
+
+        scores = X @ self.coef_T + self.intercept
+        if scores.shape[1] == 1:
+            indices = (scores[:, 0] > 0).astype(np.intp)
+        else:
+            indices = scores.argmax(axis=1)
+        return self.classes.take(indices, axis=0)
+
 
 class Model:
     """
@@ -30,6 +97,19 @@ class Model:
         self.numeric_cols = sorted(numeric_cols)
         self.target = target
         self.model = model
+        self._scorer = None
+        self._scorer_model = None
+
+    @property
+    def scorer(self):
+        """
+        compiled LinearScorer of the wrapped estimator(None if it isn't linear),
+        it is rebuilt whenever self.model is replaced.
+        """
+        if self._scorer_model is not self.model:
+            self._scorer = LinearScorer.from_estimator(self.model)
+            self._scorer_model = self.model
+        return self._scorer
 
     @classmethod
     def from_model_dir(cls, model_dir: str):
@@ -74,9 +154,19 @@ class Model:
                 )
             )
 
+        scorer = self.scorer
+        if scorer is not None:
+            return scorer.predict(X)
         return self.model.predict(X)
 
-    def save(self, model_dir: str):
+    def get_reference_df(self, X: np.ndarray) -> pd.DataFrame:
+        """features + predictions the served data is compared against for drift"""
+        reference_df = pd.DataFrame(X, columns=self.numeric_cols)
+        reference_df["prediction"] = self.predict(X)
+        return reference_df
+
+    def save(self, model_dir: str, X_reference: Optional[np.ndarray] = None):
+        model_dir = Path(model_dir)
         if os.path.exists(model_dir):
             shutil.rmtree(model_dir)
 
@@ -96,6 +186,11 @@ class Model:
                 )
             )
 
+        if X_reference is not None:
+            # computed once here so the server doesn't need the dataset at startup
+            reference_df = self.get_reference_df(X_reference)
+            reference_df.to_parquet(model_dir / REFERENCE_FILE_NAME, index=False)
+
 
 def model_training_pipeline(
     model_dir: str = MODEL_DIR,
@@ -114,7 +209,7 @@ def model_training_pipeline(
         mlflow.log_param("seed", SEED)
         mlflow.log_param("numeric_cols", numeric_cols)
 
-        df = read_dataset()
+        df = read_dataset(columns=[*numeric_cols, target])
 
         model = Model(numeric_cols=numeric_cols, target=target)
 
@@ -140,7 +235,7 @@ def model_training_pipeline(
         mlflow.log_metric("val_acc", score)
 
         print("Saving model artifacts")
-        model.save(MODEL_DIR)
+        model.save(MODEL_DIR, X_reference=X_train)
         print(f"Model artifacts saved to {MODEL_DIR}")
 
         mlflow.log_artifacts(local_dir=MODEL_DIR, artifact_path="model")
@@ -148,8 +243,8 @@ def model_training_pipeline(
 
 def evaluate_model_pipeline(model_dir: str = MODEL_DIR):
     print("\nRunning evaluate model pipeline:")
-    df = read_dataset()
     model = Model.from_model_dir(model_dir)
+    df = read_dataset(columns=[*model.numeric_cols, model.target])
 
     X, y = prepare_data(df=df, numeric_cols=model.numeric_cols, target=model.target)
     X_train, X_val, y_train, y_val = split_data(X, y, test_size=0.2, random_state=SEED)
@@ -1,26 +1,40 @@
 import os
+import re
+import json
 import shutil
+import hashlib
+import tempfile
+from pathlib import Path
 from zipfile import ZipFile
-from typing import Tuple, Optional
+from typing import List, Tuple, Optional
 
 import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 
-from constants import ZIP_PATH, FILE_PATH, EXTRACTED_DIR
+from constants import ZIP_PATH, FILE_PATH, EXTRACTED_DIR, DATASET_CACHE_DIR
 
+# column names -> .npy files of a cache dir
+CACHE_MANIFEST = "columns.json"
+# cache dirs are named by the first 16 hex digits of the zip's sha256
+CACHE_DIR_NAME = re.compile(r"[0-9a-f]{16}")
 
-def unzip_dataset():
-    if not os.path.exists(ZIP_PATH):
+
+def check_zip_exists(zip_path: Path = ZIP_PATH):
+    if not os.path.exists(zip_path):
         raise FileNotFoundError(
             (
-                f"{ZIP_PATH} missing. "
+                f"{zip_path} missing. "
                 "Download it from "
                 "kaggle link: "
                 "https://www.kaggle.com/datasets/deepcontractor/smoke-detection-dataset"
             )
         )
 
+
+def unzip_dataset():
+    check_zip_exists()
+
     if os.path.exists(EXTRACTED_DIR):
         shutil.rmtree(EXTRACTED_DIR)
 
@@ -31,11 +45,74 @@ def unzip_dataset():
     assert os.path.exists(FILE_PATH)
 
 
-def read_dataset():
-    if not os.path.exists(FILE_PATH):
-        unzip_dataset()
-    df = pd.read_csv(FILE_PATH)
-    return df
+def get_zip_hash(zip_path: Path = ZIP_PATH) -> str:
+    digest = hashlib.sha256()
+    with open(zip_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def build_dataset_cache(zip_path: Path, cache_dir: Path):
+    """
+    parse the zipped csv once and save every column as a .npy file in cache_dir,
+    so a read only loads(memory maps) the columns it needs
+    """
+    print(f"building the dataset cache {cache_dir} from {zip_path}")
+    df = pd.read_csv(zip_path)
+    os.makedirs(cache_dir.parent, exist_ok=True)
+    # written next to it and renamed, so a concurrent read never sees half a cache
+    tmp_dir = Path(tempfile.mkdtemp(dir=cache_dir.parent, prefix=".tmp-"))
+    try:
+        files = {}
+        for i, col in enumerate(df.columns):
+            values = df[col].to_numpy()
+            if values.dtype == object:
+                # fixed width strings can be memory mapped, objects can't
+                values = values.astype(str)
+            files[col] = f"{i}.npy"
+            np.save(tmp_dir / files[col], values, allow_pickle=False)
+        with open(tmp_dir / CACHE_MANIFEST, "w", encoding="utf-8") as f:
+            json.dump(files, f)
+        os.rename(tmp_dir, cache_dir)
+    except OSError:
+        # another process renamed its cache first
+        if not (cache_dir / CACHE_MANIFEST).exists():
+            raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # caches of an older zip, anything else in the cache root is left alone
+    for old_dir in cache_dir.parent.iterdir():
+        if old_dir != cache_dir and CACHE_DIR_NAME.fullmatch(old_dir.name):
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def read_dataset(
+    columns: Optional[List[str]] = None,
+    zip_path: Path = ZIP_PATH,
+    cache_dir: Path = DATASET_CACHE_DIR,
+) -> pd.DataFrame:
+    """
+    the dataset's columns(all of them by default) from a columnar cache of the
+    zipped csv, built on the first read of every version of the zip. The columns
+    are read only memory maps of the .npy files.
+    """
+    check_zip_exists(zip_path)
+    cache_dir = Path(cache_dir) / get_zip_hash(zip_path)
+    if not (cache_dir / CACHE_MANIFEST).exists():
+        build_dataset_cache(Path(zip_path), cache_dir)
+
+    with open(cache_dir / CACHE_MANIFEST, encoding="utf-8") as f:
+        files = json.load(f)
+    if columns is None:
+        columns = list(files)
+    missing_columns = [col for col in columns if col not in files]
+    if len(missing_columns) > 0:
+        raise KeyError(f"columns not in the dataset: {missing_columns}")
+
+    data = {col: np.load(cache_dir / files[col], mmap_mode="r") for col in columns}
+    return pd.DataFrame(data, copy=False)
 
 
 def prepare_data(
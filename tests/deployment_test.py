@@ -1,4 +1,24 @@
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import numpy as np
+from prometheus_client import REGISTRY
+from starlette.testclient import TestClient
+
+from src.model import Model
+from deployment import asgi as asgi_module
+from deployment import main as main_module
+from deployment.batching import MicroBatcher
 from deployment.main import is_valid_json_input
+from deployment import service as service_module
+from deployment.model_reloader import ModelReloader
+from deployment.prediction_cache import PredictionCache
+from deployment.streaming import CSV_MIMETYPE, iter_chunks
+from deployment.service import ServedModel, PredictionService
+from deployment.formats import NPY_MIMETYPE, ARROW_MIMETYPE, decode_request
+from deployment.request_schema import RequestSchema, RequestValidationError
 
 
 def test_is_valid_json_input_valid():
@@ -29,3 +49,444 @@ def test_is_valid_json_input_invalid():
     assert not is_valid_json_input(
         [test_data], ["Temperature[C]", "Humidity[%]", "eCO2[ppm]"]
     )
+
+
+def test_micro_batcher_combines_requests():
+    calls = []
+
+    def predict_fn(X):
+        calls.append(len(X))
+        return X[:, 0] * 2
+
+    batcher = MicroBatcher(predict_fn, max_batch_size=64, max_wait_ms=50)
+    batcher.start()
+
+    inputs = [np.full((i + 1, 2), i, dtype=float) for i in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        outputs = list(executor.map(batcher.predict, inputs))
+
+    for X, y_pred in zip(inputs, outputs):
+        assert np.array_equal(y_pred, X[:, 0] * 2)
+
+    stats = batcher.stats.as_dict()
+    assert sum(calls) == sum(len(X) for X in inputs)
+    assert len(calls) < len(inputs)
+    assert stats["num_requests"] == len(inputs)
+    assert sum(stats["batch_size_distribution"].values()) == stats["num_batches"]
+
+
+def test_micro_batcher_separates_predict_fns():
+    def predict_a(X):
+        return X[:, 0]
+
+    def predict_b(X):
+        return X.sum(axis=1)
+
+    batcher = MicroBatcher(predict_a, max_batch_size=64, max_wait_ms=50)
+    batcher.start()
+
+    # rows of different widths(models) can't be concatenated into one batch
+    inputs = [np.ones((1, 2)), np.ones((1, 3))] * 4
+    predict_fns = [predict_a, predict_b] * 4
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        outputs = list(
+            executor.map(
+                lambda args: batcher.predict(args[0], predict_fn=args[1]),
+                zip(inputs, predict_fns),
+            )
+        )
+
+    assert [y_pred.tolist() for y_pred in outputs] == [[1.0], [3.0]] * 4
+
+
+def test_micro_batcher_bypasses_big_requests():
+    batcher = MicroBatcher(lambda X: X[:, 0], max_batch_size=4)
+    batcher.start()
+
+    y_pred = batcher.predict(np.ones((10, 2)))
+
+    assert len(y_pred) == 10
+    assert batcher.stats.num_bypassed == 1
+
+
+def test_request_schema_parse():
+    schema = RequestSchema(["Temperature[C]", "Humidity[%]"])
+    test_data = [
+        {"Humidity[%]": 32, "Temperature[C]": 23.5, "extra": "a"},
+        {"Temperature[C]": 30, "Humidity[%]": 14},
+    ]
+
+    X = schema.parse(test_data)
+
+    assert X.dtype == np.float64
+    assert np.array_equal(X, np.array([[23.5, 32], [30, 14]]))
+
+
+def test_request_schema_single_column():
+    schema = RequestSchema(["Temperature[C]"], dtype=np.float32)
+
+    X = schema.parse([{"Temperature[C]": 23}, {"Temperature[C]": 30}])
+
+    assert X.dtype == np.float32
+    assert X.shape == (2, 1)
+    assert not schema.is_valid([{"Temperature[C]": [1, 2]}, {"Temperature[C]": [3, 4]}])
+
+
+def test_request_schema_row_errors():
+    schema = RequestSchema(["Temperature[C]", "Humidity[%]"])
+    test_data = [
+        {"Temperature[C]": 23, "Humidity[%]": 32},
+        {"Temperature[C]": 30},
+        {"Temperature[C]": "30", "Humidity[%]": 14},
+        [30, 14],
+    ]
+
+    with pytest.raises(RequestValidationError) as excinfo:
+        schema.parse(test_data)
+
+    assert excinfo.value.row_errors == [
+        "row 1: missing feature 'Humidity[%]'",
+        "row 2: feature 'Temperature[C]' should be a number, got str",
+        "row 3: expected an object, got list",
+    ]
+
+
+def test_request_schema_out_of_range():
+    schema = RequestSchema(["Temperature[C]", "Humidity[%]"])
+    # too big for int64 but fine as a float64
+    X = schema.parse([{"Temperature[C]": 10**30, "Humidity[%]": 32}])
+    assert X[0, 0] == 1e30
+
+    with pytest.raises(RequestValidationError) as excinfo:
+        schema.parse(
+            [
+                {"Temperature[C]": 23, "Humidity[%]": 32},
+                {"Temperature[C]": 10**400, "Humidity[%]": 32},
+            ]
+        )
+    assert excinfo.value.row_errors == ["row 1: feature 'Temperature[C]' is out of range"]
+
+
+def test_request_schema_parse_columns():
+    schema = RequestSchema(["Temperature[C]", "Humidity[%]"])
+
+    X = schema.parse_columns({"Humidity[%]": [32, 14], "Temperature[C]": [23, 30]})
+
+    assert np.array_equal(X, np.array([[23, 32], [30, 14]]))
+    assert not schema.is_valid({"Temperature[C]": [23, 30]})
+    with pytest.raises(RequestValidationError):
+        schema.parse_columns({"Humidity[%]": [32], "Temperature[C]": [23, 30]})
+
+
+def test_decode_npy_without_copy():
+    schema = RequestSchema(["Temperature[C]", "Humidity[%]"])
+    X_expected = np.array([[23, 32], [30, 14]], dtype=np.float64)
+    buffer = io.BytesIO()
+    np.save(buffer, X_expected)
+
+    X, columnar = decode_request(NPY_MIMETYPE, buffer.getvalue(), schema)
+
+    assert columnar
+    assert np.array_equal(X, X_expected)
+    # the array is a view over the request body
+    assert not X.flags.owndata
+
+    with pytest.raises(RequestValidationError):
+        decode_request(NPY_MIMETYPE, buffer.getvalue()[:-8], schema)
+
+
+def test_decode_arrow_rejects_non_finite():
+    pa = pytest.importorskip("pyarrow")
+    schema = RequestSchema(["Temperature[C]", "Humidity[%]"])
+    table = pa.table({"Temperature[C]": [20.0, np.nan], "Humidity[%]": [50.0, np.inf]})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    with pytest.raises(RequestValidationError, match="row 1") as e:
+        decode_request(ARROW_MIMETYPE, sink.getvalue().to_pybytes(), schema)
+    assert e.value.row_errors == [
+        "row 1: feature 'Temperature[C]' should be a finite number, got nan"
+    ]
+
+
+def test_iter_chunks_csv():
+    schema = RequestSchema(["Temperature[C]", "Humidity[%]"])
+    stream = io.BytesIO(b"Humidity[%],Temperature[C],other\n" + b"32,23,a\n" * 5)
+
+    chunks = list(iter_chunks(CSV_MIMETYPE, stream, schema, chunk_size=2))
+
+    assert [len(X) for X in chunks] == [2, 2, 1]
+    assert np.array_equal(chunks[0], np.array([[23, 32], [23, 32]]))
+
+
+def test_request_schema_rejects_non_finite():
+    schema = RequestSchema(["Temperature[C]", "Humidity[%]"])
+    with pytest.raises(RequestValidationError, match="row 1") as e:
+        schema.parse_array(np.array([[1.0, 2.0], [np.nan, 3.0], [4.0, np.inf]]))
+    assert e.value.row_errors == [
+        "row 1: feature 'Temperature[C]' should be a finite number, got nan",
+        "row 2: feature 'Humidity[%]' should be a finite number, got inf",
+    ]
+    with pytest.raises(RequestValidationError):
+        schema.parse([{"Temperature[C]": float("nan"), "Humidity[%]": 1}])
+
+
+def test_predict_stream_csv_with_blank_cell(monkeypatch):
+    model = Model(numeric_cols=["Temperature[C]", "Humidity[%]"], target="Fire Alarm")
+    model.model = CountingModel()
+    monkeypatch.setattr(service_module, "LOG_TO_DB_FLAG", False)
+    monkeypatch.setattr(service_module, "STREAM_CHUNK_SIZE", 2)
+    monkeypatch.setattr(
+        main_module,
+        "create_prediction_service",
+        lambda: PredictionService(model, model_dir=""),
+    )
+    client = main_module.create_app().test_client()
+
+    body = b"Temperature[C],Humidity[%]\n20,50\n30,60\n40,\n"
+    response = client.post("/predict/stream", data=body, content_type=CSV_MIMETYPE)
+
+    assert response.status_code == 200
+    lines = response.get_data(as_text=True).splitlines()
+    # the first chunk is answered, then the stream ends with the error
+    assert lines[:3] == ["prediction", "1", "1"]
+    assert "row 2" in lines[3] and '"error"' in lines[3]
+
+
+@pytest.mark.parametrize(
+    "body,content_type,status",
+    [
+        (b'[{"Temperature[C]": 20, "Humidity[%]": 50}]', "application/json", 200),
+        (b'[{"Temperature[C]": 20}]', "application/json", 200),
+        (b"[]", "application/json", 200),
+        (b"", None, 200),
+        (b'[{"Temperature[C]": 20,', "application/json", 400),
+    ],
+)
+def test_asgi_predict_matches_flask(monkeypatch, body, content_type, status):
+    model = Model(numeric_cols=["Temperature[C]", "Humidity[%]"], target="Fire Alarm")
+    model.model = CountingModel()
+    monkeypatch.setattr(service_module, "LOG_TO_DB_FLAG", False)
+    for module in (main_module, asgi_module):
+        monkeypatch.setattr(
+            module,
+            "create_prediction_service",
+            lambda: PredictionService(model, model_dir=""),
+        )
+    headers = {} if content_type is None else {"Content-Type": content_type}
+
+    flask_client = main_module.create_app().test_client()
+    flask_response = flask_client.post("/predict", data=body, headers=headers)
+    asgi_app = asgi_module.create_asgi_app()
+    with TestClient(asgi_app) as asgi_client:
+        asgi_response = asgi_client.post("/predict", content=body, headers=headers)
+    # the /test client is closed on shutdown
+    assert asgi_app.state.http_client.is_closed
+
+    assert flask_response.status_code == asgi_response.status_code == status
+    assert asgi_response.json() == flask_response.get_json()
+
+
+class CountingModel:
+    """Mock Model which counts the rows it predicts"""
+
+    def __init__(self):
+        self.num_rows = 0
+
+    def predict(self, X):
+        self.num_rows += len(X)
+        return (X[:, 0] > 25).astype(int)
+
+
+def test_prediction_cache_only_predicts_misses():
+    model = CountingModel()
+    cache = PredictionCache(max_size=10, precision=1)
+
+    y_pred = cache.predict(model, np.array([[20.01, 30.0], [30.0, 40.0]]))
+    assert y_pred.tolist() == [0, 1]
+    assert model.num_rows == 2
+
+    # first row is a hit once rounded, second one is new
+    y_pred = cache.predict(model, np.array([[20.0, 30.04], [26.0, 40.0], [30.0, 40.0]]))
+    assert y_pred.tolist() == [0, 1, 1]
+    assert model.num_rows == 3
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_prediction_cache_eviction_and_reload():
+    model = CountingModel()
+    cache = PredictionCache(max_size=2)
+
+    cache.predict(model, np.array([[1.0], [2.0], [3.0]]))
+    assert len(cache) == 2
+
+    # the least recently used row was evicted
+    cache.predict(model, np.array([[1.0]]))
+    assert model.num_rows == 4
+
+    # a new model gets a fresh cache
+    cache.predict(CountingModel(), np.array([[1.0]]))
+    assert len(cache) == 1
+
+
+def get_sample_value(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_prediction_service_metrics():
+    model = Model(numeric_cols=["Temperature[C]"], target="Fire Alarm")
+    model.model = CountingModel()
+    service = PredictionService(model, model_dir="")
+
+    requests_before = get_sample_value(
+        "prediction_requests_total", format="application/json"
+    )
+    rows_before = get_sample_value("prediction_rows_total")
+    errors_before = get_sample_value("prediction_errors_total", reason="invalid_json")
+    predict_before = get_sample_value(
+        "prediction_stage_duration_seconds_count", stage="predict"
+    )
+
+    body = b'[{"Temperature[C]": 20}, {"Temperature[C]": 30}]'
+    assert service.predict_request("application/json", body).data == [0, 1]
+    assert service.predict_request("application/json", b"{").status == 400
+
+    requests = get_sample_value("prediction_requests_total", format="application/json")
+    assert requests - requests_before == 2
+    assert get_sample_value("prediction_rows_total") - rows_before == 2
+    errors = get_sample_value("prediction_errors_total", reason="invalid_json")
+    assert errors - errors_before == 1
+    predict = get_sample_value("prediction_stage_duration_seconds_count", stage="predict")
+    assert predict - predict_before == 1
+
+
+def test_model_reloader_swaps_model(tmp_path):
+    model_dir = tmp_path / "model"
+    model = Model(numeric_cols=["Temperature[C]"], target="Fire Alarm")
+    model.train_model(np.array([[10.0], [20.0], [30.0], [40.0]]), np.array([0, 0, 1, 1]))
+    model.save(model_dir)
+
+    service = PredictionService(Model.from_model_dir(model_dir), model_dir)
+    reloader = ModelReloader(service, model_dir)
+    old_served = service.served
+    assert not reloader.check()
+
+    new_model = Model(numeric_cols=["Temperature[C]", "Humidity[%]"], target="Fire Alarm")
+    new_model.train_model(
+        np.array([[10.0, 0], [20.0, 0], [30.0, 1], [40.0, 1]]), [0, 0, 1, 1]
+    )
+    new_model.save(model_dir)
+
+    # the files have to stay the same for two checks in a row
+    assert not reloader.check()
+    assert reloader.check()
+    assert service.served is not old_served
+    assert service.model.numeric_cols == new_model.numeric_cols
+
+    body = b'[{"Temperature[C]": 20}]'
+    assert "error" in service.predict_request("application/json", body).data
+    body = b'[{"Temperature[C]": 20, "Humidity[%]": 0}]'
+    assert service.predict_request("application/json", body).data == [0]
+
+    # a broken model keeps the old one served
+    (model_dir / "model.bin").write_bytes(b"broken")
+    assert not reloader.check()
+    assert not reloader.check()
+    assert service.model.numeric_cols == new_model.numeric_cols
+
+
+def test_model_reloader_seeded_version_and_start_after_fork(tmp_path, monkeypatch):
+    model_dir = tmp_path / "model"
+    model = Model(numeric_cols=["Temperature[C]"], target="Fire Alarm")
+    model.train_model(np.array([[10.0], [20.0], [30.0], [40.0]]), np.array([0, 0, 1, 1]))
+    model.save(model_dir)
+
+    service = PredictionService(Model.from_model_dir(model_dir), model_dir)
+    reloader = ModelReloader(
+        service, model_dir, interval=60, mlflow_alias="champion", loaded_version="2"
+    )
+    mlflow_model = type("ModelVersion", (), {"version": "2"})()
+    monkeypatch.setattr(reloader, "_get_mlflow_model", lambda: mlflow_model)
+    # the served version isn't downloaded and loaded again
+    assert not reloader.check()
+
+    # the master(preload_app) doesn't watch, its workers do on their first request
+    def is_watching():
+        return any(thread.name == "model-reloader" for thread in threading.enumerate())
+
+    reloader.start(after_fork=True)
+    assert not is_watching()
+    reloader.start_after_fork()
+    assert is_watching()
+    reloader.stop()
+    assert not is_watching()
+
+
+def get_served_model(numeric_cols, key):
+    model = Model(numeric_cols=numeric_cols, target="Fire Alarm")
+    # predicts 1 when the first(sorted) column is above 25
+    model.model = CountingModel()
+    return ServedModel(model, model_dir="", key=key)
+
+
+def test_get_model_version(monkeypatch):
+    monkeypatch.setattr(service_module, "model_dir", "artifacts/model")
+    monkeypatch.setattr(service_module, "MLFLOW_MODEL_VERSION", "3")
+    get_model_version = service_module.get_model_version
+    primary_key = service_module.PRIMARY_MODEL_KEY
+
+    assert get_model_version("artifacts/versions/4", primary_key) == "v4"
+    assert get_model_version("artifacts/model", "shadow") == "shadow"
+    monkeypatch.setattr(service_module, "DOWLOAD_MODEL_FLAG", True)
+    # the registry version downloaded to MODEL_DIR
+    assert get_model_version("artifacts/model", primary_key) == "v3"
+    assert get_model_version("other/model", primary_key) == "other/model"
+    monkeypatch.setattr(service_module, "DOWLOAD_MODEL_FLAG", False)
+    assert get_model_version("artifacts/model", primary_key) == "artifacts/model"
+
+
+def test_drift_window_only_for_primary_model(monkeypatch):
+    monkeypatch.setattr(service_module, "DRIFT_WINDOW_FLAG", True)
+    numeric_cols = ["Temperature[C]", "Humidity[%]"]
+
+    primary = get_served_model(numeric_cols, service_module.PRIMARY_MODEL_KEY)
+    assert primary.drift_window is not None
+    # the canary and shadow models aren't drift monitored
+    assert get_served_model(numeric_cols, "v2").drift_window is None
+
+
+def test_prediction_service_canary_and_shadow(monkeypatch):
+    comparisons = []
+    monkeypatch.setattr(service_module, "log_model_comparisons", comparisons.extend)
+
+    model = Model(numeric_cols=["Temperature[C]"], target="Fire Alarm")
+    model.model = CountingModel()
+    canary = get_served_model(["Humidity[%]", "Temperature[C]"], "v2")
+    shadow = get_served_model(["Humidity[%]"], "v3")
+    service = PredictionService(
+        model, model_dir="", canary=canary, canary_percent=100, shadows=[shadow]
+    )
+    routes = service.routes
+    assert routes.numeric_cols == ["Humidity[%]", "Temperature[C]"]
+
+    # requests with every model's features go to the canary
+    body = b'[{"Temperature[C]": 30, "Humidity[%]": 20}]'
+    assert service.predict_request("application/json", body).data == [0]
+    assert canary.model.model.num_rows == 1
+
+    # the primary model's features are enough
+    body = b'[{"Temperature[C]": 30}]'
+    assert service.predict_request("application/json", body).data == [1]
+    assert service.model.model.num_rows == 1
+
+    X_all = np.array([[20.0, 30.0], [30.0, 20.0]])
+    service.score_secondary_models(X_all, np.array([0, 1]), canary, routes)
+    assert [(c["model"], c["role"]) for c in comparisons] == [
+        ("v2", "canary"),
+        ("v3", "shadow"),
+    ]
+    # primary predicts [1, 0] from temperature, the shadow [0, 1] from humidity
+    assert comparisons[0]["agreement"] == 0.0
+    assert comparisons[1]["agreement"] == 0.0
+    assert comparisons[1]["primary_prediction_mean"] == 0.5
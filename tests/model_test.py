@@ -3,6 +3,8 @@ import numpy as np
 import pandas as pd
 
 from src.model import Model
+from src import model as model_module
+from src.prepare_dataset import read_dataset
 
 
 def get_numeric_cols():
@@ -84,3 +86,120 @@ def test_predict_other():
         model.predict(dummy_other_data)
 
     assert excinfo.type is TypeError
+
+
+def get_trained_model(n_classes=2, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(500, 2)) * [10, 30] + [20, 50]
+    y = rng.integers(0, n_classes, size=500)
+    model = get_model_object()
+    model.train_model(X, y)
+    return model
+
+
+@pytest.mark.parametrize("n_classes", [2, 3])
+def test_linear_scorer_parity(n_classes):
+    model = get_trained_model(n_classes=n_classes)
+    assert model.scorer is not None
+
+    rng = np.random.default_rng(1)
+    X_float = rng.normal(size=(10_000, 2)) * [10, 30] + [20, 50]
+    # points right around the decision boundary are the ones that could flip
+    scores = model.model.decision_function(X_float)
+    if n_classes == 2:
+        margins = np.abs(scores)
+    else:
+        top_2_scores = np.sort(scores, axis=1)[:, -2:]
+        margins = top_2_scores[:, 1] - top_2_scores[:, 0]
+    X_boundary = X_float[np.argsort(margins)[:100]]
+
+    for X in [
+        X_float,
+        X_boundary,
+        X_float.astype(np.float32),
+        X_float.round().astype(np.int64),
+        np.asfortranarray(X_float),
+    ]:
+        assert np.array_equal(model.predict(X), model.model.predict(X))
+
+    X_df = pd.DataFrame(X_float, columns=get_numeric_cols())
+    y_expected = model.model.predict(X_df[model.numeric_cols].values)
+    assert np.array_equal(model.predict(X_df), y_expected)
+
+
+def test_linear_scorer_invalid_input():
+    model = get_trained_model()
+
+    with pytest.raises(ValueError):
+        model.predict(np.ones((3, 3)))
+
+    with pytest.raises(ValueError):
+        model.predict(np.array([[np.nan, 1.0]]))
+
+
+def test_linear_scorer_fallback():
+    model = get_model_object(model=ModelMock())
+    assert model.scorer is None
+
+    # replacing the estimator rebuilds the scorer
+    model.model = get_trained_model().model
+    assert model.scorer is not None
+
+
+def test_linear_scorer_without_sklearn_mixin(monkeypatch):
+    # sklearn's private LinearClassifierMixin can move, the model then predicts
+    # through sklearn
+    monkeypatch.setattr(model_module, "LinearClassifierMixin", None)
+    model = get_trained_model()
+    assert model.scorer is None
+
+    X = np.array([[10.0, 40.0], [30.0, 60.0]])
+    assert np.array_equal(model.predict(X), model.model.predict(X))
+
+
+def test_save_reference_df(tmp_path):
+    model = get_trained_model()
+    X = get_dummy_data()
+    model.save(tmp_path, X_reference=X)
+
+    reference_df = pd.read_parquet(tmp_path / "reference.parquet")
+    assert list(reference_df.columns) == [*model.numeric_cols, "prediction"]
+    assert np.array_equal(reference_df[model.numeric_cols].values, X)
+    assert np.array_equal(reference_df["prediction"].values, model.predict(X))
+
+    # the reference df is optional
+    model.save(tmp_path)
+    assert not (tmp_path / "reference.parquet").exists()
+    assert Model.from_model_dir(tmp_path).numeric_cols == model.numeric_cols
+
+
+def test_read_dataset_columnar_cache(tmp_path, monkeypatch):
+    df = pd.DataFrame(
+        {"UTC": [1, 2, 3], "Temperature[C]": [20.0, 20.5, 21.0], "Fire Alarm": [0, 1, 1]}
+    )
+    zip_path = tmp_path / "dataset.csv.zip"
+    df.to_csv(zip_path, index=False)
+    cache_dir = tmp_path / "cache"
+
+    assert read_dataset(zip_path=zip_path, cache_dir=cache_dir).equals(df)
+
+    # later reads don't parse the csv and only load the asked columns
+    monkeypatch.setattr(pd, "read_csv", None)
+    projected = read_dataset(
+        ["Fire Alarm", "UTC"], zip_path=zip_path, cache_dir=cache_dir
+    )
+    assert projected.equals(df[["Fire Alarm", "UTC"]])
+    # memory mapped
+    assert not projected["UTC"].to_numpy().flags.writeable
+    with pytest.raises(KeyError):
+        read_dataset(["CNT"], zip_path=zip_path, cache_dir=cache_dir)
+    monkeypatch.undo()
+
+    # a new zip gets a new cache, the old one is removed(but not other dirs)
+    old_caches = list(cache_dir.iterdir())
+    (cache_dir / "notes").mkdir()
+    df.iloc[:2].to_csv(zip_path, index=False)
+    assert len(read_dataset(zip_path=zip_path, cache_dir=cache_dir)) == 2
+    caches = sorted(path.name for path in cache_dir.iterdir())
+    assert len(caches) == 2 and "notes" in caches
+    assert not old_caches[0].exists()
@@ -0,0 +1,679 @@
+import time
+import datetime
+import warnings
+import threading
+
+import pytz
+import pytest
+import psycopg2
+import numpy as np
+import pandas as pd
+
+from src.model import Model
+from benchmarks.fake_db import FakeDatabase
+
+# isort: split
+from monitoring.db import run_query
+from monitoring.worker import MonitoringWorker
+from monitoring.drift_window import DriftWindow
+from monitoring.metrics_buffer import MetricsBuffer
+from monitoring import db, metrics_rollup, log_evidently_metrics
+from monitoring.circuit_breaker import CircuitBreaker, CircuitOpenError
+from monitoring.sampling import (
+    BudgetSampler,
+    FixedRateSampler,
+    ReservoirSampler,
+)
+from monitoring.drift import (
+    ReferenceProfile,
+    category_drift,
+    calculate_native_metrics,
+)
+from monitoring.drift_backfill import (
+    get_buckets,
+    iter_file_buckets,
+    calculate_bucket_metrics,
+)
+from monitoring.log_evidently_metrics import (
+    TIMEZONE,
+    calculate_metrics,
+    load_model_reference_df,
+)
+from monitoring.prediction_log import (
+    ParquetSink,
+    PostgresSink,
+    PredictionBatch,
+    get_partition_days,
+)
+
+
+def test_monitoring_worker_runs_jobs():
+    results = []
+    worker = MonitoringWorker(results.append, queue_size=10, num_threads=2)
+    worker.start()
+
+    for i in range(5):
+        assert worker.submit(i)
+
+    worker.stop(timeout=5)
+    assert sorted(results) == [0, 1, 2, 3, 4]
+
+
+def test_monitoring_worker_ticks_without_jobs():
+    ticks = []
+    worker = MonitoringWorker(
+        lambda _: None, tick=lambda: ticks.append(1), tick_interval=0.01
+    )
+    worker.start()
+    deadline = time.time() + 5
+    while len(ticks) < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    worker.stop(timeout=5)
+    assert len(ticks) >= 3
+
+
+def test_monitoring_worker_drop_policy():
+    release = threading.Event()
+    worker = MonitoringWorker(lambda _: release.wait(5), queue_size=1)
+    worker.start()
+
+    # the first job keeps the thread busy, the second one fills the queue
+    worker.submit(0)
+    time.sleep(0.1)
+    assert worker.submit(1)
+    assert not worker.submit(2)
+    assert worker.num_dropped == 1
+
+    release.set()
+    worker.stop(timeout=5)
+
+
+def test_monitoring_worker_block_policy_timeout():
+    release = threading.Event()
+    worker = MonitoringWorker(
+        lambda _: release.wait(5),
+        queue_size=1,
+        overflow_policy="block",
+        block_timeout=0.05,
+    )
+    worker.start()
+
+    worker.submit(0)
+    time.sleep(0.1)
+    worker.submit(1)
+    assert not worker.submit(2)
+
+    release.set()
+    worker.stop(timeout=5)
+
+
+def test_monitoring_worker_survives_failing_job():
+    def job(value):
+        if value == 0:
+            raise ValueError("failed")
+        results.append(value)
+
+    results = []
+    worker = MonitoringWorker(job)
+    worker.start()
+    worker.submit(0)
+    worker.submit(1)
+    worker.stop(timeout=5)
+
+    assert worker.num_failed == 1
+    assert results == [1]
+
+
+def test_monitoring_worker_invalid_policy():
+    with pytest.raises(ValueError):
+        MonitoringWorker(print, overflow_policy="ignore")
+
+
+def test_load_model_reference_df(tmp_path):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(100, 2))
+    model = Model(numeric_cols=["Temperature[C]", "Humidity[%]"], target="Fire Alarm")
+    model.train_model(X, X[:, 0] > 0)
+    model.save(tmp_path, X_reference=X)
+
+    reference_df = load_model_reference_df(model, tmp_path)
+    assert reference_df.shape == (100, 3)
+    assert np.array_equal(reference_df["prediction"].values, model.predict(X))
+
+
+def test_log_evidently_metrics_with_fake_db(monkeypatch):
+    fake_db = FakeDatabase(latency_ms=0)
+    monkeypatch.setattr(db, "_pool", fake_db)
+    monkeypatch.setattr(log_evidently_metrics, "_evidently_table_columns", None)
+    monkeypatch.setattr(metrics_rollup, "_rollup_columns", None)
+
+    log_evidently_metrics.log_evidently_metrics({"num_drifted_columns": 1})
+    log_evidently_metrics.log_evidently_metrics(
+        {"num_drifted_columns": 0, "share_missing_values": 0.5}
+    )
+
+    assert fake_db.tables["evidently_metrics"]["columns"] == [
+        "timestamp",
+        "num_drifted_columns",
+        "share_missing_values",
+    ]
+    assert fake_db.num_rows("evidently_metrics") == 2
+    # one transaction per logged row
+    assert fake_db.num_commits == 2
+
+
+def test_log_evidently_metrics_caches_table_schema(monkeypatch):
+    fake_db = FakeDatabase(latency_ms=0)
+    monkeypatch.setattr(db, "_pool", fake_db)
+    monkeypatch.setattr(log_evidently_metrics, "_evidently_table_columns", None)
+    monkeypatch.setattr(metrics_rollup, "_rollup_columns", None)
+    metrics = {"num_drifted_columns": 1}
+
+    # schema lookup, create table, index and insert, then create, alter and upsert
+    # of the two rollup tables
+    log_evidently_metrics.log_evidently_metrics(metrics)
+    assert fake_db.num_queries == 10
+    # only the insert and the rollup upserts
+    log_evidently_metrics.log_evidently_metrics(metrics)
+    assert fake_db.num_queries == 13
+
+    # the table is dropped behind the cache's back, the failed insert reloads it
+    fake_db.tables.pop("evidently_metrics")
+    log_evidently_metrics.log_evidently_metrics(metrics)
+    assert fake_db.num_rows("evidently_metrics") == 1
+
+
+class StubConnection:
+    """just enough of a psycopg2 connection for the pool"""
+
+    def __init__(self, queries, fail_next_query=False):
+        self.queries = queries
+        self.fail_next_query = fail_next_query
+        self.closed = 0
+        self.num_commits = 0
+        self.info = type("info", (), {"transaction_status": 0})()
+
+    def cursor(self):
+        conn = self
+
+        class StubCursor:
+            """cursor of the stub connection, its query fails if fail_next_query is set"""
+
+            description = None
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *_):
+                pass
+
+            def execute(self, q, q_args=None):  # pylint: disable=unused-argument
+                if conn.fail_next_query:
+                    conn.closed = 2
+                    raise psycopg2.OperationalError("server closed the connection")
+                conn.queries.append(q)
+
+        return StubCursor()
+
+    def commit(self):
+        self.num_commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture(name="stub_pool")
+def fixture_stub_pool(monkeypatch):
+    queries, connections = [], []
+
+    def connect(*_, **__):
+        # the first connection is dropped by the "server" on its first query
+        conn = StubConnection(queries, fail_next_query=len(connections) == 0)
+        connections.append(conn)
+        return conn
+
+    monkeypatch.setattr(psycopg2, "connect", connect)
+    pool = db.ConnectionPool("dsn", min_size=1, max_size=2, timeout=0.1)
+    monkeypatch.setattr(db, "_pool", pool)
+    monkeypatch.setattr(db, "_breaker", CircuitBreaker())
+    return pool, queries, connections
+
+
+def test_run_query_replaces_broken_connection(stub_pool):
+    _, queries, connections = stub_pool
+
+    db.run_query("SELECT 1")
+    assert queries == ["SELECT 1"]
+    assert len(connections) == 2 and connections[0].closed
+
+    # queries in a transaction share a connection and a commit
+    with db.transaction():
+        db.run_query("SELECT 2")
+        db.run_query("SELECT 3")
+    assert queries == ["SELECT 1", "SELECT 2", "SELECT 3"]
+    assert connections[1].num_commits == 2
+
+
+def test_connection_pool_timeout(stub_pool):
+    pool, _, _ = stub_pool
+    with pool.connection(), pool.connection():
+        with pytest.raises(db.PoolTimeoutError):
+            with pool.connection():
+                pass
+
+
+class FakeClock:
+    """clock of the circuit breaker which only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_circuit_breaker_opens_and_probes():
+    clock = FakeClock()
+    breaker = CircuitBreaker(
+        failure_threshold=2, reset_timeout=10, latency_budget=1, clock=clock
+    )
+
+    # a success resets the count, failures and slow calls have to be in a row
+    breaker.record(0.1, failed=True)
+    breaker.record(0.1)
+    breaker.record(0.1, failed=True)
+    assert breaker.allow() and not breaker.is_open
+    breaker.record(5)
+    assert breaker.is_open and not breaker.allow()
+
+    # a single probe after reset_timeout, its failure opens the circuit again
+    clock.now = 10
+    assert not breaker.is_open
+    assert breaker.allow()
+    assert not breaker.allow() and breaker.is_open
+    breaker.record(0.1, failed=True)
+    assert not breaker.allow()
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.record(0.1)
+    assert breaker.allow() and breaker.allow()
+    assert breaker.num_opened == 2
+
+
+def test_transaction_skips_database_while_circuit_is_open(monkeypatch):
+    class DownPool:
+        """pool of a database which is down"""
+
+        num_connections = 0
+
+        def connection(self):
+            self.num_connections += 1
+            raise db.PoolTimeoutError("no free database connection")
+
+    clock = FakeClock()
+    pool = DownPool()
+    monkeypatch.setattr(db, "_pool", pool)
+    monkeypatch.setattr(
+        db, "_breaker", CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    )
+
+    for _ in range(2):
+        with pytest.raises(db.PoolTimeoutError):
+            run_query("SELECT 1")
+    assert db.is_circuit_open()
+    with pytest.raises(CircuitOpenError):
+        run_query("SELECT 1")
+    assert pool.num_connections == 2
+
+    # the probe reaches the recovered database and closes the circuit
+    clock.now = 10
+    fake_db = FakeDatabase(latency_ms=0)
+    monkeypatch.setattr(db, "_pool", fake_db)
+    with db.transaction():
+        run_query("drop TABLE if exists predictions;")
+        run_query("drop TABLE if exists model_comparison;")
+    assert not db.is_circuit_open()
+    assert fake_db.num_queries == 2
+
+
+def test_metrics_buffer_flushes_on_size_and_stop():
+    batches = []
+    buffer = MetricsBuffer(batches.append, max_rows=3, flush_interval=60)
+    buffer.start()
+
+    for i in range(3):
+        assert buffer.add(i)
+    deadline = time.time() + 5
+    while len(batches) == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert batches == [[0, 1, 2]]
+
+    assert buffer.add(3)
+    buffer.stop(timeout=5)
+    assert batches == [[0, 1, 2], [3]]
+    assert buffer.num_written == 4
+    # rows added after stop are dropped
+    assert not buffer.add(4)
+
+
+def test_log_evidently_metrics_batch_with_fake_db(monkeypatch):
+    fake_db = FakeDatabase(latency_ms=0)
+    monkeypatch.setattr(db, "_pool", fake_db)
+    monkeypatch.setattr(log_evidently_metrics, "_evidently_table_columns", None)
+    monkeypatch.setattr(metrics_rollup, "_rollup_columns", None)
+    timestamp = log_evidently_metrics.get_timestamp()
+
+    log_evidently_metrics.log_evidently_metrics_batch(
+        [
+            (timestamp, {"num_drifted_columns": 1}),
+            (timestamp, {"num_drifted_columns": 0}),
+            (timestamp, {"num_drifted_columns": 2, "share_missing_values": 0.5}),
+        ]
+    )
+
+    # schema lookup, create table, index, one insert for all the rows and the rollups
+    assert fake_db.num_queries == 10
+    assert fake_db.num_rows("evidently_metrics") == 3
+    assert "share_missing_values" in fake_db.tables["evidently_metrics"]["columns"]
+    # the rows share a minute and an hour
+    assert fake_db.num_rows("evidently_metrics_1m") == 1
+    assert (
+        "share_missing_values__max" in fake_db.tables["evidently_metrics_1h"]["columns"]
+    )
+
+
+def test_metrics_rollup_aggregates_rows():
+    start = datetime.datetime(2024, 1, 1, 10, 0)
+    rows = [
+        (start, {"drift": 0.2, "window_start": start}),
+        (
+            start + datetime.timedelta(seconds=30),
+            {"drift": 0.4, "num_drifted_columns": 1},
+        ),
+        (start + datetime.timedelta(minutes=1), {"drift": 0.9}),
+    ]
+
+    columns = metrics_rollup.get_metric_columns(rows)
+    assert columns == ["drift", "num_drifted_columns"]
+
+    minutes = metrics_rollup.aggregate_rows(rows, columns, "1m")
+    assert minutes[start]["drift"] == [pytest.approx(0.3), 0.4, 2]
+    assert minutes[start]["num_drifted_columns"] == [1.0, 1, 1]
+    assert "num_drifted_columns" not in minutes[start + datetime.timedelta(minutes=1)]
+
+    hours = metrics_rollup.aggregate_rows(rows, columns, "1h")
+    assert hours[start]["drift"] == [pytest.approx(0.5), 0.9, 3]
+
+    # aware timestamps are bucketed by the utc hour
+    local_rows = [(TIMEZONE.localize(timestamp), metrics) for timestamp, metrics in rows]
+    local_hours = metrics_rollup.aggregate_rows(local_rows, columns, "1h")
+    assert list(local_hours) == [datetime.datetime(2024, 1, 1, 4, 0)]
+
+
+def test_drift_window_closes_on_rows():
+    window = DriftWindow(num_cols=2, max_rows=5, window_seconds=60, min_rows=2)
+    X = np.arange(8, dtype=np.float64).reshape(4, 2)
+
+    assert window.add(X, np.array([0, 1, 0, 1])) is None
+    closed = window.add(X[:2] + 100, np.array([1, 1]))
+    assert closed is not None
+    assert closed.num_seen == 6
+    # the ring buffer keeps the latest 5 rows, oldest first
+    assert np.array_equal(closed.X, np.vstack([X[1:], X[:2] + 100]))
+    assert np.array_equal(closed.y_pred, [1, 0, 1, 1, 1])
+    assert closed.y_pred.dtype == np.int64
+    assert window.num_rows == 0
+
+
+def test_drift_window_closes_on_time_with_min_rows():
+    now = [0.0]
+    window = DriftWindow(
+        num_cols=1, max_rows=100, window_seconds=10, min_rows=3, clock=lambda: now[0]
+    )
+
+    window.add(np.zeros((1, 1)), np.zeros(1))
+    now[0] = 20.0
+    # window_seconds passed but it has less than min_rows
+    assert window.add(np.zeros((1, 1)), np.zeros(1)) is None
+    assert window.close() is None
+
+    now[0] = 21.0
+    # it got min_rows after it was due, so it ends then, on the next tick
+    assert window.add(np.zeros((1, 1)), np.zeros(1)) is None
+    now[0] = 22.0
+    closed = window.tick()
+    assert len(closed.X) == 3
+    assert (closed.end - closed.start).total_seconds() == 21.0
+
+    assert closed.sampling_rate == 1.0
+
+
+def test_drift_window_closes_at_its_end_without_traffic():
+    now = [0.0]
+    window = DriftWindow(
+        num_cols=1, max_rows=100, window_seconds=10, min_rows=1, clock=lambda: now[0]
+    )
+    window.add(np.zeros((1, 1)), np.zeros(1))
+    now[0] = 5.0
+    assert window.tick() is None
+
+    # the traffic stopped, the tick closes it at the window's end
+    now[0] = 12.0
+    closed = window.tick()
+    assert (closed.end - closed.start).total_seconds() == 10.0
+    assert window.tick() is None
+
+    # a late request closes the due window without its rows, which open the next one
+    window.add(np.zeros((1, 1)), np.zeros(1))
+    now[0] = 40.0
+    closed = window.add(np.ones((2, 1)), np.ones(2))
+    assert len(closed.X) == 1
+    assert (closed.end - closed.start).total_seconds() == 10.0
+    assert window.num_rows == 2
+
+
+def test_drift_window_sampling_rate():
+    window = DriftWindow(num_cols=1, max_rows=100, window_seconds=60, min_rows=1)
+    window.add(np.zeros((1, 1)), np.zeros(1), sampling_rate=0.5)
+    window.add(np.zeros((1, 1)), np.zeros(1), sampling_rate=0.25)
+    # 2 requests standing for 2 + 4
+    assert window.close().sampling_rate == pytest.approx(2 / 6)
+
+
+def test_fixed_rate_sampler():
+    sampler = FixedRateSampler(0.2, seed=0)
+    sampled = [s for i in range(10000) for s in sampler.sample(i)]
+    assert len(sampled) == pytest.approx(2000, rel=0.1)
+    assert all(rate == 0.2 for _, rate in sampled)
+
+    with pytest.raises(ValueError):
+        FixedRateSampler(0.0)
+
+
+def test_reservoir_sampler_releases_per_window():
+    now = [0.0]
+    sampler = ReservoirSampler(size=10, window_seconds=10, seed=0, clock=lambda: now[0])
+
+    assert not any(sampler.sample(i) for i in range(100))
+    now[0] = 10.0
+    # released by the first request after the window ended
+    sampled = sampler.sample(100)
+    assert len(sampled) == 10
+    assert len({item for item, _ in sampled}) == 10
+    assert all(item < 100 and rate == 0.1 for item, rate in sampled)
+
+    # a window with fewer requests than the reservoir keeps all of them
+    assert sampler.flush() == [(100, 1.0)]
+    assert sampler.flush() == []
+
+
+def test_budget_sampler_adjusts_rate():
+    now = [0.0]
+    sampler = BudgetSampler(cpu_budget=0.1, interval=10, clock=lambda: now[0])
+
+    # 4s of cpu in 10s is 4x the budget, it can at most halve per interval
+    sampler.record_cost(4.0)
+    now[0] = 10.0
+    sampler.record_cost(0.0)
+    assert sampler.rate == 0.5
+
+    # 0.5s in 10s is half the budget
+    sampler.record_cost(0.5)
+    now[0] = 20.0
+    sampler.record_cost(0.0)
+    assert sampler.rate == 1.0
+
+    sampler.rate = 0.001
+    now[0] = 30.0
+    # no monitoring jobs ran, the rate recovers on the next request
+    sampler.sample(0)
+    assert sampler.rate == 0.002
+
+
+def get_prediction_batch(day: int, hour: int = 0, numeric_cols=None) -> PredictionBatch:
+    numeric_cols = numeric_cols or ["Temperature[C]", "Humidity[%]"]
+    return PredictionBatch(
+        timestamp=pytz.utc.localize(datetime.datetime(2024, 1, day, hour)),
+        model="v1",
+        numeric_cols=numeric_cols,
+        X=np.ones((3, len(numeric_cols))),
+        y_pred=np.array([0, 1, 1]),
+    )
+
+
+def test_prediction_log_postgres_with_fake_db(monkeypatch):
+    fake_db = FakeDatabase(latency_ms=0)
+    monkeypatch.setattr(db, "_pool", fake_db)
+    sink = PostgresSink(retention_days=2)
+
+    sink.write([get_prediction_batch(1), get_prediction_batch(2)])
+    assert fake_db.num_rows("predictions") == 6
+    assert get_partition_days() == [datetime.date(2024, 1, 1), datetime.date(2024, 1, 2)]
+
+    # the cached partitions aren't created again
+    num_queries = fake_db.num_queries
+    sink.write([get_prediction_batch(2)])
+    assert fake_db.num_queries == num_queries + 1
+
+    # a new day drops the partitions older than retention_days
+    sink.write([get_prediction_batch(4)])
+    assert get_partition_days() == [datetime.date(2024, 1, 2), datetime.date(2024, 1, 4)]
+
+    # recreated if the table was dropped underneath
+    run_query("drop TABLE if exists predictions;")
+    sink.write([get_prediction_batch(4)])
+    assert fake_db.num_rows("predictions") == 3
+
+
+def test_prediction_log_parquet(tmp_path):
+    sink = ParquetSink(tmp_path, retention_days=0)
+    sink.write([get_prediction_batch(1, hour=10), get_prediction_batch(1, hour=11)])
+    sink.write([get_prediction_batch(1, hour=11, numeric_cols=["eCO2[ppm]"])])
+    sink.close()
+
+    files = sorted(path.name.split("-")[0] for path in tmp_path.glob("date=*/*.parquet"))
+    assert files == ["10", "11"]
+    df = pd.read_parquet(tmp_path)
+    assert len(df) == 9
+    assert df["temperature"].isna().sum() == 3
+    assert df["eco2_ppm"].isna().sum() == 6
+    assert sorted(df["prediction"].unique()) == [0.0, 1.0]
+
+
+@pytest.mark.parametrize("num_reference_rows", [500, 5000])
+@pytest.mark.parametrize("shift", [0.0, 0.3])
+def test_native_drift_matches_evidently(num_reference_rows, shift):
+    numeric_cols = ["Temperature[C]", "Humidity[%]", "eCO2[ppm]"]
+    model = Model(numeric_cols=numeric_cols, target="Fire Alarm")
+    rng = np.random.default_rng(0)
+
+    def make_df(num_rows, shift):
+        X = np.column_stack(
+            [
+                rng.normal(20 + shift * 10, 5, num_rows),
+                rng.uniform(10 + shift * 30, 80, num_rows),
+                rng.lognormal(6 + shift, 1, num_rows),
+            ]
+        )
+        df = pd.DataFrame(X, columns=numeric_cols)
+        df["prediction"] = (rng.random(num_rows) < 0.7 + shift / 2).astype(int)
+        return df
+
+    reference_df = make_df(num_reference_rows, 0.0)
+    current_df = make_df(300, shift)
+
+    evidently_metrics = calculate_metrics(reference_df, current_df.copy(), model)
+    profile = ReferenceProfile(reference_df, [*numeric_cols, "prediction"])
+    native_metrics = calculate_native_metrics(
+        profile,
+        current_df[numeric_cols].to_numpy(),
+        current_df["prediction"].to_numpy(),
+        numeric_cols,
+    )
+
+    assert native_metrics.keys() == evidently_metrics.keys()
+    for key, value in evidently_metrics.items():
+        assert native_metrics[key] == pytest.approx(value, rel=0.05, abs=0.02), key
+
+
+def test_native_drift_unseen_category():
+    reference_df = pd.DataFrame({"a": np.tile([0.0, 1.0, 2.0], 100)})
+    profile = ReferenceProfile(reference_df, ["a"])
+    current = np.array([[0.0], [1.0], [2.0], [3.0], [3.0], [3.0]])
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        p_value, drifted = category_drift(profile, 0, current[:, 0])
+    assert np.isfinite(p_value) and drifted
+    # no smoothing when the reference has all the categories
+    p_value, drifted = category_drift(profile, 0, current[:3, 0])
+    assert p_value == pytest.approx(1.0) and not drifted
+
+
+def test_get_buckets():
+    start = datetime.datetime(2024, 1, 1)
+    buckets = get_buckets(start, start + datetime.timedelta(minutes=150), 3600)
+    assert [(end - start).total_seconds() for start, end in buckets] == [3600, 3600, 1800]
+
+
+def test_drift_backfill_file_buckets(tmp_path):
+    numeric_cols = ["Temperature[C]", "Humidity[%]"]
+    rng = np.random.default_rng(0)
+    # 3 hours of unix timestamps(like the dataset's UTC column), time ordered
+    df = pd.DataFrame(
+        {
+            "UTC": 1717200000 + np.arange(0, 3 * 3600, 30),
+            "temperature": rng.normal(20, 5, 360),
+            "humidity": rng.uniform(10, 80, 360),
+            "prediction": rng.integers(0, 2, 360),
+        }
+    )
+    df.loc[0, "humidity"] = np.nan
+    df.to_csv(tmp_path / "predictions.csv", index=False)
+
+    buckets = list(
+        iter_file_buckets(
+            tmp_path / "predictions.csv", 3600, chunksize=50, timestamp_col="UTC"
+        )
+    )
+    assert [len(rows) for _, rows in buckets] == [120, 120, 120]
+    assert buckets[0][0][0] == datetime.datetime(2024, 6, 1, 0, 0)
+
+    model = Model(numeric_cols=numeric_cols, target="Fire Alarm")
+    reference_df = df.rename(columns={"temperature": numeric_cols[0]})
+    reference_df = reference_df.rename(columns={"humidity": numeric_cols[1]}).dropna()
+    profile = ReferenceProfile(reference_df, [*numeric_cols, "prediction"])
+
+    bucket, rows = buckets[0]
+    timestamp, metrics = calculate_bucket_metrics(
+        rows, bucket, model, profile, min_rows=100
+    )
+    # the row with a NULL feature is skipped
+    assert metrics["window_rows"] == 119
+    assert timestamp == metrics["window_end"]
+    assert "temperature__column_drift" in metrics
+    assert calculate_bucket_metrics(rows, bucket, model, profile, min_rows=200) is None
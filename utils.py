@@ -1,4 +1,5 @@
 import os
+import weakref
 
 
 def getenv(key: str, default_value: str) -> str:
@@ -8,3 +9,18 @@ def getenv(key: str, default_value: str) -> str:
     if value is None:
         value = default_value
     return value
+
+
+def register_after_fork(method):
+    """
+    call `method` in the child process after a fork(e.g. gunicorn workers), it is
+    held through a weak reference so the owning object can still be garbage collected.
+    """
+    method_ref = weakref.WeakMethod(method)
+
+    def after_fork():
+        bound_method = method_ref()
+        if bound_method is not None:
+            bound_method()
+
+    os.register_at_fork(after_in_child=after_fork)